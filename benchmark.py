@@ -0,0 +1,766 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from database_manager import DatabaseManager
+from custom_index_calculator import CustomIndexCalculator, calculate_index_for_date_range
+from data_fetcher import DataFetcher, FakeDataProvider
+from index_engine import IndexEngine, WEIGHTING_SCHEMES
+from exports import export_to_csv, export_to_excel, export_to_parquet, export_to_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def _synthetic_blocks(n_tickers, n_days, start_date, seed, chunk_days):
+    # Yield (dates, prices, market_caps) blocks of up to chunk_days rows of the synthetic market.
+    # Returns are drawn block by block from one generator, which yields the same stream as a
+    # single draw, so the market does not depend on chunk_days.
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range(start=start_date, periods=n_days).strftime('%Y-%m-%d')
+    start_prices = rng.uniform(10, 500, size=n_tickers)
+    shares = rng.uniform(1e7, 1e10, size=n_tickers)
+    walk = np.zeros(n_tickers)
+    for start in range(0, n_days, chunk_days):
+        log_returns = rng.normal(0.0, 0.02, size=(min(chunk_days, n_days - start), n_tickers))
+        cumulative = walk + np.cumsum(log_returns, axis=0)
+        walk = cumulative[-1]
+        prices = start_prices * np.exp(cumulative)
+        yield dates[start:start + len(prices)], prices, prices * shares
+
+
+def _synthetic_tickers(n_tickers):
+    return np.array([f"SYN{i:05d}" for i in range(n_tickers)])
+
+
+def generate_synthetic_matrices(n_tickers, n_days, start_date="2015-01-01", seed=42):
+    """
+    Generate a deterministic synthetic market of n_tickers x n_days business days as matrices.
+    Prices follow a geometric random walk and market caps are price times a fixed
+    per-ticker share count, so rankings change from day to day.
+    :return: Tuple (prices, market_caps) of DataFrames indexed by date string, one column per ticker.
+    """
+    blocks = list(_synthetic_blocks(n_tickers, n_days, start_date, seed, chunk_days=max(n_days, 1)))
+    tickers = _synthetic_tickers(n_tickers)
+    dates = np.concatenate([block[0] for block in blocks]) if blocks else np.array([], dtype=object)
+    prices = np.vstack([block[1] for block in blocks]) if blocks else np.empty((0, n_tickers))
+    market_caps = np.vstack([block[2] for block in blocks]) if blocks else np.empty((0, n_tickers))
+    return (pd.DataFrame(prices, index=dates, columns=tickers),
+            pd.DataFrame(market_caps, index=dates, columns=tickers))
+
+
+def iter_synthetic_market(n_tickers, n_days, start_date="2015-01-01", seed=42, chunk_days=250):
+    """
+    Generate the synthetic market of generate_synthetic_matrices in long form, chunk_days at a time,
+    so markets of 10k tickers x 5k days can be loaded without holding every row in memory.
+    :return: Iterator of DataFrames with columns date, ticker, closing_price, market_cap.
+    """
+    tickers = _synthetic_tickers(n_tickers)
+    for dates, prices, market_caps in _synthetic_blocks(n_tickers, n_days, start_date, seed, chunk_days):
+        yield pd.DataFrame({
+            'date': np.repeat(np.asarray(dates), n_tickers),
+            'ticker': np.tile(tickers, len(dates)),
+            'closing_price': prices.ravel(),
+            'market_cap': market_caps.ravel(),
+        })
+
+
+def generate_synthetic_market(n_tickers, n_days, start_date="2015-01-01", seed=42):
+    """
+    Generate the synthetic market of generate_synthetic_matrices in long form.
+    :return: pandas DataFrame with columns date, ticker, closing_price, market_cap.
+    """
+    chunks = list(iter_synthetic_market(n_tickers, n_days, start_date=start_date, seed=seed))
+    if not chunks:
+        return pd.DataFrame({'date': pd.Series(dtype=object), 'ticker': pd.Series(dtype=object),
+                             'closing_price': pd.Series(dtype=float), 'market_cap': pd.Series(dtype=float)})
+    return pd.concat(chunks, ignore_index=True)
+
+
+def load_synthetic_market(db_manager, market_df):
+    """
+    Load a synthetic market DataFrame into the daily_data table of db_manager.
+    """
+    return db_manager.insert_daily_data_bulk(market_df)
+
+
+def _per_day_index_history(db_manager, start_date, end_date):
+    # Reference implementation: one query per business day.
+    calc = CustomIndexCalculator(db_manager)
+    dates = pd.bdate_range(start=start_date, end=end_date).strftime('%Y-%m-%d')
+    return pd.DataFrame({'date': list(dates),
+                         'index_value': [calc.calculate_index_value(d) for d in dates]})
+
+
+def benchmark_index_history(sizes, n_tickers=200, include_per_day=True):
+    """
+    Time the single-pass index history against the per-day loop for each number of days
+    in sizes and check that both produce the same values.
+    :param sizes: Iterable of day counts to benchmark.
+    :return: pandas DataFrame with one row per size.
+    """
+    results = []
+    for n_days in sizes:
+        market_df = generate_synthetic_market(n_tickers, n_days)
+        db_manager = DatabaseManager()
+        load_synthetic_market(db_manager, market_df)
+        start_date, end_date = market_df['date'].iloc[0], market_df['date'].iloc[-1]
+
+        started = time.perf_counter()
+        ranged = calculate_index_for_date_range(db_manager, start_date, end_date)
+        range_seconds = time.perf_counter() - started
+        row = {'days': n_days, 'rows': len(market_df), 'range_seconds': range_seconds,
+               'range_rows_per_sec': len(market_df) / range_seconds}
+
+        if include_per_day:
+            started = time.perf_counter()
+            per_day = _per_day_index_history(db_manager, start_date, end_date)
+            row['per_day_seconds'] = time.perf_counter() - started
+            row['speedup'] = row['per_day_seconds'] / range_seconds
+            row['max_abs_diff'] = float(np.nanmax(np.abs(
+                ranged['index_value'].to_numpy(dtype=float) - per_day['index_value'].to_numpy(dtype=float))))
+        db_manager.close()
+        results.append(row)
+        logger.info(f"Benchmarked index history: {row}")
+    return pd.DataFrame(results)
+
+
+def benchmark_bulk_insert(db_path, n_tickers=200, n_days=730, include_per_row=False):
+    """
+    Time a historical load of n_tickers x n_days rows through the bulk loader, and
+    optionally through the per-row insert_daily_data path, into a fresh database file.
+    :return: dict with the timings and rows per second of each path.
+    """
+    market_df = generate_synthetic_market(n_tickers, n_days)
+    result = {'rows': len(market_df)}
+    for suffix in ("-wal", "-shm", ""):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    db_manager = DatabaseManager(db_path=db_path, wal=True, synchronous="NORMAL")
+    stats = db_manager.insert_daily_data_bulk(market_df)
+    result['bulk_seconds'] = stats['seconds']
+    result['bulk_rows_per_sec'] = stats['rows_per_sec']
+    if include_per_row:
+        started = time.perf_counter()
+        for row in market_df.itertuples(index=False):
+            db_manager.insert_daily_data(row.date, row.ticker, row.closing_price, row.market_cap)
+        result['per_row_seconds'] = time.perf_counter() - started
+        result['per_row_rows_per_sec'] = len(market_df) / result['per_row_seconds']
+    db_manager.close()
+    logger.info(f"Benchmarked bulk insert: {result}")
+    return result
+
+
+def benchmark_fetch(n_tickers=200, latency=0.05, chunk_size=50, max_workers=4, requests_per_second=20.0):
+    """
+    Time fetching n_tickers from the fake provider with a simulated per-request latency,
+    one ticker at a time versus in concurrent chunks.
+    :return: dict with the wall time of each mode.
+    """
+    tickers = [f"SYN{i:05d}" for i in range(n_tickers)]
+    result = {'tickers': n_tickers, 'latency': latency}
+    for mode, size, workers in (("serial", 1, 1), ("chunked", chunk_size, max_workers)):
+        fetcher = DataFetcher(tickers=tickers, provider=FakeDataProvider(latency=latency), chunk_size=size,
+                              max_workers=workers, requests_per_second=requests_per_second)
+        started = time.perf_counter()
+        fetcher.fetch_data("2023-01-02", "2023-03-01")
+        result[f'{mode}_seconds'] = time.perf_counter() - started
+    logger.info(f"Benchmarked fetch: {result}")
+    return result
+
+
+def benchmark_index_engine(n_tickers=3000, n_days=7500, top_n=500, rebalances=("D", "M")):
+    """
+    Time the vectorized index engine for every weighting scheme and rebalance frequency on a
+    synthetic market of n_tickers x n_days (7500 business days is about 30 years).
+    :return: pandas DataFrame with one row per scheme and frequency.
+    """
+    prices, market_caps = generate_synthetic_matrices(n_tickers, n_days, start_date="1995-01-02")
+    results = []
+    for weighting in WEIGHTING_SCHEMES:
+        for rebalance in rebalances:
+            engine = IndexEngine(top_n=top_n, weighting=weighting, rebalance=rebalance)
+            started = time.perf_counter()
+            engine.compute(prices, market_caps)
+            results.append({'weighting': weighting, 'rebalance': rebalance, 'tickers': n_tickers,
+                            'days': n_days, 'seconds': time.perf_counter() - started})
+    logger.info(f"Benchmarked index engine: {results}")
+    return pd.DataFrame(results)
+
+
+def benchmark_index_sweep(n_tickers=1000, n_days=2500, processes=(1, 4)):
+    """
+    Time a 100-variant study (top 25 to 200, daily to quarterly rebalancing, five weighting
+    schemes) on one synthetic market: one IndexEngine run per variant against index_sweep.run_sweep
+    in this process and in process pools of the given sizes.
+    :return: pandas DataFrame with one row per method.
+    """
+    from index_engine import CappedMarketCapWeight
+    from index_sweep import run_sweep, sweep_configs
+
+    prices, market_caps = generate_synthetic_matrices(n_tickers, n_days, start_date="2010-01-01")
+    configs = sweep_configs(top_ns=(25, 50, 100, 150, 200), rebalances=('D', 'W', 'M', 'Q'),
+                            weightings=('equal', 'market_cap', CappedMarketCapWeight(0.05),
+                                        CappedMarketCapWeight(0.1), CappedMarketCapWeight(0.2)))
+    started = time.perf_counter()
+    for config in configs:
+        IndexEngine(top_n=config.top_n, weighting=config.weighting, rebalance=config.rebalance).compute(
+            prices, market_caps)
+    results = [{'method': 'engine_per_variant', 'variants': len(configs), 'seconds': time.perf_counter() - started}]
+    for workers in processes:
+        started = time.perf_counter()
+        run_sweep(prices, market_caps, configs, processes=workers)
+        results.append({'method': f'sweep_{workers}_process{"es" if workers > 1 else ""}', 'variants': len(configs),
+                        'seconds': time.perf_counter() - started})
+    logger.info(f"Benchmarked index sweep: {results}")
+    return pd.DataFrame(results)
+
+
+def _synthetic_composition_chunks(n_rows, chunk_rows, top_n=100):
+    # Composition rows (date, rank, ticker, closing_price, market_cap) generated chunk by chunk.
+    rng = np.random.default_rng(7)
+    for start in range(0, n_rows, chunk_rows):
+        position = np.arange(start, min(start + chunk_rows, n_rows))
+        yield pd.DataFrame({
+            'date': (pd.Timestamp("2000-01-03") + pd.to_timedelta(position // top_n, unit='D')).strftime('%Y-%m-%d'),
+            'rank': position % top_n + 1,
+            'ticker': np.char.add("SYN", (position % 997).astype(str)),
+            'closing_price': rng.uniform(10, 500, size=len(position)),
+            'market_cap': rng.uniform(1e9, 1e12, size=len(position)),
+        })
+
+
+def benchmark_exports(sizes=(20_000, 100_000), chunk_rows=10_000, formats=("csv", "parquet", "xlsx", "pdf")):
+    """
+    Time each streaming exporter on synthetic composition histories of increasing row counts and
+    record the peak traced memory, which should stay flat as the row count grows.
+    :return: pandas DataFrame with one row per format and size.
+    """
+    exporters = {'csv': export_to_csv, 'parquet': export_to_parquet, 'xlsx': export_to_excel, 'pdf': export_to_pdf}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for fmt in formats:
+            for n_rows in sizes:
+                path = os.path.join(tmp_dir, f"composition.{fmt}")
+                started = time.perf_counter()
+                exporters[fmt](_synthetic_composition_chunks(n_rows, chunk_rows), path)
+                seconds = time.perf_counter() - started
+                # A second run under tracemalloc, so tracing overhead does not distort the timing.
+                tracemalloc.start()
+                exporters[fmt](_synthetic_composition_chunks(n_rows, chunk_rows), path)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                results.append({'format': fmt, 'rows': n_rows, 'seconds': seconds,
+                                'rows_per_sec': n_rows / seconds, 'peak_mib': peak / 2 ** 20,
+                                'file_mib': os.path.getsize(path) / 2 ** 20})
+    logger.info(f"Benchmarked exports: {results}")
+    return pd.DataFrame(results)
+
+
+def benchmark_streaming_ingestion(sizes=(250, 1000, 4000), n_days=365):
+    """
+    Run the streaming ingestion pipeline with the offline provider for growing ticker universes
+    and record the wall time and peak traced memory, which should stay flat as the universe grows.
+    :return: pandas DataFrame with one row per universe size.
+    """
+    from data_ingestion import run_data_ingestion
+
+    results = []
+    options = {'requests_per_second': 1000.0}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_tickers in sizes:
+            tickers = _synthetic_tickers(n_tickers)
+            started = time.perf_counter()
+            summary = run_data_ingestion(backfill_days=n_days, provider=FakeDataProvider(), universe=tickers,
+                                         db_path=os.path.join(tmp_dir, f"timed_{n_tickers}.db"),
+                                         fetcher_options=options)
+            seconds = time.perf_counter() - started
+            # A second run under tracemalloc, so tracing overhead does not distort the timing.
+            tracemalloc.start()
+            run_data_ingestion(backfill_days=n_days, provider=FakeDataProvider(), universe=tickers,
+                               db_path=os.path.join(tmp_dir, f"traced_{n_tickers}.db"), fetcher_options=options)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows = summary['counters']['rows_written_total{table="daily_data"}']
+            results.append({'tickers': n_tickers, 'rows': rows, 'seconds': seconds,
+                            'rows_per_sec': rows / seconds, 'peak_mib': peak / 2 ** 20})
+    logger.info(f"Benchmarked streaming ingestion: {results}")
+    return pd.DataFrame(results)
+
+
+def benchmark_index_service(n_tickers=500, n_days=500, clients=8, requests_per_client=200, pool_size=4,
+                            cache_sizes=(0, 256), distinct_queries=50):
+    """
+    Serve a synthetic market with index_service and measure request latency under concurrent
+    keep-alive clients, with the response cache disabled and enabled.
+    Each client cycles through distinct_queries random /index and /constituents requests.
+    :return: pandas DataFrame with the p50, p95 and p99 latency in milliseconds and the
+             throughput per cache size.
+    """
+    import http.client
+    import threading
+    from index_service import IndexService
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "service.db")
+        db_manager = DatabaseManager(db_path=db_path, wal=True)
+        market_df = generate_synthetic_market(n_tickers, n_days)
+        load_synthetic_market(db_manager, market_df)
+        db_manager.refresh_index_tables()
+        db_manager.close()
+        dates = sorted(market_df['date'].unique())
+        rng = np.random.default_rng(0)
+        paths = []
+        for _ in range(distinct_queries):
+            start, end = sorted(rng.choice(len(dates), 2, replace=False))
+            paths.append(f"/index?start={dates[start]}&end={dates[end]}")
+            paths.append(f"/constituents?date={dates[rng.integers(len(dates))]}")
+
+        for cache_size in cache_sizes:
+            service = IndexService(db_path, pool_size=pool_size, cache_size=cache_size)
+            server = service.make_server(port=0)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            latencies = [[] for _ in range(clients)]
+
+            def run_client(client_id):
+                conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+                for i in range(requests_per_client):
+                    started = time.perf_counter()
+                    conn.request("GET", paths[(client_id * 7 + i) % len(paths)])
+                    response = conn.getresponse()
+                    response.read()
+                    latencies[client_id].append(time.perf_counter() - started)
+                conn.close()
+
+            started = time.perf_counter()
+            threads = [threading.Thread(target=run_client, args=(i,)) for i in range(clients)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            seconds = time.perf_counter() - started
+            server.shutdown()
+            server.server_close()
+            service.close()
+            all_latencies = np.concatenate([np.asarray(values) for values in latencies]) * 1000
+            results.append({'cache_size': cache_size, 'requests': len(all_latencies),
+                            'p50_ms': np.percentile(all_latencies, 50), 'p95_ms': np.percentile(all_latencies, 95),
+                            'p99_ms': np.percentile(all_latencies, 99), 'requests_per_sec': len(all_latencies) / seconds})
+    logger.info(f"Benchmarked index service: {results}")
+    return pd.DataFrame(results)
+
+
+def benchmark_index_analytics(history_days=(250, 1000, 2500), n_tickers=200, appended_days=5):
+    """
+    Time the running index analytics for growing histories: the first full computation, then
+    one index refresh and analytics update per appended day, and a summary over the whole
+    history. The per-day update should stay flat as the history grows.
+    :return: pandas DataFrame with one row per history length.
+    """
+    from index_analytics import summarize_horizon, update_index_analytics
+
+    results = []
+    for n_days in history_days:
+        market_df = generate_synthetic_market(n_tickers, n_days + appended_days)
+        dates = sorted(market_df['date'].unique())
+        db_manager = DatabaseManager()
+        load_synthetic_market(db_manager, market_df[market_df['date'] <= dates[n_days - 1]])
+        db_manager.refresh_index_tables()
+        started = time.perf_counter()
+        update_index_analytics(db_manager)
+        full_seconds = time.perf_counter() - started
+        update_seconds = []
+        for date in dates[n_days:]:
+            load_synthetic_market(db_manager, market_df[market_df['date'] == date])
+            db_manager.refresh_index_tables()
+            started = time.perf_counter()
+            update_index_analytics(db_manager)
+            update_seconds.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        summarize_horizon(db_manager.query_index_analytics())
+        summary_seconds = time.perf_counter() - started
+        db_manager.close()
+        results.append({'days': n_days, 'full_ms': full_seconds * 1000,
+                        'daily_update_ms': np.median(update_seconds) * 1000, 'summary_ms': summary_seconds * 1000})
+    logger.info(f"Benchmarked index analytics: {results}")
+    return pd.DataFrame(results)
+
+
+# Modules that take a noticeable share of start-up time, reported per command when loaded.
+HEAVY_MODULES = ('pandas', 'numpy', 'pyarrow', 'yfinance', 'openpyxl', 'streamlit')
+
+_STARTUP_PROBE = """
+import sys, cli
+try:
+    cli.main(sys.argv[1:])
+except SystemExit:
+    pass
+print()
+print(' '.join(name for name in {modules!r} if name in sys.modules))
+"""
+
+
+def benchmark_cli_startup(repeats=5):
+    """
+    Measure the cold start of every cli.py command: the wall time of a fresh interpreter running
+    the command against an empty database (the best of repeats runs), and which heavy modules
+    the command imported. ingest runs offline with nothing to fetch and bench only prints its help.
+    :return: pandas DataFrame with one row per command.
+    """
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "startup.db")
+        DatabaseManager(db_path=db_path).close()
+        commands = {
+            'help': ["--help"],
+            'ingest': ["ingest", "--db_path", db_path, "--offline", "--backfill_days", "0"],
+            'compute': ["compute", "--db_path", db_path],
+            'export': ["export", "--db_path", db_path, "--output_dir", tmp_dir],
+            'validate': ["validate", "--db_path", db_path],
+            'bench': ["bench", "--help"],
+        }
+        for command, args in commands.items():
+            seconds = []
+            for _ in range(repeats):
+                started = time.perf_counter()
+                subprocess.run([sys.executable, os.path.join(here, "cli.py")] + args, cwd=tmp_dir,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                seconds.append(time.perf_counter() - started)
+            probe = subprocess.run([sys.executable, "-c", _STARTUP_PROBE.format(modules=HEAVY_MODULES)] + args,
+                                   cwd=tmp_dir, env=dict(os.environ, PYTHONPATH=here), capture_output=True,
+                                   text=True, check=True)
+            results.append({'command': command, 'seconds': min(seconds),
+                            'heavy_modules': probe.stdout.splitlines()[-1]})
+    logger.info(f"Benchmarked CLI start-up: {results}")
+    return pd.DataFrame(results)
+
+
+def benchmark_live_index(n_tickers=3000, quotes=200_000, batch_sizes=(1, 50), top_n=100, resort_quotes=2000):
+    """
+    Measure the quotes per second of the live index on a simulated feed, for each batch size, and
+    with snapshots written in batches to a SQLite file. The reference recomputes the index from
+    every price after each quote, with a NumPy partial sort of all market caps.
+    :return: pandas DataFrame with one row per method.
+    """
+    from live_index import LiveIndex, SnapshotWriter, run_live_index, simulated_quotes
+
+    prices, market_caps = generate_synthetic_matrices(n_tickers, 1)
+    shares = dict(zip(prices.columns, market_caps.iloc[0] / prices.iloc[0]))
+    start = dict(zip(prices.columns, prices.iloc[0]))
+    results = []
+
+    feed = list(simulated_quotes(start, resort_quotes, batch_size=1, seed=1))
+    tickers = {ticker: i for i, ticker in enumerate(prices.columns)}
+    current = prices.iloc[0].to_numpy(dtype=float, copy=True)
+    counts = np.array([shares[ticker] for ticker in prices.columns])
+    started = time.perf_counter()
+    for _, batch in feed:
+        for ticker, price in batch:
+            current[tickers[ticker]] = price
+        top = np.argpartition(-(current * counts), top_n - 1)[:top_n]
+        reference = current[top].mean()
+    seconds = time.perf_counter() - started
+    live_index = LiveIndex(shares, start, top_n=top_n)
+    run_live_index(live_index, iter(feed))
+    results.append({'method': 'resort_per_quote', 'quotes': resort_quotes, 'seconds': seconds,
+                    'quotes_per_sec': resort_quotes / seconds, 'abs_diff': abs(live_index.value - reference)})
+
+    for batch_size in batch_sizes:
+        feed = list(simulated_quotes(start, quotes // batch_size, batch_size=batch_size, seed=2))
+        stats = run_live_index(LiveIndex(shares, start, top_n=top_n), iter(feed))
+        results.append({'method': f'live_index_batch{batch_size}', 'quotes': stats['quotes'],
+                        'seconds': stats['seconds'], 'quotes_per_sec': stats['quotes_per_sec']})
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_manager = DatabaseManager(db_path=os.path.join(tmp_dir, "live.db"))
+        batch_size = batch_sizes[-1]
+        feed = list(simulated_quotes(start, quotes // batch_size, batch_size=batch_size, seed=2))
+        stats = run_live_index(LiveIndex(shares, start, top_n=top_n), iter(feed), SnapshotWriter(db_manager))
+        db_manager.close()
+        results.append({'method': f'live_index_batch{batch_size}_sqlite_snapshots', 'quotes': stats['quotes'],
+                        'seconds': stats['seconds'], 'quotes_per_sec': stats['quotes_per_sec'],
+                        'snapshots': stats['snapshots_written'], 'flushes': stats['flushes']})
+    logger.info(f"Benchmarked live index: {results}")
+    return pd.DataFrame(results)
+
+
+# Reads compared by benchmark_compact_reads, each run in a fresh interpreter.
+COMPACT_READS = {
+    'query_daily_data_range': "result = db.query_daily_data_range(start, end)",
+    'compact': "result = db.query_daily_data_range(start, end, compact=True)",
+    'compact_float32_date_ids': "result = db.query_daily_data_range(start, end, compact=True, float32=True, "
+                                "date_ids=True)",
+    'iter_daily_data': "for result in db.iter_daily_data(start, end): pass",
+    'pivot_matrices': "result = build_market_matrices(db.query_daily_data_range(start, end))",
+    'load_market_matrices': "result = load_market_matrices(db, start, end)",
+}
+
+# Linux only: resets the process's peak resident set (VmHWM) to its current size before the read.
+_READ_PROBE = """
+import sys, time
+import pandas as pd
+from database_manager import DatabaseManager
+from index_engine import build_market_matrices, load_market_matrices
+
+def status_kib(field):
+    with open('/proc/self/status') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith(field + ':'))
+
+db, start, end = DatabaseManager(db_path=sys.argv[1]), sys.argv[2], sys.argv[3]
+with open('/proc/self/clear_refs', 'w') as f:
+    f.write('5')
+baseline = status_kib('VmRSS')
+started = time.perf_counter()
+{read}
+seconds = time.perf_counter() - started
+frames = result if isinstance(result, tuple) else (result,)
+print(seconds, (status_kib('VmHWM') - baseline) / 1024,
+      sum(frame.memory_usage(deep=True).sum() for frame in frames) / 2 ** 20)
+"""
+
+
+def benchmark_compact_reads(n_tickers=2000, n_days=5000, reads=tuple(COMPACT_READS)):
+    """
+    Compare the memory of reading a whole n_tickers x n_days daily table (10M rows by default)
+    through the string-typed query_daily_data_range with the compact typed reads, and of building
+    the index engine matrices by pivot or by load_market_matrices.
+    Each read runs in a fresh interpreter, and its peak is the growth of the process's maximum
+    resident set over the read, so SQLite buffers and fetched row tuples are included (Linux only).
+    :return: pandas DataFrame with seconds, peak_mib and result_mib (deep size of the result, or of
+             the last chunk for iter_daily_data) per read.
+    """
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "compact.db")
+        db_manager = DatabaseManager(db_path=db_path, wal=True, synchronous="NORMAL")
+        for chunk in iter_synthetic_market(n_tickers, n_days):
+            db_manager.insert_daily_data_bulk(chunk)
+        start, end = db_manager.query_date_bounds()
+        db_manager.close()
+        for read in reads:
+            probe = subprocess.run([sys.executable, "-c", _READ_PROBE.format(read=COMPACT_READS[read]),
+                                    db_path, start, end], cwd=tmp_dir, env=dict(os.environ, PYTHONPATH=here),
+                                   capture_output=True, text=True, check=True)
+            seconds, peak_mib, result_mib = map(float, probe.stdout.split())
+            results.append({'read': read, 'rows': n_tickers * n_days, 'seconds': seconds, 'peak_mib': peak_mib,
+                            'result_mib': result_mib})
+    logger.info(f"Benchmarked compact reads: {results}")
+    return pd.DataFrame(results)
+
+
+class _StageTimer:
+    """
+    Context manager that records the wall time and, optionally, the peak traced memory of one
+    benchmark stage into results[name]. Set .rows inside the block to report throughput.
+    """
+    def __init__(self, results, name, track_memory=True):
+        self.results = results
+        self.name = name
+        self.track_memory = track_memory
+        self.rows = None
+
+    def __enter__(self):
+        if self.track_memory:
+            tracemalloc.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.started
+        stage = {'seconds': seconds}
+        if self.track_memory:
+            stage['peak_mib'] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        if self.rows is not None:
+            stage['rows'] = int(self.rows)
+            stage['rows_per_sec'] = self.rows / seconds if seconds > 0 else None
+        if exc_type is None:
+            self.results[self.name] = stage
+            logger.info(f"Stage {self.name}: {stage}")
+
+
+def _run_suite_stages(db_path, tmp_dir, n_tickers, n_days, export_days, dashboard_days, track_memory):
+    # One pass over every stage against a fresh database; returns {stage: metrics}.
+    stages = {}
+    db_manager = DatabaseManager(db_path=db_path, wal=True, synchronous="NORMAL")
+    dates = pd.bdate_range(start="2015-01-01", periods=n_days).strftime('%Y-%m-%d')
+    start_date, end_date = dates[0], dates[-1]
+
+    with _StageTimer(stages, "insert", track_memory) as stage:
+        stage.rows = db_manager.insert_daily_data_bulk(iter_synthetic_market(n_tickers, n_days))['rows']
+    with _StageTimer(stages, "refresh_index", track_memory) as stage:
+        db_manager.refresh_index_tables()
+        stage.rows = n_days
+    with _StageTimer(stages, "index_range", track_memory) as stage:
+        stage.rows = len(calculate_index_for_date_range(db_manager, start_date, end_date))
+    with _StageTimer(stages, "index_engine", track_memory) as stage:
+        history = CustomIndexCalculator(db_manager).calculate_weighted_index(
+            start_date, end_date, weighting='capped', rebalance='M')
+        stage.rows = len(history) * n_tickers
+    with _StageTimer(stages, "dashboard_composition", track_memory) as stage:
+        stage.rows = len(db_manager.query_daily_data_range(dates[-min(dashboard_days, n_days)], end_date))
+
+    export_start = dates[-min(export_days, n_days)]
+    exporters = {'csv': export_to_csv, 'xlsx': export_to_excel, 'pdf': export_to_pdf, 'parquet': export_to_parquet}
+    for fmt, exporter in exporters.items():
+        with _StageTimer(stages, f"export_{fmt}", track_memory) as stage:
+            stage.rows = exporter(db_manager.iter_index_composition(export_start, end_date),
+                                  os.path.join(tmp_dir, f"composition.{fmt}"))
+    db_manager.close()
+    return stages
+
+
+def run_benchmark_suite(n_tickers=500, n_days=500, export_days=60, dashboard_days=250, track_memory=True):
+    """
+    Run the end-to-end benchmark suite on a deterministic synthetic market of n_tickers x n_days
+    (up to 10k x 5k; the market is generated and loaded in chunks).
+    Stages: bulk insert, index refresh, calculate_index_for_date_range, the weighted index engine,
+    the dashboard composition query over the last dashboard_days, and each exporter over the
+    composition of the last export_days.
+    Timings come from an untraced pass. With track_memory, a second pass on a fresh database
+    records each stage's tracemalloc peak, so tracing overhead does not distort the timings.
+    :return: JSON-serializable dict with the config, the environment and per-stage metrics.
+    """
+    config = {'tickers': n_tickers, 'days': n_days, 'export_days': export_days,
+              'dashboard_days': dashboard_days, 'track_memory': track_memory}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        stages = _run_suite_stages(os.path.join(tmp_dir, "timing.db"), tmp_dir, n_tickers, n_days,
+                                   export_days, dashboard_days, track_memory=False)
+        if track_memory:
+            traced = _run_suite_stages(os.path.join(tmp_dir, "memory.db"), tmp_dir, n_tickers, n_days,
+                                       export_days, dashboard_days, track_memory=True)
+            for name, stage in traced.items():
+                stages[name]['peak_mib'] = stage['peak_mib']
+
+    environment = {'python': platform.python_version(), 'platform': platform.platform(),
+                   'numpy': np.__version__, 'pandas': pd.__version__}
+    try:
+        import resource
+        # ru_maxrss is kilobytes on Linux and bytes on macOS.
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        environment['max_rss_mib'] = max_rss / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+    except ImportError:
+        pass
+    return {'config': config, 'environment': environment, 'stages': stages}
+
+
+def compare_with_baseline(results, baseline, tolerance=0.5, min_seconds=0.05, min_mib=1.0):
+    """
+    Compare suite results against a stored baseline.
+    A stage regresses when its time or peak memory exceeds the baseline by more than tolerance
+    (0.5 = 50%) and by more than min_seconds / min_mib, so tiny stages do not flag on noise.
+    :raises ValueError: If the results and the baseline were run with different configs.
+    :return: List of regressions, each a dict with stage, metric, baseline, current and ratio.
+    """
+    if results['config'] != baseline['config']:
+        raise ValueError(f"Baseline config {baseline['config']} does not match {results['config']}")
+    regressions = []
+    for name, stage in results['stages'].items():
+        reference = baseline['stages'].get(name)
+        if reference is None:
+            continue
+        for metric, floor in (('seconds', min_seconds), ('peak_mib', min_mib)):
+            if metric not in stage or metric not in reference:
+                continue
+            current, expected = stage[metric], reference[metric]
+            if current > expected * (1 + tolerance) and current - expected > floor:
+                regressions.append({'stage': name, 'metric': metric, 'baseline': expected,
+                                    'current': current, 'ratio': current / expected if expected else None})
+    return regressions
+
+
+def main(argv=None):
+    """
+    Run the benchmarks selected by the command-line arguments.
+    :param argv: Arguments without the program name; defaults to sys.argv[1:].
+    :return: Process exit status: 1 if the suite found regressions, else 0.
+    """
+    parser = argparse.ArgumentParser(prog="benchmark", description="Benchmark the index history calculation.")
+    parser.add_argument("--tickers", type=int, default=200, help="Number of synthetic tickers. Default is 200.")
+    parser.add_argument("--days", type=int, nargs="+", default=[60, 250, 1000],
+                        help="Day counts to benchmark. Default is 60 250 1000.")
+    parser.add_argument("--skip_per_day", action="store_true", help="Only time the single-pass engine.")
+    parser.add_argument("--insert_days", type=int, default=730,
+                        help="Days of history for the bulk insert benchmark. Default is 730.")
+    parser.add_argument("--per_row", action="store_true", help="Also time the per-row insert path.")
+    parser.add_argument("--engine_tickers", type=int, default=3000,
+                        help="Tickers for the index engine benchmark. Default is 3000.")
+    parser.add_argument("--engine_days", type=int, default=7500,
+                        help="Days for the index engine benchmark. Default is 7500.")
+    parser.add_argument("--export_rows", type=int, nargs="+", default=[20_000, 100_000],
+                        help="Row counts for the streaming export benchmark. Default is 20000 100000.")
+    parser.add_argument("--ingest_tickers", type=int, nargs="+", default=[250, 1000, 4000],
+                        help="Universe sizes for the streaming ingestion benchmark. Default is 250 1000 4000.")
+    parser.add_argument("--service_clients", type=int, default=8,
+                        help="Concurrent clients for the index service benchmark. Default is 8.")
+    parser.add_argument("--startup", action="store_true",
+                        help="Only measure the cold-start time of each cli.py command.")
+    parser.add_argument("--compact_reads", type=int, nargs=2, metavar=("TICKERS", "DAYS"), default=None,
+                        help="Only compare the peak memory of the string and compact reads of a TICKERS x DAYS "
+                             "table, e.g. 2000 5000 for 10M rows.")
+    parser.add_argument("--suite", action="store_true",
+                        help="Run the end-to-end suite instead, print JSON and compare with the baseline.")
+    parser.add_argument("--suite_tickers", type=int, default=500, help="Suite tickers (up to 10000). Default is 500.")
+    parser.add_argument("--suite_days", type=int, default=500, help="Suite days (up to 5000). Default is 500.")
+    parser.add_argument("--json", type=str, default=None, help="Also write the suite results to this file.")
+    parser.add_argument("--baseline", type=str, default="benchmark_baseline.json",
+                        help="Baseline file to compare against. Default is benchmark_baseline.json.")
+    parser.add_argument("--save_baseline", action="store_true", help="Store the suite results as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed slowdown or memory growth over the baseline. Default is 0.5 (50%%).")
+    args = parser.parse_args(argv)
+    if args.startup:
+        print(benchmark_cli_startup().to_string(index=False))
+        return 0
+    if args.compact_reads:
+        print(benchmark_compact_reads(*args.compact_reads).to_string(index=False))
+        return 0
+    if args.suite:
+        results = run_benchmark_suite(n_tickers=args.suite_tickers, n_days=args.suite_days)
+        print(json.dumps(results, indent=2))
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+        if args.save_baseline:
+            with open(args.baseline, "w") as f:
+                json.dump(results, f, indent=2)
+        elif os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                regressions = compare_with_baseline(results, json.load(f), tolerance=args.tolerance)
+            for regression in regressions:
+                print(f"REGRESSION {regression['stage']} {regression['metric']}: "
+                      f"{regression['baseline']:.3f} -> {regression['current']:.3f}", file=sys.stderr)
+            return 1 if regressions else 0
+        return 0
+    print(benchmark_index_history(args.days, n_tickers=args.tickers,
+                                  include_per_day=not args.skip_per_day).to_string(index=False))
+    print(benchmark_fetch(n_tickers=args.tickers))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print(benchmark_bulk_insert(os.path.join(tmp_dir, "bench.db"), n_tickers=args.tickers,
+                                    n_days=args.insert_days, include_per_row=args.per_row))
+    print(benchmark_index_engine(n_tickers=args.engine_tickers, n_days=args.engine_days).to_string(index=False))
+    print(benchmark_exports(args.export_rows).to_string(index=False))
+    print(benchmark_streaming_ingestion(args.ingest_tickers).to_string(index=False))
+    print(benchmark_index_service(clients=args.service_clients).to_string(index=False))
+    print(benchmark_index_analytics().to_string(index=False))
+    print(benchmark_index_sweep().to_string(index=False))
+    print(benchmark_live_index().to_string(index=False))
+    print(benchmark_cli_startup().to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    sys.exit(main())
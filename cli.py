@@ -0,0 +1,269 @@
+import argparse
+import datetime
+import logging
+import sys
+
+logger = logging.getLogger(__name__)
+
+# Each command imports what it needs inside its handler, so parsing the arguments, --help and
+# the commands that do not touch an exporter or a data provider never load them.
+
+
+def _add_storage_arguments(parser):
+    parser.add_argument("--db_path", default=None,
+                        help="Storage path. Defaults to HEDGINEER_STORAGE_PATH, then data.db (or data_parquet).")
+    parser.add_argument("--storage_backend", choices=["sqlite", "parquet"], default=None,
+                        help="Storage backend. Defaults to HEDGINEER_STORAGE_BACKEND or sqlite.")
+
+
+def _ingest(args):
+    from data_ingestion import run_data_ingestion
+
+    provider = None
+    if args.offline:
+        from data_fetcher import FakeDataProvider
+        provider = FakeDataProvider()
+    run_data_ingestion(historical_load=args.historical_load == "yes", backfill_days=args.backfill_days,
+                       export_files=args.export_files == "yes", provider=provider, db_path=args.db_path,
+                       storage_backend=args.storage_backend, metrics_dir=args.metrics_dir,
+                       cache_dir=args.cache_dir, replay_cache=args.replay_cache, universe=args.universe,
+                       check_quality=not args.skip_quality)
+    return 0
+
+
+def _compute(args):
+    from database_manager import open_storage
+    from index_analytics import update_index_analytics
+
+    storage = open_storage(args.storage_backend, args.db_path)
+    try:
+        refreshed = storage.refresh_index_tables()
+        appended = update_index_analytics(storage)
+    finally:
+        storage.close()
+    print(f"Recomputed the index for {refreshed} dates and appended analytics for {appended} dates.")
+    return 0
+
+
+def _export(args):
+    from database_manager import open_storage
+    from exports import export_index_reports
+
+    storage = open_storage(args.storage_backend, args.db_path)
+    try:
+        rows = export_index_reports(storage, args.start, args.end, output_dir=args.output_dir)
+    finally:
+        storage.close()
+    for name, count in rows.items():
+        print(f"{name}: {count} rows")
+    return 0 if all(count is not None for count in rows.values()) else 1
+
+
+def _validate(args):
+    from database_manager import open_storage
+    from data_quality import run_quality_checks
+
+    storage = open_storage(args.storage_backend, args.db_path)
+    try:
+        result = run_quality_checks(storage, full=args.full, min_universe=args.min_universe,
+                                    max_abs_return=args.max_abs_return, stale_days=args.stale_days)
+        print(f"Checked {result['rows_checked']} rows on {result['dates_checked']} dates in {result['seconds']:.2f}s.")
+        for check, count in result['issues'].items():
+            print(f"{check}: {count}")
+        if args.show:
+            print(storage.query_quality_issues().tail(args.show).to_string(index=False))
+    finally:
+        storage.close()
+    return 0
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return number
+
+
+def _rebalance_arg(value):
+    # A frequency letter or a positive number of trading days.
+    if value.isdigit():
+        return _positive_int(value)
+    if value.upper() not in ("D", "W", "M", "Q", "Y"):
+        raise argparse.ArgumentTypeError(f"must be D, W, M, Q, Y or a number of trading days, got {value}")
+    return value.upper()
+
+
+def _sweep(args):
+    from database_manager import open_storage
+    from index_engine import load_market_matrices
+    from index_sweep import run_sweep, summarize_sweep, sweep_configs
+
+    storage = open_storage(args.storage_backend, args.db_path)
+    try:
+        prices, market_caps = load_market_matrices(storage, args.start, args.end)
+    finally:
+        storage.close()
+    if prices.empty:
+        print(f"No data between {args.start} and {args.end}.")
+        return 1
+    levels = run_sweep(prices, market_caps, sweep_configs(args.top_n, args.rebalance, args.weighting),
+                       processes=args.processes)
+    if args.output:
+        levels.reset_index().to_csv(args.output, index=False)
+    print(summarize_sweep(levels).to_string(float_format=lambda value: f"{value:.4f}"))
+    return 0
+
+
+def _live(args):
+    from database_manager import open_storage
+    from live_index import LiveIndex, SnapshotWriter, run_live_index, simulated_quotes
+
+    storage = open_storage(args.storage_backend, args.db_path)
+    try:
+        try:
+            live_index = LiveIndex.from_storage(storage, date=args.date, top_n=args.top_n)
+        except ValueError as e:
+            print(e)
+            return 1
+        feed = simulated_quotes(dict(live_index.prices), args.batches, batch_size=args.batch_size,
+                                interval=args.interval, seed=args.seed)
+        writer = SnapshotWriter(storage, flush_rows=args.flush_rows, flush_seconds=args.flush_seconds)
+        stats = run_live_index(live_index, feed, writer)
+    finally:
+        storage.close()
+    # The rate is None for an instant run and the value is None once no ticker is left.
+    rate = "n/a" if stats['quotes_per_sec'] is None else f"{stats['quotes_per_sec']:,.0f}"
+    value = "n/a" if stats['value'] is None else f"{stats['value']:.4f}"
+    print(f"Applied {stats['quotes']} quotes in {stats['seconds']:.2f}s ({rate}/s) with "
+          f"{stats['membership_changes']} membership changes; wrote {stats['snapshots_written']} snapshots in "
+          f"{stats['flushes']} batches. Last value: {value}.")
+    return 0
+
+
+def _bench(args):
+    from benchmark import main as benchmark_main
+
+    return benchmark_main(args.bench_args)
+
+
+def build_parser():
+    """
+    Build the argument parser of every command.
+    """
+    today = datetime.date.today()
+    parser = argparse.ArgumentParser(prog="cli.py", description="Scheduled jobs of the hedgineer index pipeline.")
+    parser.add_argument("--log_level", default="INFO", help="Logging level. Default is INFO.")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    ingest = commands.add_parser("ingest", help="Fetch and store new daily data, then refresh the index.",
+                                 description="Run data ingestion for stock data.")
+    _add_storage_arguments(ingest)
+    ingest.add_argument("--historical_load", type=str.lower, choices=["yes", "no"], default="no",
+                        help="Perform a historical load (yes or no). Default is no.")
+    ingest.add_argument("--backfill_days", type=int, default=730,
+                        help="Number of days to backfill for historical load. Default is 730 days.")
+    ingest.add_argument("--export_files", type=str.lower, choices=["yes", "no"], default="no",
+                        help="Export the past month of the index (yes or no). Default is no.")
+    ingest.add_argument("--offline", action="store_true",
+                        help="Use the deterministic fake data provider instead of yfinance.")
+    ingest.add_argument("--metrics_dir", type=str, default=None,
+                        help="Directory for the JSON run summary and Prometheus metrics file.")
+    ingest.add_argument("--cache_dir", type=str, default=None,
+                        help="Directory of the Parquet download cache. Downloads are not cached by default.")
+    ingest.add_argument("--replay_cache", action="store_true",
+                        help="Load the database from the download cache only, without downloading.")
+    ingest.add_argument("--universe", choices=["top200", "all"], default="top200",
+                        help="Ingest the top 200 US tickers or every US-listed symbol. Default is top200.")
+    ingest.add_argument("--skip_quality", action="store_true",
+                        help="Do not run the data-quality checks on the newly ingested dates.")
+    ingest.set_defaults(handler=_ingest)
+
+    compute = commands.add_parser("compute", help="Recompute the index for changed dates and extend the analytics.",
+                                  description="Refresh the materialized index and the running index analytics "
+                                              "from the stored data, without fetching.")
+    _add_storage_arguments(compute)
+    compute.set_defaults(handler=_compute)
+
+    export = commands.add_parser("export", help="Export the materialized index to Excel, PDF and CSV.",
+                                 description="Export the index history, rebalances, analytics and composition "
+                                             "as materialized by the last ingest or compute.")
+    _add_storage_arguments(export)
+    export.add_argument("--start", default=(today - datetime.timedelta(days=30)).strftime('%Y-%m-%d'),
+                        help="First date (YYYY-MM-DD). Default is 30 days ago.")
+    export.add_argument("--end", default=today.strftime('%Y-%m-%d'), help="Last date (YYYY-MM-DD). Default is today.")
+    export.add_argument("--output_dir", default=".", help="Directory for the files. Default is the current one.")
+    export.set_defaults(handler=_export)
+
+    validate = commands.add_parser("validate", help="Run the data-quality checks and print the issues.",
+                                   description="Check the stored daily data and persist the issues found.")
+    _add_storage_arguments(validate)
+    validate.add_argument("--full", action="store_true", help="Check every stored date, not only the changed ones.")
+    validate.add_argument("--show", type=int, default=20,
+                          help="Number of most recent issues to print. Default is 20.")
+    validate.add_argument("--min_universe", type=int, default=100,
+                          help="Fewest tickers a date may have. Default is 100.")
+    validate.add_argument("--max_abs_return", type=float, default=0.25,
+                          help="Largest daily return not reported as an outlier. Default is 0.25.")
+    validate.add_argument("--stale_days", type=int, default=5,
+                          help="Consecutive unchanged prices reported as stale. Default is 5.")
+    validate.set_defaults(handler=_validate)
+
+    sweep = commands.add_parser("sweep", help="Backtest many index definitions over stored data in one pass.",
+                                description="Compute every combination of top-N, rebalance frequency and "
+                                            "weighting from one data load and print their performance.")
+    _add_storage_arguments(sweep)
+    sweep.add_argument("--start", default=(today - datetime.timedelta(days=730)).strftime('%Y-%m-%d'),
+                       help="First date (YYYY-MM-DD). Default is two years ago.")
+    sweep.add_argument("--end", default=today.strftime('%Y-%m-%d'), help="Last date (YYYY-MM-DD). Default is today.")
+    sweep.add_argument("--top_n", type=_positive_int, nargs="+", default=[50, 100, 200],
+                       help="Index sizes. Default is 50 100 200.")
+    sweep.add_argument("--rebalance", type=_rebalance_arg, nargs="+", default=["D", "W", "M", "Q"],
+                       help="Rebalance frequencies (D, W, M, Q, Y or a number of trading days). Default is D W M Q.")
+    sweep.add_argument("--weighting", nargs="+", choices=["equal", "market_cap", "capped"],
+                       default=["equal", "market_cap", "capped"], help="Weighting schemes. Default is all three.")
+    sweep.add_argument("--processes", type=int, default=None,
+                       help="Worker processes sharing the data through shared memory. Default is none.")
+    sweep.add_argument("--output", default=None, help="Also write every variant's index values to this CSV file.")
+    sweep.set_defaults(handler=_sweep)
+
+    live = commands.add_parser("live", help="Run the intraday index on a simulated quote feed.",
+                               description="Start the live top-N index from the closes of a stored date, apply a "
+                                           "simulated quote feed and store its snapshots in batches.")
+    _add_storage_arguments(live)
+    live.add_argument("--date", default=None, help="Date of the starting closes. Default is the latest stored date.")
+    live.add_argument("--top_n", type=_positive_int, default=100, help="Index size. Default is 100.")
+    live.add_argument("--batches", type=int, default=10_000, help="Quote batches to simulate. Default is 10000.")
+    live.add_argument("--batch_size", type=int, default=50, help="Quotes per batch. Default is 50.")
+    live.add_argument("--interval", type=float, default=0.01,
+                      help="Simulated seconds between batches. Default is 0.01.")
+    live.add_argument("--seed", type=int, default=0, help="Seed of the simulated feed. Default is 0.")
+    live.add_argument("--flush_rows", type=int, default=1000,
+                      help="Snapshots written per batch. Default is 1000.")
+    live.add_argument("--flush_seconds", type=float, default=1.0,
+                      help="Longest wait in seconds before buffered snapshots are written. Default is 1.")
+    live.set_defaults(handler=_live)
+
+    # The benchmark options belong to benchmark.py, so everything after "bench" is passed on.
+    bench = commands.add_parser("bench", add_help=False, help="Run benchmark.py with the remaining arguments.")
+    bench.set_defaults(handler=_bench)
+    return parser
+
+
+def main(argv=None):
+    """
+    Parse the command line and run the selected command.
+    :param argv: Arguments without the program name; defaults to sys.argv[1:].
+    :return: Process exit status.
+    """
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == "bench":
+        args.bench_args = extra
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    logging.basicConfig(level=args.log_level.upper())
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,7 @@
 import logging
 import pandas as pd
+from index_engine import IndexEngine, load_market_matrices
+from index_sweep import run_sweep
 
 logger = logging.getLogger(__name__)
 
@@ -12,44 +14,81 @@ class CustomIndexCalculator:
     def __init__(self, db_manager):
         self.db_manager = db_manager
 
-    def calculate_index_value(self, date):
+    def calculate_index_value(self, date, top_n=100):
         """
         Calculate the equal-weighted index value for a given date.
-        This is computed as the average closing price of the top 100 stocks by market cap.
+        This is computed as the average closing price of the top_n (100) stocks by market cap.
         :param date: Date string in 'YYYY-MM-DD' format.
         :return: Average closing price (float) or None if no data is available.
         """
-        query = """
-            SELECT ticker, closing_price, market_cap 
-            FROM daily_data
-            WHERE DATE(date) = ?
-            ORDER BY market_cap DESC
-            LIMIT 100
-        """
-        logger.warning(f"Calculating index value for date: {date}")
-        df = pd.read_sql_query(query, self.db_manager.conn, params=(date,))
+        logger.debug(f"Calculating index value for date: {date}")
+        df = self.db_manager.query_top_stocks(date, limit=top_n)
         if df.empty:
             logger.warning(f"No data available for {date}")
             return None
         # Return the mean of the closing prices
         return df['closing_price'].mean()
 
-def calculate_index_for_date_range(db_manager, start_date, end_date):
+    def calculate_index_history(self, start_date, end_date, top_n=100):
+        """
+        Calculate the equal-weighted index value for every date with data between
+        start_date and end_date in a single pass.
+        The window is loaded once with the top stocks already ranked per date, so the cost
+        grows with the number of rows in the range rather than rows x days.
+        :param start_date: Start date in 'YYYY-MM-DD' format.
+        :param end_date: End date in 'YYYY-MM-DD' format.
+        :param top_n: Number of constituents by market cap included each day.
+        :return: pandas DataFrame with columns 'date' and 'index_value'.
+        """
+        logger.info(f"Calculating index history from {start_date} to {end_date}")
+        df = self.db_manager.query_top_stocks_range(start_date, end_date, limit=top_n)
+        if df.empty:
+            return pd.DataFrame({'date': pd.Series(dtype=object), 'index_value': pd.Series(dtype=float)})
+        history = df.groupby('date', sort=True)['closing_price'].mean()
+        return history.rename('index_value').rename_axis('date').reset_index()
+
+    def calculate_weighted_index(self, start_date, end_date, top_n=100, weighting='equal', rebalance='D',
+                                 base_value=100.0):
+        """
+        Calculate a return-continuous index between start_date and end_date with IndexEngine.
+        Unlike calculate_index_history, the level does not jump when membership changes: the
+        divisor is adjusted at every rebalance and holdings are fixed in between.
+        :param weighting: 'equal', 'market_cap', 'capped' or a WeightingScheme instance.
+        :param rebalance: Rebalance frequency: 'D', 'W', 'M', 'Q', 'Y' or a number of trading days.
+        :return: pandas DataFrame with columns date, index_value, divisor, constituent_count and rebalance.
+        """
+        logger.info(f"Calculating {weighting} index from {start_date} to {end_date} rebalanced {rebalance}")
+        prices, market_caps = load_market_matrices(self.db_manager, start_date, end_date)
+        engine = IndexEngine(top_n=top_n, weighting=weighting, rebalance=rebalance, base_value=base_value)
+        return engine.compute(prices, market_caps)
+
+    def calculate_index_sweep(self, start_date, end_date, configs, processes=None):
+        """
+        Calculate many index variants between start_date and end_date from one data load.
+        :param configs: Iterable of index_sweep.SweepConfig, e.g. from index_sweep.sweep_configs().
+        :param processes: Worker processes for index_sweep.run_sweep; None runs in this process.
+        :return: DataFrame of index values indexed by date, one column per configuration.
+        """
+        prices, market_caps = load_market_matrices(self.db_manager, start_date, end_date)
+        return run_sweep(prices, market_caps, configs, processes=processes)
+
+def calculate_index_for_date_range(db_manager, start_date, end_date, refresh=True):
     """
     Calculate the equal-weighted custom index for each business day in the specified date range.
-    Uses pandas.bdate_range to iterate only over trading days.
+    Dates changed since the last call are recomputed into the materialized index_values table,
+    which is then read with a single range scan; days without data get a missing index value.
     Returns a DataFrame with columns 'date' and 'index_value'.
     :param db_manager: Instance of DatabaseManager.
     :param start_date: Start date in 'YYYY-MM-DD' format.
     :param end_date: End date in 'YYYY-MM-DD' format.
+    :param refresh: Recompute changed dates first. Read-only callers pass False and read the
+                    index as materialized by the last ingestion.
     :return: pandas DataFrame with index values for each trading day.
     """
     # Generate business days (trading days) between start_date and end_date
-    dates = pd.bdate_range(start=start_date, end=end_date)
-    index_values = []
-    calc = CustomIndexCalculator(db_manager)
-    for d in dates:
-        date_str = d.strftime('%Y-%m-%d')
-        index_value = calc.calculate_index_value(date_str)
-        index_values.append({'date': date_str, 'index_value': index_value})
-    return pd.DataFrame(index_values)
\ No newline at end of file
+    dates = pd.bdate_range(start=start_date, end=end_date).strftime('%Y-%m-%d')
+    if refresh:
+        db_manager.refresh_index_tables()
+    history = db_manager.query_index_values(start_date, end_date)
+    index_values = history.set_index('date')['index_value'].reindex(dates)
+    return pd.DataFrame({'date': list(dates), 'index_value': index_values.to_numpy()})
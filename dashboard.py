@@ -1,21 +1,64 @@
 import streamlit as st
 import datetime
-import pandas as pd
-from database_manager import DatabaseManager
-from custom_index_calculator import calculate_index_for_date_range
-import sqlite3
+import threading
+from contextlib import nullcontext
+from database_manager import open_storage
+from index_analytics import summarize_horizon
 import os
 
-# Set up database directory and path
-db_dir = r"C:\Users\abhij\OneDrive\Desktop\hedgineer"
-if not os.path.exists(db_dir):
-    os.makedirs(db_dir)
+# HEDGINEER_STORAGE_BACKEND / HEDGINEER_STORAGE_PATH select another backend such as parquet
+storage_backend = os.environ.get("HEDGINEER_STORAGE_BACKEND", "sqlite")
+storage_path = os.environ.get("HEDGINEER_STORAGE_PATH")
+if storage_backend == "sqlite" and storage_path is None:
+    # Set up database directory and path
+    db_dir = r"C:\Users\abhij\OneDrive\Desktop\hedgineer"
+    if not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    storage_path = os.path.join(db_dir, "data.db")
+print(f"Database path: {storage_path}")
+
+
+@st.cache_resource
+def get_storage(backend, path):
+    """
+    Open the storage once and share it across reruns and sessions.
+    DatabaseManager is safe to share between session threads and reads from its own
+    connection pool; the Parquet backend is serialized with a lock.
+    """
+    lock = nullcontext() if backend == "sqlite" else threading.Lock()
+    return open_storage(backend, path), lock
+
+
+# Query results are cached by their parameters plus the data version stamp, which only
+# changes when ingestion commits new data, so widget interactions reuse them.
+# The composition is cached in the compact form (categorical tickers, datetime64 dates),
+# which keeps long ranges small in the cache and fast to copy out of it.
+@st.cache_data(max_entries=64)
+def load_composition(start_date, end_date, data_version):
+    db_manager, lock = get_storage(storage_backend, storage_path)
+    with lock:
+        return db_manager.query_daily_data_range(start_date, end_date, compact=True)
+
+
+@st.cache_data(max_entries=64)
+def load_index_analytics(start_date, end_date, data_version):
+    # Read-only: the analytics are kept current by `cli.py ingest` and `cli.py compute`.
+    db_manager, lock = get_storage(storage_backend, storage_path)
+    with lock:
+        return db_manager.query_index_analytics(start_date, end_date)
+
+
+@st.cache_data(max_entries=64)
+def load_rebalances(start_date, end_date, data_version):
+    db_manager, lock = get_storage(storage_backend, storage_path)
+    with lock:
+        return db_manager.query_turnover(start_date, end_date), db_manager.query_rebalance_events(start_date, end_date)
 
-db_path = os.path.join(db_dir, "data.db")
-print(f"Database path: {db_path}")
 
 st.write("Connecting to database...")
-db_manager = DatabaseManager(db_path=db_path)
+db_manager, db_lock = get_storage(storage_backend, storage_path)
+with db_lock:
+    data_version = db_manager.get_data_version()
 st.write("Connected to database.")
 
 st.title("Custom Equal-Weighted Index Dashboard")
@@ -45,13 +88,7 @@ if start_date > end_date:
     st.stop()
 
 # Query the database for composition data
-composition_query = """
-    SELECT ticker, closing_price, market_cap, date
-    FROM daily_data
-    WHERE DATE(date) BETWEEN ? AND ?
-    ORDER BY DATE(date), market_cap DESC
-"""
-composition_df = pd.read_sql_query(composition_query, db_manager.conn, params=(start_date, end_date))
+composition_df = load_composition(start_date, end_date, data_version)
 
 if composition_df.empty:
     st.write(f"No index composition data available for the selected date range: {start_date} to {end_date}.")
@@ -60,42 +97,44 @@ else:
     st.dataframe(composition_df)
     
     # For visualization, compute the average market cap per ticker over the period
-    avg_mcap_df = composition_df.groupby("ticker")["market_cap"].mean().reset_index()
+    avg_mcap_df = composition_df.groupby("ticker", observed=True)["market_cap"].mean().reset_index()
     avg_mcap_df = avg_mcap_df.sort_values(by="market_cap", ascending=False).head(10)
+    avg_mcap_df["ticker"] = avg_mcap_df["ticker"].astype(str)
     st.subheader("Top 10 Stocks by Average Market Cap (Composition over period)")
     st.bar_chart(avg_mcap_df.set_index("ticker")["market_cap"])
 
-# Display index performance over the past 30 days
+# Display index performance over the selected horizon, from the stored running analytics
+HORIZONS = {"1 Month": 30, "3 Months": 91, "1 Year": 365, "3 Years": 3 * 365, "5 Years": 5 * 365}
+horizon = st.sidebar.selectbox("Performance Horizon", list(HORIZONS))
 today = datetime.date.today()
-perf_start_date = (today - datetime.timedelta(days=30)).strftime('%Y-%m-%d')
+perf_start_date = (today - datetime.timedelta(days=HORIZONS[horizon])).strftime('%Y-%m-%d')
 perf_end_date = today.strftime('%Y-%m-%d')
-index_history_df = calculate_index_for_date_range(db_manager, perf_start_date, perf_end_date)
+analytics_df = load_index_analytics(perf_start_date, perf_end_date, data_version)
+summary = summarize_horizon(analytics_df)
 
-if index_history_df.empty:
-    st.write("No index performance data available for the past 30 days.")
+if summary is None:
+    st.write(f"No index performance data available for the past {horizon.lower()}.")
 else:
-    st.subheader("Index Performance Over the Past 30 Days")
-    index_history_df['daily_change'] = index_history_df['index_value'].pct_change() * 100
-    index_history_df['cumulative_return'] = (1 + index_history_df['daily_change'] / 100).cumprod() - 1
-    st.line_chart(index_history_df.set_index('date')['index_value'])
+    st.subheader(f"Index Performance Over the Past {horizon}")
+    st.line_chart(analytics_df.set_index('date')['index_value'])
 
     # Display summary metrics
     st.subheader("Summary Metrics")
-    st.write(f"Cumulative Return: {index_history_df['cumulative_return'].iloc[-1]:.2%}")
-    st.write(f"Average Daily Change: {index_history_df['daily_change'].mean():.2f}%")
+    st.write(f"Cumulative Return: {summary['total_return']:.2%}")
+    st.write(f"Average Daily Change: {summary['mean_daily_return'] * 100:.2f}%")
+    st.write(f"Annualized Volatility: {summary['volatility']:.2%}")
+    st.write(f"Max Drawdown: {summary['max_drawdown']:.2%}")
+    st.write(f"Average Daily Turnover: {summary['average_turnover']:.2%}")
+    st.write(f"Market Return: {summary['market_return']:.2%} (excess {summary['excess_return']:.2%})")
+    st.write(f"Tracking Error: {summary['tracking_error']:.2%} (information ratio "
+             f"{summary['information_ratio']:.2f})")
 
 # Highlight composition changes
-composition_changes_query = """
-    SELECT DISTINCT date
-    FROM daily_data
-    WHERE ticker NOT IN (
-        SELECT ticker
-        FROM daily_data
-        WHERE DATE(date) = ?
-    )
-"""
-composition_changes_df = pd.read_sql_query(composition_changes_query, db_manager.conn, params=(start_date,))
+turnover_df, rebalance_events_df = load_rebalances(start_date, end_date, data_version)
+composition_changes_df = turnover_df[(turnover_df['entries'] > 0) | (turnover_df['exits'] > 0)]
 if not composition_changes_df.empty:
     st.subheader("Composition Changes")
     st.write("Days with changes in index composition:")
-    st.dataframe(composition_changes_df)
\ No newline at end of file
+    st.dataframe(composition_changes_df)
+    st.write("Tickers entering and leaving the index:")
+    st.dataframe(rebalance_events_df)
\ No newline at end of file
@@ -1,17 +1,236 @@
 import pandas as pd
 import logging
-import yfinance as yf
+import threading
+import time
+import zlib
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from metrics import MetricsRegistry, SampledLogger
 
 
 logger = logging.getLogger(__name__)
 
+
+class DataProvider:
+    """
+    Interface for market data sources used by DataFetcher.
+    A provider downloads daily bars for a list of tickers and returns a dictionary mapping
+    ticker -> DataFrame with a 'Date' column and at least a 'Close' column.
+    Tickers confirmed to have no data in the range are left out of the result. A ticker whose
+    download failed within an otherwise answered request maps to None, and a request that failed
+    as a whole raises; both are retried.
+    """
+    # Tickers per shares outstanding request; None serves any number of tickers in one request.
+    shares_request_size = None
+
+    def download(self, tickers, start_date, end_date):
+        raise NotImplementedError
+
+    def shares_outstanding(self, tickers, start_date, end_date):
+        """
+        Return the shares outstanding records effective between start_date and end_date as a
+        DataFrame with columns ticker, effective_date and shares. Providers without share data
+        return no records, and market caps keep the placeholder estimate.
+        """
+        return pd.DataFrame(columns=['ticker', 'effective_date', 'shares'])
+
+    def shares_cached(self, tickers, start_date, end_date):
+        """
+        Whether shares_outstanding can answer for these tickers without a network request, in
+        which case DataFetcher takes no rate-limit token for it.
+        """
+        return False
+
+
+class YFinanceProvider(DataProvider):
+    """
+    Provider that downloads many tickers per request from yfinance.
+    yf.download logs a ticker that failed instead of raising, and returns it without rows, as it
+    does a ticker that has no data. Tickers without rows are therefore asked for again one at a
+    time with raise_errors=True: only a missing-ticker error confirms that there is no data, and
+    any other error marks the ticker as failed.
+    Shares outstanding come from one get_shares_full request per ticker.
+    """
+    shares_request_size = 1
+
+    def download(self, tickers, start_date, end_date):
+        import yfinance as yf
+
+        # Explicitly set interval='1d' to avoid invalid period errors.
+        raw = yf.download(list(tickers), start=start_date, end=end_date, interval='1d',
+                          group_by='ticker', threads=False, progress=False)
+        data, suspects = {}, []
+        for ticker in tickers:
+            df = None
+            if raw is not None and not raw.empty:
+                if not isinstance(raw.columns, pd.MultiIndex):
+                    df = raw
+                elif ticker in raw.columns.get_level_values(0):
+                    df = raw[ticker]
+            # Failed tickers come back as all-NaN columns in a multi-ticker download.
+            df = None if df is None else df.dropna(subset=['Close'])
+            if df is None or df.empty:
+                suspects.append(ticker)
+            else:
+                data[ticker] = df.rename_axis('Date').reset_index()
+        for ticker in suspects:
+            df = self._download_one(ticker, start_date, end_date)
+            if df is None or not df.empty:
+                data[ticker] = df
+        return data
+
+    @staticmethod
+    def _download_one(ticker, start_date, end_date):
+        # Rows of one ticker, an empty frame if yfinance confirms it has none, or None if it failed.
+        import yfinance as yf
+        from yfinance.exceptions import YFTickerMissingError
+
+        try:
+            df = yf.Ticker(ticker).history(start=start_date, end=end_date, interval='1d', raise_errors=True)
+        except YFTickerMissingError:
+            return pd.DataFrame(columns=['Date', 'Close'])
+        except Exception as e:
+            logger.warning(f"Download failed for {ticker}: {e}")
+            return None
+        df = df.dropna(subset=['Close'])
+        if isinstance(df.index, pd.DatetimeIndex) and df.index.tz is not None:
+            df.index = df.index.tz_localize(None)
+        return df.rename_axis('Date').reset_index()
+
+    def shares_outstanding(self, tickers, start_date, end_date):
+        import yfinance as yf
+
+        frames = []
+        for ticker in tickers:
+            series = yf.Ticker(ticker).get_shares_full(start=start_date, end=end_date)
+            if series is None or series.empty:
+                continue
+            dates = pd.DatetimeIndex(series.index)
+            if dates.tz is not None:
+                dates = dates.tz_localize(None)
+            # Several filings can land on one day; the last one is in effect.
+            frames.append(pd.DataFrame({'ticker': ticker, 'effective_date': dates.normalize(),
+                                        'shares': series.to_numpy(dtype=float)})
+                          .drop_duplicates('effective_date', keep='last'))
+        if not frames:
+            return super().shares_outstanding(tickers, start_date, end_date)
+        return pd.concat(frames, ignore_index=True)
+
+
+class FakeDataProvider(DataProvider):
+    """
+    Deterministic offline provider for tests and benchmarks.
+    Every ticker gets a reproducible random walk on business days in [start_date, end_date),
+    seeded from the ticker symbol, so repeated runs return identical data.
+    :param latency: Seconds to sleep per download call to simulate network latency.
+    :param fail_once: Tickers whose first download request raises, to exercise retries.
+    :param drop_once: Tickers that the first request containing them answers as failed (None)
+                      without raising, as yfinance does for a ticker whose download failed.
+    """
+    def __init__(self, latency=0.0, fail_once=(), drop_once=()):
+        self.latency = latency
+        self.fail_once = set(fail_once)
+        self.drop_once = set(drop_once)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def download(self, tickers, start_date, end_date):
+        with self._lock:
+            self.calls += 1
+            failing = self.fail_once.intersection(tickers)
+            self.fail_once -= failing
+            dropped = self.drop_once.intersection(tickers) if not failing else set()
+            self.drop_once -= dropped
+        if self.latency:
+            time.sleep(self.latency)
+        if failing:
+            raise ConnectionError(f"Simulated failure for {', '.join(sorted(failing))}")
+        dates = pd.bdate_range(start=start_date, end=pd.to_datetime(end_date) - pd.Timedelta(days=1))
+        data = {}
+        for ticker in tickers:
+            if ticker in dropped:
+                data[ticker] = None
+            elif not dates.empty:
+                data[ticker] = pd.DataFrame({'Date': dates, 'Close': self._prices(ticker, dates)})
+        return data
+
+    def shares_outstanding(self, tickers, start_date, end_date):
+        # One record per calendar quarter, drifting from a per-ticker base so that the ranking
+        # by market cap differs from the ranking by price.
+        quarters = pd.date_range(pd.Timestamp(start_date).to_period('Q').start_time,
+                                 pd.to_datetime(end_date) - pd.Timedelta(days=1), freq='QS')
+        quarter_index = np.asarray((quarters.year - 2000) * 4 + quarters.quarter - 1, dtype=float)
+        frames = []
+        for ticker in tickers:
+            base = np.random.default_rng(zlib.crc32(ticker.encode()) + 1).uniform(1e8, 1e10)
+            frames.append(pd.DataFrame({'ticker': ticker, 'effective_date': quarters,
+                                        'shares': np.round(base * (1 + 0.005 * quarter_index))}))
+        if not frames:
+            return super().shares_outstanding(tickers, start_date, end_date)
+        return pd.concat(frames, ignore_index=True)
+
+    @staticmethod
+    def _prices(ticker, dates):
+        # Walk from a fixed epoch so overlapping ranges agree on the same day's price.
+        rng = np.random.default_rng(zlib.crc32(ticker.encode()))
+        epoch = pd.Timestamp("2000-01-03")
+        start_price = rng.uniform(10, 500)
+        offsets = np.busday_count(np.datetime64(epoch.date()), dates.values.astype('datetime64[D]'))
+        walk = np.cumsum(rng.normal(0.0003, 0.02, size=int(offsets.max()) + 1))
+        return start_price * np.exp(walk[offsets])
+
+
+class TokenBucket:
+    """
+    Thread-safe token-bucket rate limiter.
+    :param rate: Tokens added per second.
+    :param capacity: Maximum burst size.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Block until a token is available and consume it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
 class DataFetcher:
     """
-    Class to fetch historical stock data using yfinance.
+    Class to fetch historical stock data from a DataProvider (yfinance by default).
     If no tickers or ticker source file is provided, it ingests all US tickers
     from an online source (e.g., NASDAQ Trader file).
+    Tickers are downloaded in chunks on a bounded thread pool behind a token-bucket
+    rate limit. Requests that raise, and tickers the provider answered as failed, are retried with
+    exponential backoff; tickers the provider confirmed to have no rows (no trading days in the
+    range, delisted) are reported as empty and not retried.
+    Request latency, failures and retries are recorded in a MetricsRegistry.
     """
-    def __init__(self, tickers=None, ticker_source_file=None):
+    def __init__(self, tickers=None, ticker_source_file=None, provider=None, chunk_size=50,
+                 max_workers=4, requests_per_second=2.0, max_retries=3, retry_backoff=1.0, metrics=None):
+        self.provider = provider if provider is not None else YFinanceProvider()
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.rate_limiter = TokenBucket(requests_per_second, capacity=max_workers)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
         if tickers is not None:
             self.tickers = tickers
         elif ticker_source_file is not None:
@@ -30,41 +249,176 @@ class DataFetcher:
         url = "ftp://ftp.nasdaqtrader.com/SymbolDirectory/nasdaqtraded.txt"
         try:
             df = pd.read_csv(url, sep="|")
-            df = df[df['Test Issue'] != 'Y']
-            tickers = df['Symbol'].tolist()
-            return tickers[2]
+            # The last line of the file is a creation timestamp, not a symbol.
+            df = df[(df['Test Issue'] != 'Y') & df['Symbol'].notna()]
+            return list(dict.fromkeys(df['Symbol'].astype(str)))
         except Exception as e:
             logger.error(f"Error loading tickers from default source: {e}")
             return []
 
-    def fetch_data(self, start_date, end_date):
+    def fetch_data(self, start_date, end_date, tickers=None):
         """
-        Fetch historical data for each ticker between start_date and end_date.
+        Fetch historical data for each ticker between start_date and end_date (exclusive).
+        :param tickers: Optional subset of tickers to fetch instead of self.tickers.
         Returns a dictionary mapping ticker -> DataFrame.
-        The DataFrame will have a 'Date' column, 'closing_price' (from 'Close'),
-        and a dummy 'market_cap' computed for demonstration.
+        The DataFrame will have a 'Date' column, 'closing_price' (from 'Close'), and a placeholder
+        'market_cap' that is replaced with closing_price * shares outstanding where shares are known.
         """
         data = {}
-        logger.info(f"Fetching data from {start_date} to {end_date} for {len(self.tickers)} tickers.")
-        for ticker in self.tickers:
+        for chunk_data in self.iter_fetch_data(start_date, end_date, tickers=tickers):
+            data.update(chunk_data)
+        return data
+
+    def iter_fetch_data(self, start_date, end_date, tickers=None):
+        """
+        Fetch like fetch_data, but yield one dictionary of ticker -> DataFrame per chunk of
+        tickers, in ticker order, as soon as the chunk is done. At most max_workers chunks are
+        downloaded ahead of the consumer, so memory does not grow with the number of tickers.
+        Failed requests are retried within their chunk with exponential backoff.
+        """
+        for chunk_data, _ in self.iter_fetch_chunks(start_date, end_date, tickers=tickers):
+            yield chunk_data
+
+    def iter_fetch_chunks(self, start_date, end_date, tickers=None):
+        """
+        Fetch like iter_fetch_data, but yield (chunk_data, answered) per chunk, where answered
+        lists the tickers that returned rows or that the provider confirmed to have none. The
+        range is complete for those tickers; the others failed and should be asked for again later.
+        """
+        errors = SampledLogger(logger, every=10)
+        # Drop duplicate symbols while keeping the configured order.
+        pending = list(dict.fromkeys(self.tickers if tickers is None else tickers))
+        logger.info(f"Fetching data from {start_date} to {end_date} for {len(pending)} tickers "
+                    f"in chunks of {self.chunk_size}.")
+        chunks = iter([pending[i:i + self.chunk_size] for i in range(0, len(pending), self.chunk_size)])
+        fetched, empty, failed = 0, [], []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = deque(executor.submit(self._fetch_with_retries, chunk, start_date, end_date, errors)
+                              for chunk in itertools.islice(chunks, self.max_workers))
+            while in_flight:
+                chunk_data, chunk_empty, chunk_failed = in_flight.popleft().result()
+                next_chunk = next(chunks, None)
+                if next_chunk is not None:
+                    in_flight.append(executor.submit(self._fetch_with_retries, next_chunk, start_date, end_date, errors))
+                fetched += len(chunk_data)
+                failed.extend(chunk_failed)
+                empty.extend(chunk_empty)
+                yield chunk_data, list(chunk_data) + chunk_empty
+        errors.flush(logging.ERROR, "failed fetch requests")
+        if empty:
+            logger.info(f"No rows in range for {len(empty)} tickers: {', '.join(empty)}")
+        if failed:
+            logger.warning(f"Fetch failed after {self.max_retries} retries for {len(failed)} tickers: "
+                           f"{', '.join(failed)}")
+        self.metrics.inc("fetch_tickers_total", fetched, status="ok")
+        self.metrics.inc("fetch_tickers_total", len(empty), status="empty")
+        self.metrics.inc("fetch_tickers_total", len(failed), status="failed")
+        logger.info(f"Fetched data for {fetched} tickers.")
+
+    def _fetch_with_retries(self, tickers, start_date, end_date, errors):
+        # Download one chunk, retrying the whole request while the provider raises and then only
+        # the tickers it answered as failed. A ticker missing from an answer has no rows in the
+        # range and is not asked for again.
+        # Returns the frames and the empty and the failed tickers.
+        data, empty, pending = {}, [], list(tickers)
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                logger.warning(f"Retrying {len(pending)} tickers in {delay:.1f}s (attempt {attempt}).")
+                self.metrics.inc("fetch_retried_tickers_total", len(pending))
+                time.sleep(delay)
+            answer = self._fetch_chunk(pending, start_date, end_date, errors)
+            if answer is None:
+                continue
+            data.update((ticker, df) for ticker, df in answer.items() if df is not None)
+            empty.extend(ticker for ticker in pending if ticker not in answer)
+            pending = [ticker for ticker in pending if ticker in answer and answer[ticker] is None]
+            if not pending:
+                break
+        return data, empty, pending
+
+    def fetch_shares_outstanding(self, start_date, end_date, tickers=None, lookback_days=366):
+        """
+        Fetch the shares outstanding records of each ticker on the thread pool, taking one
+        rate-limit token per provider request of provider.shares_request_size tickers (a whole
+        chunk by default) that a cache cannot answer. The request starts lookback_days before
+        start_date so the record in effect on start_date is included. A failed multi-ticker
+        request is retried one ticker at a time, so one bad ticker does not drop the others;
+        tickers whose own request fails are logged and skipped, and keep the placeholder market
+        cap until a later run.
+        :return: Tuple (shares, fetched): DataFrame with columns ticker, effective_date and shares,
+                 and the list of tickers whose request succeeded.
+        """
+        pending = list(dict.fromkeys(self.tickers if tickers is None else tickers))
+        start = (pd.to_datetime(start_date) - pd.Timedelta(days=lookback_days)).strftime('%Y-%m-%d')
+        errors = SampledLogger(logger, every=10)
+
+        def fetch_batch(batch):
+            if not self.provider.shares_cached(batch, start, end_date):
+                self.rate_limiter.acquire()
             try:
-                logger.info(f"Fetching data for {ticker}")
-                # Explicitly set interval='1d' to avoid invalid period errors.
-                df = yf.download(ticker, start=start_date, end=end_date, interval='1d',threads=True)
-                logger.info(f"Data fetched for {ticker}: {df.shape[0]} rows")
-                if not df.empty:
-                    df = df.reset_index()
-                    if isinstance(df.columns, pd.MultiIndex):
-                        df.columns = df.columns.get_level_values(0)
-                    df['ticker'] = ticker
-                    df.rename(columns={'Close': 'closing_price'}, inplace=True)
-                    # For demonstration: simulate market cap as closing_price * 1,000,000.
-                    df['market_cap'] = df['closing_price'] * 1_000_000
-                    data[ticker] = df
-                else:
-                    logger.warning(f"No data returned for {ticker}")
+                with self.metrics.timer("fetch_shares_request_seconds"):
+                    df = self.provider.shares_outstanding(batch, start, end_date)
             except Exception as e:
-                # Log the error and skip the ticker.
-                logger.error(f"Error fetching data for {ticker}: {e}")
-                continue
-        return data
\ No newline at end of file
+                self.metrics.inc("fetch_shares_requests_total", status="error")
+                if len(batch) > 1:
+                    results = [fetch_batch([ticker]) for ticker in batch]
+                    return [df for frames, _ in results for df in frames], [t for _, ok in results for t in ok]
+                errors.log(logging.ERROR, f"Error fetching shares outstanding for {batch[0]}: {e}")
+                return [], []
+            self.metrics.inc("fetch_shares_requests_total", status="ok")
+            return [df], list(batch)
+
+        size = self.provider.shares_request_size or self.chunk_size
+        batches = [pending[i:i + size] for i in range(0, len(pending), size)]
+        frames, fetched = [], []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch_frames, batch_fetched in executor.map(fetch_batch, batches):
+                frames.extend(df for df in batch_frames if df is not None and not df.empty)
+                fetched.extend(batch_fetched)
+        errors.flush(logging.ERROR, "failed shares outstanding requests")
+        if frames:
+            shares = pd.concat(frames, ignore_index=True)
+        else:
+            shares = self.provider.shares_outstanding([], start, end_date)
+        self.metrics.inc("fetch_shares_records_total", len(shares))
+        logger.info(f"Fetched {len(shares)} shares outstanding records for {shares['ticker'].nunique()} tickers.")
+        return shares, fetched
+
+    def _fetch_chunk(self, tickers, start_date, end_date, errors):
+        # Download one chunk of tickers; None marks a failed request, which is retried whole,
+        # and a ticker mapped to None failed on its own.
+        self.rate_limiter.acquire()
+        started = time.perf_counter()
+        try:
+            raw = self.provider.download(tickers, start_date, end_date)
+        except Exception as e:
+            self.metrics.inc("fetch_requests_total", status="error")
+            errors.log(logging.ERROR, f"Error fetching data for {len(tickers)} tickers starting with {tickers[0]}: {e}")
+            return None
+        elapsed = time.perf_counter() - started
+        self.metrics.inc("fetch_requests_total", status="ok")
+        self.metrics.observe("fetch_request_seconds", elapsed)
+        # A multi-ticker request has no per-ticker timing, so each ticker is charged its share.
+        for _ in tickers:
+            self.metrics.observe("fetch_ticker_seconds", elapsed / len(tickers))
+        failed = [ticker for ticker, df in raw.items() if df is None]
+        if failed:
+            self.metrics.inc("fetch_ticker_errors_total", len(failed))
+            errors.log(logging.ERROR, f"Download failed for {len(failed)} tickers: {', '.join(failed)}")
+        return {ticker: None if df is None else self.to_daily_frame(ticker, df)
+                for ticker, df in raw.items() if df is None or not df.empty}
+
+    @staticmethod
+    def to_daily_frame(ticker, df):
+        """
+        Convert a provider frame into daily rows with closing_price and market_cap columns.
+        """
+        df = df.copy()
+        if isinstance(df.columns, pd.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
+        df['ticker'] = ticker
+        df.rename(columns={'Close': 'closing_price'}, inplace=True)
+        # Placeholder until shares outstanding are applied (see market_caps.apply_shares_outstanding).
+        df['market_cap'] = df['closing_price'] * 1_000_000
+        return df
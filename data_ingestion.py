@@ -1,15 +1,21 @@
-import argparse
+import sys
 import datetime
+import json
+import numpy as np
 import pandas as pd
 import logging
-from database_manager import DatabaseManager
-from custom_index_calculator import CustomIndexCalculator, calculate_index_for_date_range
-from exports import export_to_excel, export_to_pdf
-from data_fetcher import DataFetcher
+from database_manager import open_storage
+from metrics import MetricsRegistry
+from ingestion_state import plan_fetch_windows, plan_shares_windows
+from streaming import iter_in_background
+from data_fetcher import DataFetcher, YFinanceProvider
+from download_cache import CachingProvider
+from market_caps import apply_shares_outstanding, recompute_market_caps
+from data_quality import run_quality_checks
+from index_analytics import update_index_analytics
 from constants import top_200_us_stock_tickers
 import os
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def get_latest_date_from_db(db_manager):
@@ -17,83 +23,214 @@ def get_latest_date_from_db(db_manager):
     Returns the latest date available in the daily_data table as a pandas Timestamp.
     If no data exists, returns None.
     """
-    query = "SELECT MIN(date) as latest_date FROM daily_data"
-    df = pd.read_sql_query(query, db_manager.conn)
-    if pd.isna(df['latest_date'].iloc[0]):
+    _, latest_date = db_manager.query_date_bounds()
+    if latest_date is None:
         return None
-    print(f"Latest date in database: {df['latest_date'].iloc[0]}")
-    return pd.to_datetime(df['latest_date'].iloc[0])
-
-def run_data_ingestion(historical_load=False, backfill_days=730, export_files=False):
-    # Initialize DataFetcher without specifying tickers or CSV file so that it loads all US tickers.
-    fetcher = DataFetcher(tickers=top_200_us_stock_tickers)
-    # Initialize the in-memory database
-    db_manager = DatabaseManager(db_path="data.db")
+    logger.info(f"Latest date in database: {latest_date}")
+    return pd.to_datetime(latest_date)
+
+def _iter_fetched_chunks(fetcher, windows):
+    # One item per downloaded chunk of tickers: the frames and the ranges they cover. A ticker
+    # the provider confirmed to have no rows (a holiday window, a delisted symbol) is covered
+    # too; tickers whose request failed, or that the provider answered as failed, are not, so
+    # the next run plans them again.
+    for (start, end), tickers in windows.items():
+        for chunk_data, answered in fetcher.iter_fetch_chunks(start.strftime('%Y-%m-%d'),
+                                                              (end + datetime.timedelta(days=1)).strftime('%Y-%m-%d'),
+                                                              tickers=tickers):
+            yield chunk_data, [(start, end, answered)]
+
+
+def _iter_cached_chunks(fetcher, cache):
+    # Every cached ticker and range, expired or not, in chunks of fetcher.chunk_size tickers.
+    tickers = cache.tickers()
+    for offset in range(0, len(tickers), fetcher.chunk_size):
+        chunk = tickers[offset:offset + fetcher.chunk_size]
+        yield ({ticker: fetcher.to_daily_frame(ticker, cache.load(ticker)) for ticker in chunk},
+               [(start, end, [ticker]) for ticker in chunk for start, end in cache.cached_ranges(ticker)])
+
+
+def _iter_chunks_with_shares(fetcher, metrics, chunks, shares_covered, refresh_days):
+    # Runs on the producer thread: downloads each chunk and then the shares outstanding that are
+    # stale for its tickers. shares_covered maps ticker -> fetched shares ranges and is updated
+    # as requests succeed, so a ticker in several chunks is not requested twice.
+    chunks = iter(chunks)
+    while True:
+        with metrics.stage("fetch"):
+            item = next(chunks, None)
+            if item is None:
+                return
+            chunk_data, ranges = item
+            shares = []
+            if chunk_data:
+                windows = plan_shares_windows(shares_covered, list(chunk_data), min(start for start, _, _ in ranges),
+                                              max(end for _, end, _ in ranges), refresh_days=refresh_days)
+                metrics.inc("shares_fresh_tickers_total",
+                            len(set(chunk_data) - {ticker for group in windows.values() for ticker in group}))
+                for (start, end), tickers in windows.items():
+                    shares_df, fetched = fetcher.fetch_shares_outstanding(
+                        start.strftime('%Y-%m-%d'), (end + datetime.timedelta(days=1)).strftime('%Y-%m-%d'),
+                        tickers=tickers, lookback_days=0)
+                    for ticker in fetched:
+                        shares_covered.setdefault(ticker, []).append((start, end))
+                    shares.append((start, end, shares_df, fetched))
+        yield chunk_data, ranges, shares
+
+
+def _write_chunk(db_manager, metrics, chunk_data, ranges, shares):
+    """
+    Store one chunk: its shares outstanding, its daily rows and its ingestion coverage.
+    :param shares: List of (start, end, shares_df, fetched) shares requests, see _iter_chunks_with_shares.
+    :return: Number of daily rows written.
+    """
+    if shares:
+        # Revised records also recompute the stored market caps they affect, from the earliest
+        # revised date on. Tickers without coverage have no stored rows to recompute.
+        with metrics.stage("market_caps"):
+            revised = {}
+            for start, end, shares_df, fetched in shares:
+                for ticker, date in db_manager.upsert_shares_outstanding(shares_df).items():
+                    revised[ticker] = min(date, revised.get(ticker, date))
+                db_manager.record_shares_coverage(fetched, start, end)
+            stored = set(db_manager.query_ingestion_coverage(list(revised))['ticker'])
+            revised = {ticker: date for ticker, date in revised.items() if ticker in stored}
+            metrics.inc("market_caps_recomputed_total", recompute_market_caps(db_manager, revised))
+
+    # Reshape the provider frames into daily rows in date order. Inserting in primary-key order
+    # instead of ticker by ticker keeps the writes sequential and is about 4x faster.
+    with metrics.stage("transform"):
+        # Concatenate the columns as arrays; building a DataFrame per ticker costs more than the data.
+        frames = list(chunk_data.values())
+        daily_df = pd.DataFrame({
+            'date': np.concatenate([df['Date'].to_numpy() for df in frames]) if frames else [],
+            'ticker': np.repeat(np.array(list(chunk_data), dtype=object), [len(df) for df in frames]),
+            'closing_price': np.concatenate([df['closing_price'].to_numpy(dtype=float) for df in frames]) if frames else [],
+            'market_cap': np.concatenate([df['market_cap'].to_numpy(dtype=float) for df in frames]) if frames else [],
+        })
+        daily_df = daily_df.sort_values(['date', 'ticker'], kind='stable')
+        daily_df = apply_shares_outstanding(daily_df, db_manager.query_shares_outstanding(list(chunk_data)))
+        metrics.inc("rows_fetched_total", len(daily_df))
+
+    with metrics.stage("insert"):
+        stats = db_manager.insert_daily_data_bulk(daily_df)
+        # Coverage is recorded only once the chunk's rows are committed, so a run that dies
+        # part-way is resumed by the next run from the chunks that were not written.
+        for start, end, tickers in ranges:
+            db_manager.record_ingestion_coverage(tickers, start, end)
+    metrics.inc("rows_written_total", stats['rows'], table="daily_data")
+    metrics.inc("ingestion_chunks_total")
+    return stats['rows']
+
+
+def run_data_ingestion(historical_load=False, backfill_days=730, export_files=False, provider=None,
+                       db_path=None, storage_backend=None, metrics_dir=None, cache_dir=None, replay_cache=False,
+                       universe="top200", queue_size=4, fetcher_options=None, check_quality=True,
+                       shares_refresh_days=30):
+    """
+    Fetch, store and index the daily data, instrumenting each stage.
+    Every ticker should cover the last backfill_days up to yesterday. The per-ticker coverage
+    recorded by earlier runs is used to fetch only the missing ranges (gaps included), grouped into
+    as few provider requests as possible, so a daily run fetches about one day per ticker.
+    historical_load ignores the recorded coverage and refetches the whole window.
+    Ingestion is streamed: a background thread downloads chunks of tickers and hands them to the
+    writer through a queue of at most queue_size chunks, so fetching and writing overlap and
+    memory does not grow with the universe. Each chunk is committed with its coverage, so a run
+    that dies part-way is resumed by the next run.
+    With cache_dir, downloads go through a CachingProvider, so ranges fetched before are read from
+    the local Parquet cache instead of the network. replay_cache loads everything in the cache
+    into storage without any download, e.g. to rebuild the database offline.
+    Market caps are closing price times the shares outstanding in effect on each date. Shares
+    records are tracked like prices, in the shares coverage, and a ticker's shares are only
+    requested again once they are shares_refresh_days old.
+    The index stage also appends the running index analytics of the new dates
+    (see index_analytics.update_index_analytics).
+    With check_quality, the data-quality checks run over the dates this run changed and their
+    issues are persisted (see data_quality.run_quality_checks).
+    Stage timings (fetch, market_caps, transform, insert, index, quality, export), fetch latency histograms and row
+    counts are collected in a MetricsRegistry. The run summary is logged as one JSON line and,
+    if metrics_dir is given, written there as ingestion_metrics.json and ingestion_metrics.prom
+    (Prometheus text format).
+    :param universe: 'top200' for the top 200 US tickers, 'all' for every US-listed symbol, or a list of tickers.
+    :param fetcher_options: Extra keyword arguments for DataFetcher, e.g. chunk_size or requests_per_second.
+    :return: The run summary dict.
+    """
+    metrics = MetricsRegistry()
+    if replay_cache and cache_dir is None:
+        raise ValueError("replay_cache requires a cache_dir.")
+    if cache_dir is not None:
+        upstream = None if replay_cache else (provider if provider is not None else YFinanceProvider())
+        provider = CachingProvider(upstream, cache_dir, offline=replay_cache, metrics=metrics)
+    # provider=None downloads from yfinance; the 'all' universe is loaded from the NASDAQ symbol directory.
+    tickers = {'top200': top_200_us_stock_tickers, 'all': None}[universe] if isinstance(universe, str) else universe
+    fetcher = DataFetcher(tickers=tickers, provider=provider, metrics=metrics, **(fetcher_options or {}))
+    # Initialize the configured storage backend (SQLite data.db by default)
+    db_manager = open_storage(storage_backend, db_path, wal=True, synchronous="NORMAL")
     
-    # Determine the date range for data fetching:
-    # If the database is empty, perform an initial load for the last `backfill_days`.
-    # Otherwise, fetch incrementally from the day after the latest stored date.
-    latest_date = get_latest_date_from_db(db_manager)
+    get_latest_date_from_db(db_manager)
     today = datetime.date.today()
-    
-    if historical_load or latest_date is None:
-        # Historical load: backfill for the specified number of days
-        start_date = (today - datetime.timedelta(days=backfill_days)).strftime('%Y-%m-%d')
-        end_date = today.strftime('%Y-%m-%d')
-        logger.info(f"Performing historical load. Loading data from {start_date} to {end_date}.")
-    else:
-        # Incremental load: day after the latest stored date until today.
-        start_date = (latest_date + pd.Timedelta(days=1)).strftime('%Y-%m-%d')
-        end_date = today.strftime('%Y-%m-%d')
-        logger.info(f"Performing incremental load. Loading data from {start_date} to {end_date}.")
-
-    # Fetch the data using yfinance for the specified date range
-    data = fetcher.fetch_data(start_date, end_date)
-
-    # Insert fetched data into the database
-    for ticker, df in data.items():
-        db_manager.insert_stock(ticker)
-        logger.info(f"Inserted data for {ticker} into the database.")
-        for row in df.itertuples(index=False):
-            # Ensure that the Date column is available and correctly formatted.
-            # If the column name is 'Date' (after flattening MultiIndex), use row.Date.
-            date_str = pd.to_datetime(row.Date).strftime('%Y-%m-%d')
-            db_manager.insert_daily_data(date_str, ticker, row.closing_price, row.market_cap)
-            logger.info(f"Inserted daily data for {ticker} on {date_str}.")
-    
-    # Now you can calculate the custom index for a given day (e.g., latest date) or over a range.
-    calc = CustomIndexCalculator(db_manager)
-    test_date = today.strftime('%Y-%m-%d')
-    index_value = calc.calculate_index_value(test_date)
-    if index_value is not None:
-        logger.info(f"Index value on {test_date}: {index_value}")
+    if replay_cache:
+        logger.info(f"Replaying the download cache in {cache_dir}.")
+        chunks = _iter_cached_chunks(fetcher, fetcher.provider)
     else:
-        logger.info(f"No index value calculated for {test_date}")
-    
-    # Calculate the index for a full date range (e.g., the past month)
-    index_history_df = calculate_index_for_date_range(db_manager, (today - datetime.timedelta(days=30)).strftime('%Y-%m-%d'), today.strftime('%Y-%m-%d'))
-    
-    # Optionally export the historical index
+        # Determine the date ranges to fetch. The provider's end date is exclusive, so today's
+        # incomplete session is left for the next run.
+        window_start = today - datetime.timedelta(days=backfill_days)
+        window_end = today - datetime.timedelta(days=1)
+        if historical_load:
+            coverage = db_manager.query_ingestion_coverage([])
+            logger.info(f"Performing historical load. Loading data from {window_start} to {window_end}.")
+        else:
+            coverage = db_manager.query_ingestion_coverage(fetcher.tickers)
+        windows = plan_fetch_windows(coverage, fetcher.tickers, window_start, window_end)
+        ticker_days = sum(((end - start).days + 1) * len(tickers) for (start, end), tickers in windows.items())
+        logger.info(f"Planned {len(windows)} fetch windows covering {ticker_days} missing ticker-days.")
+        metrics.inc("fetch_windows_total", len(windows))
+        metrics.inc("fetch_ticker_days_total", ticker_days)
+        chunks = _iter_fetched_chunks(fetcher, windows)
+
+    # The producer thread plans shares requests from the coverage read here, so it needs no storage access
+    shares_covered = {}
+    shares_coverage = db_manager.query_shares_coverage(None if replay_cache else fetcher.tickers)
+    for ticker, start, end in shares_coverage.itertuples(index=False, name=None):
+        shares_covered.setdefault(ticker, []).append((start, end))
+
+    # Write each chunk as soon as the producer thread has fetched it
+    rows_written, tickers_written = 0, set()
+    producer = _iter_chunks_with_shares(fetcher, metrics, chunks, shares_covered, shares_refresh_days)
+    for chunk_data, ranges, shares in iter_in_background(producer, maxsize=queue_size, name="ingestion-fetch"):
+        rows_written += _write_chunk(db_manager, metrics, chunk_data, ranges, shares)
+        tickers_written.update(chunk_data)
+    logger.info(f"Inserted {rows_written} rows for {len(tickers_written)} tickers into the database.")
+
+    with metrics.stage("index"):
+        # Recompute the materialized index only for the dates whose rows changed
+        refreshed = db_manager.refresh_index_tables()
+        metrics.inc("index_dates_refreshed_total", refreshed)
+        logger.info(f"Recomputed the index for {refreshed} changed dates.")
+        # Extend the running analytics from the last date still valid after the refresh
+        metrics.inc("index_analytics_dates_total", update_index_analytics(db_manager))
+
+    if check_quality:
+        with metrics.stage("quality"):
+            # Only the dates written by this run (and their neighbours) are checked
+            run_quality_checks(db_manager, metrics=metrics)
+
+    # Optionally export the index over the past month
     if export_files:
-        export_to_excel(index_history_df, "index_history.xlsx")
-        export_to_pdf(index_history_df, "index_history.pdf")
-        logger.info("Exported index history to Excel and PDF.")
+        with metrics.stage("export"):
+            from exports import export_index_reports
+            export_index_reports(db_manager, (today - datetime.timedelta(days=30)).strftime('%Y-%m-%d'),
+                                 today.strftime('%Y-%m-%d'), metrics=metrics)
+
+    summary = metrics.summary()
+    logger.info(f"Run summary: {json.dumps(summary)}")
+    if metrics_dir is not None:
+        os.makedirs(metrics_dir, exist_ok=True)
+        metrics.write(json_path=os.path.join(metrics_dir, "ingestion_metrics.json"),
+                      prometheus_path=os.path.join(metrics_dir, "ingestion_metrics.prom"))
+    return summary
 
 if __name__ == "__main__":
-    # Set up argument parser
-    parser = argparse.ArgumentParser(description="Run data ingestion for stock data.")
-    parser.add_argument("--historical_load", type=str, choices=["yes", "no"], default="no",
-                        help="Perform a historical load (yes or no). Default is no.")
-    parser.add_argument("--backfill_days", type=int, default=730,
-                        help="Number of days to backfill for historical load. Default is 730 days.")
-    parser.add_argument("--export_files", type=str, choices=["yes", "no"], default="no",
-                        help="Export index history to Excel and PDF (yes or no). Default is no.")
-    
-    # Parse arguments
-    args = parser.parse_args()
-    historical_load = args.historical_load.lower() == "yes"
-    backfill_days = args.backfill_days
-    export_files = args.export_files.lower() == "yes"
-
-    # Run data ingestion with parsed arguments
-    run_data_ingestion(historical_load=historical_load, backfill_days=backfill_days, export_files=export_files)
\ No newline at end of file
+    # The options are defined once, by the ingest command of cli.py
+    from cli import main
+    sys.exit(main(["ingest"] + sys.argv[1:]))
@@ -0,0 +1,151 @@
+import datetime
+import logging
+import sys
+import time
+import numpy as np
+import pandas as pd
+from ingestion_state import as_date, merge_ranges
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+CHECKS = ('missing_day', 'duplicate_price', 'stale_price', 'outlier_return', 'thin_universe')
+DEFAULT_STALE_DAYS = 5
+
+
+def _empty_issues():
+    return pd.DataFrame({'date': pd.Series(dtype=object), 'ticker': pd.Series(dtype=object),
+                         'check': pd.Series(dtype=object), 'value': pd.Series(dtype=float)})
+
+
+def check_daily_data(daily_df, min_universe=100, max_abs_return=0.25, stale_days=DEFAULT_STALE_DAYS):
+    """
+    Run every data-quality check over a block of daily rows in one vectorized pass.
+    The trading calendar is the set of dates present in the block, and each ticker's rows are
+    compared with its previous row in that calendar:
+    - missing_day: a trading day without a row between two rows of the ticker, or after its last
+      row up to the end of the block, i.e. a ticker that stopped reporting (value: gap length);
+    - duplicate_price: closing price and market cap identical to another ticker's on the same
+      date, i.e. a copied row (value: number of tickers sharing it);
+    - stale_price: the closing price has not changed for stale_days or more consecutive rows
+      (value: rows with that price so far);
+    - outlier_return: the return since the previous row exceeds max_abs_return (value: return);
+    - thin_universe: the date has fewer than min_universe tickers (ticker None, value: count).
+    :param daily_df: DataFrame with columns date, ticker, closing_price and market_cap.
+    :return: DataFrame with columns date, ticker, check and value, ordered by date, check and ticker.
+    """
+    if daily_df.empty:
+        return _empty_issues()
+    date_codes, calendar = pd.factorize(daily_df['date'], sort=True)
+    ticker_codes, symbols = pd.factorize(daily_df['ticker'])
+    order = np.lexsort((date_codes, ticker_codes))
+    t, d = ticker_codes[order], date_codes[order]
+    prices = daily_df['closing_price'].to_numpy(dtype=float)[order]
+    caps = daily_df['market_cap'].to_numpy(dtype=float)[order]
+    # same[i]: row i + 1 continues the ticker of row i.
+    same = t[1:] == t[:-1]
+    frames = []
+
+    def add(check, date_index, ticker_index, value):
+        frames.append(pd.DataFrame({
+            'date': np.asarray(calendar)[date_index],
+            'ticker': np.asarray(symbols, dtype=object)[ticker_index] if ticker_index is not None
+            else np.full(len(date_index), None, dtype=object),
+            'check': check,
+            'value': np.asarray(value, dtype=float),
+        }))
+
+    # Every trading day strictly between two consecutive rows of a ticker is missing, and so is
+    # every day after a ticker's last row; the block end acts as a row after the last date.
+    last = np.r_[~same, True]
+    gaps = np.r_[d[1:] - d[:-1], 0]
+    gaps[last] = len(calendar) - d[last]
+    has_gap = gaps > 1
+    counts = gaps[has_gap] - 1
+    if counts.size:
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        add('missing_day', np.repeat(d[has_gap] + 1, counts) + offsets,
+            np.repeat(t[has_gap], counts), np.repeat(counts, counts))
+
+    keys = pd.DataFrame({'date': d, 'price': prices, 'cap': caps})
+    sharing = keys.groupby(['date', 'price', 'cap'], sort=False)['date'].transform('size').to_numpy()
+    duplicated = sharing > 1
+    add('duplicate_price', d[duplicated], t[duplicated], sharing[duplicated])
+
+    # Length of the run of identical prices ending at each row.
+    changed = np.ones(len(prices), dtype=bool)
+    changed[1:] = ~(same & (prices[1:] == prices[:-1]))
+    run_starts = np.flatnonzero(changed)
+    run_length = np.arange(len(prices)) - run_starts[np.cumsum(changed) - 1] + 1
+    stale = run_length >= stale_days
+    add('stale_price', d[stale], t[stale], run_length[stale])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = prices[1:] / prices[:-1] - 1
+    outlier = same & (np.abs(returns) > max_abs_return)
+    add('outlier_return', d[1:][outlier], t[1:][outlier], returns[outlier])
+
+    universe = np.bincount(date_codes, minlength=len(calendar))
+    thin = np.flatnonzero(universe < min_universe)
+    add('thin_universe', thin, None, universe[thin])
+
+    issues = pd.concat(frames, ignore_index=True)
+    return issues.sort_values(['date', 'check', 'ticker'], kind='stable', na_position='first').reset_index(drop=True)
+
+
+def run_quality_checks(db_manager, full=False, context_days=21, chunk_days=366, metrics=None, **thresholds):
+    """
+    Check the dates written since the last run and persist their issues.
+    Dates whose rows changed are recorded by storage. Each is checked together with the
+    context_days around it, because its rows also decide the gaps, stale runs and returns of its
+    neighbours. Rows are read context_days beyond each checked range, and ranges longer than
+    chunk_days are split, so memory depends on the changed dates, not on the table size. The
+    stored issues of every checked date are replaced. The context is widened to twice stale_days
+    calendar days when that is longer, so a stale run of stale_days rows, weekends and holidays
+    included, is always read whole.
+    :param db_manager: DatabaseManager or ParquetStorageManager.
+    :param full: Check every stored date instead of only the changed ones.
+    :param context_days: Calendar days of neighbouring data used, and rechecked, around a changed date.
+    :param thresholds: min_universe, max_abs_return or stale_days for check_daily_data.
+    :return: dict with the dates and rows checked, the issue count per check and the elapsed seconds.
+    """
+    metrics = metrics if metrics is not None else MetricsRegistry()
+    started = time.perf_counter()
+    stale_days = thresholds.get('stale_days', DEFAULT_STALE_DAYS)
+    context = datetime.timedelta(days=max(context_days, 2 * stale_days))
+    if full:
+        first, last = db_manager.query_date_bounds()
+        ranges = [] if first is None else [(as_date(first), as_date(last))]
+    else:
+        ranges = merge_ranges((as_date(date) - context, as_date(date) + context)
+                              for date in db_manager.query_quality_dirty_dates())
+    summary = {'dates_checked': 0, 'rows_checked': 0, 'issues': dict.fromkeys(CHECKS, 0)}
+    for range_start, range_end in ranges:
+        block_start = range_start
+        while block_start <= range_end:
+            block_end = min(block_start + datetime.timedelta(days=chunk_days - 1), range_end)
+            start, end = block_start.strftime('%Y-%m-%d'), block_end.strftime('%Y-%m-%d')
+            daily_df = db_manager.query_daily_data_range((block_start - context).strftime('%Y-%m-%d'),
+                                                         (block_end + context).strftime('%Y-%m-%d'))
+            issues = check_daily_data(daily_df, **thresholds)
+            issues = issues[(issues['date'] >= start) & (issues['date'] <= end)]
+            db_manager.replace_quality_issues(start, end, issues)
+            in_block = daily_df['date'].between(start, end)
+            summary['dates_checked'] += daily_df.loc[in_block, 'date'].nunique()
+            summary['rows_checked'] += int(in_block.sum())
+            for check, count in issues['check'].value_counts().items():
+                summary['issues'][check] += int(count)
+            block_start = block_end + datetime.timedelta(days=1)
+    summary['seconds'] = time.perf_counter() - started
+    metrics.inc("quality_rows_checked_total", summary['rows_checked'])
+    for check, count in summary['issues'].items():
+        metrics.inc("quality_issues_total", count, check=check)
+    logger.info(f"Checked {summary['rows_checked']} rows on {summary['dates_checked']} dates in "
+                f"{summary['seconds']:.2f}s: {summary['issues']}")
+    return summary
+
+
+if __name__ == "__main__":
+    # The options are defined once, by the validate command of cli.py
+    from cli import main
+    sys.exit(main(["validate"] + sys.argv[1:]))
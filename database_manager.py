@@ -1,61 +1,627 @@
 import logging
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from urllib.request import pathname2url
+import numpy as np
 import pandas as pd
+from ingestion_state import merge_ranges
+from index_analytics import ANALYTICS_COLUMNS
+from index_rebalance import compute_rebalance_events, rebalance_dates_to_refresh
 
 
 
 logger = logging.getLogger(__name__)
 
 
+def encode_date(date):
+    """
+    Encode a date (string, datetime or Timestamp) as the integer YYYYMMDD used by the schema.
+    Raises ValueError for strings that are not dates.
+    """
+    ts = pd.Timestamp(date)
+    return ts.year * 10000 + ts.month * 100 + ts.day
+
+
+def decode_date(date_id):
+    """
+    Decode an integer YYYYMMDD date into a 'YYYY-MM-DD' string.
+    """
+    return f"{date_id // 10000:04d}-{date_id // 100 % 100:02d}-{date_id % 100:02d}"
+
+
+def _date_text(column):
+    # SQL expression rendering an integer YYYYMMDD column as 'YYYY-MM-DD'.
+    return f"printf('%04d-%02d-%02d', {column} / 10000, {column} / 100 % 100, {column} % 100)"
+
+
+def date_ids_to_datetime(date_ids):
+    """
+    Convert integer YYYYMMDD dates into datetime64 values.
+    Each distinct date is parsed once into a lookup table over the range of the ids, so the cost
+    is one gather per row rather than a sort.
+    """
+    date_ids = np.asarray(date_ids, dtype=np.int32)
+    if not len(date_ids):
+        return np.empty(0, dtype='datetime64[ns]')
+    first = int(date_ids.min())
+    offsets = date_ids - first
+    present = np.bincount(offsets) > 0
+    table = np.full(len(present), np.datetime64('NaT'), dtype='datetime64[ns]')
+    table[present] = pd.to_datetime((np.flatnonzero(present) + first).astype(str), format='%Y%m%d').to_numpy()
+    return table[offsets]
+
+
+def compact_daily_frame(columns, tickers, date_ids=False):
+    """
+    Build a compact daily DataFrame from the column arrays of a typed read.
+    :param columns: dict of arrays date_id (int32 YYYYMMDD), ticker_code (position in tickers, -1 if
+                    unknown), closing_price and market_cap.
+    :param tickers: Ticker names, the categories of the ticker column.
+    :param date_ids: Keep the dates as int32 YYYYMMDD instead of converting them to datetime64.
+    :return: DataFrame with columns ticker, closing_price, market_cap and date.
+    """
+    return pd.DataFrame({
+        'ticker': pd.Categorical.from_codes(columns['ticker_code'], categories=pd.Index(tickers, dtype=object)),
+        'closing_price': columns['closing_price'],
+        'market_cap': columns['market_cap'],
+        'date': columns['date_id'] if date_ids else date_ids_to_datetime(columns['date_id']),
+    }, copy=False)
+
+
+def join_daily_chunks(chunks, float32=False):
+    """
+    Concatenate the column arrays of typed read chunks one column at a time, releasing each
+    column's parts once joined, so the peak stays close to one copy of the result.
+    :param chunks: List of dicts as taken by compact_daily_frame; emptied by the call.
+    :param float32: The chunks hold float32 closing prices (sets the dtype when there are none).
+    """
+    columns = {}
+    for name, dtype in (('date_id', np.int32), ('ticker_code', np.int32),
+                        ('closing_price', np.float32 if float32 else np.float64),
+                        ('market_cap', np.float64)):
+        parts = [chunk.pop(name) for chunk in chunks]
+        columns[name] = np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+        del parts
+    return columns
+
+
+# Upsert that leaves identical rows untouched, so only real changes mark index dates dirty.
+UPSERT_DAILY_PRICES = """
+    INSERT INTO daily_prices (date_id, ticker_id, closing_price, market_cap)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (date_id, ticker_id) DO UPDATE SET
+        closing_price = excluded.closing_price,
+        market_cap = excluded.market_cap
+    WHERE closing_price IS NOT excluded.closing_price OR market_cap IS NOT excluded.market_cap
+"""
+
+UPSERT_SHARES_OUTSTANDING = """
+    INSERT INTO shares_outstanding (ticker_id, effective_date_id, shares)
+    VALUES (?, ?, ?)
+    ON CONFLICT (ticker_id, effective_date_id) DO UPDATE SET shares = excluded.shares
+    WHERE shares IS NOT excluded.shares
+"""
+
+# Schema version 1: the original text-keyed tables.
+MIGRATION_1 = """
+    CREATE TABLE IF NOT EXISTS stocks (
+        ticker TEXT PRIMARY KEY,
+        name TEXT
+    );
+    CREATE TABLE IF NOT EXISTS daily_data (
+        date DATE,
+        ticker TEXT,
+        closing_price REAL,
+        market_cap REAL,
+        PRIMARY KEY (date, ticker),
+        FOREIGN KEY (ticker) REFERENCES stocks(ticker)
+    );
+"""
+
+# Schema version 2: integer YYYYMMDD dates and ticker ids, a covering index for the top-N
+# query, and integer-keyed materialized index tables. daily_data stays available as a view
+# whose INSTEAD OF triggers write through to daily_prices.
+MIGRATION_2 = f"""
+    DROP TRIGGER IF EXISTS daily_data_mark_insert;
+    DROP TRIGGER IF EXISTS daily_data_mark_update;
+    DROP TRIGGER IF EXISTS daily_data_mark_delete;
+    DROP TABLE IF EXISTS index_values;
+    DROP TABLE IF EXISTS index_constituents;
+    DROP TABLE IF EXISTS index_dirty_dates;
+    ALTER TABLE stocks RENAME TO stocks_v1;
+    ALTER TABLE daily_data RENAME TO daily_data_v1;
+
+    CREATE TABLE stocks (
+        ticker_id INTEGER PRIMARY KEY,
+        ticker TEXT NOT NULL UNIQUE,
+        name TEXT
+    );
+    CREATE TABLE daily_prices (
+        date_id INTEGER NOT NULL,
+        ticker_id INTEGER NOT NULL REFERENCES stocks(ticker_id),
+        closing_price REAL,
+        market_cap REAL,
+        PRIMARY KEY (date_id, ticker_id)
+    ) WITHOUT ROWID;
+    CREATE INDEX idx_daily_prices_rank ON daily_prices (date_id, market_cap DESC, closing_price, ticker_id);
+    CREATE TABLE index_values (
+        date_id INTEGER PRIMARY KEY,
+        index_value REAL,
+        constituent_count INTEGER
+    );
+    CREATE TABLE index_constituents (
+        date_id INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        ticker_id INTEGER NOT NULL,
+        PRIMARY KEY (date_id, rank)
+    ) WITHOUT ROWID;
+    CREATE TABLE index_dirty_dates (
+        date_id INTEGER PRIMARY KEY
+    );
+
+    CREATE TRIGGER daily_prices_mark_insert AFTER INSERT ON daily_prices
+    BEGIN
+        INSERT INTO index_dirty_dates (date_id) VALUES (NEW.date_id) ON CONFLICT DO NOTHING;
+    END;
+    CREATE TRIGGER daily_prices_mark_update AFTER UPDATE ON daily_prices
+    BEGIN
+        INSERT INTO index_dirty_dates (date_id) VALUES (OLD.date_id) ON CONFLICT DO NOTHING;
+        INSERT INTO index_dirty_dates (date_id) VALUES (NEW.date_id) ON CONFLICT DO NOTHING;
+    END;
+    CREATE TRIGGER daily_prices_mark_delete AFTER DELETE ON daily_prices
+    BEGIN
+        INSERT INTO index_dirty_dates (date_id) VALUES (OLD.date_id) ON CONFLICT DO NOTHING;
+    END;
+
+    INSERT INTO stocks (ticker, name) SELECT ticker, name FROM stocks_v1 ORDER BY ticker;
+    INSERT INTO stocks (ticker) SELECT DISTINCT ticker FROM daily_data_v1 WHERE true ON CONFLICT DO NOTHING;
+    INSERT INTO daily_prices (date_id, ticker_id, closing_price, market_cap)
+    SELECT CAST(strftime('%Y%m%d', d.date) AS INTEGER), s.ticker_id, d.closing_price, d.market_cap
+    FROM daily_data_v1 d JOIN stocks s ON s.ticker = d.ticker
+    WHERE true
+    ON CONFLICT (date_id, ticker_id) DO UPDATE SET
+        closing_price = excluded.closing_price,
+        market_cap = excluded.market_cap;
+    DROP TABLE daily_data_v1;
+    DROP TABLE stocks_v1;
+
+    CREATE VIEW daily_data AS
+    SELECT {_date_text('p.date_id')} AS date, s.ticker, p.closing_price, p.market_cap
+    FROM daily_prices p JOIN stocks s ON s.ticker_id = p.ticker_id;
+    CREATE TRIGGER daily_data_insert INSTEAD OF INSERT ON daily_data
+    BEGIN
+        INSERT INTO stocks (ticker) VALUES (NEW.ticker) ON CONFLICT DO NOTHING;
+        INSERT INTO daily_prices (date_id, ticker_id, closing_price, market_cap)
+        VALUES (CAST(strftime('%Y%m%d', NEW.date) AS INTEGER),
+                (SELECT ticker_id FROM stocks WHERE ticker = NEW.ticker),
+                NEW.closing_price, NEW.market_cap)
+        ON CONFLICT (date_id, ticker_id) DO UPDATE SET
+            closing_price = excluded.closing_price,
+            market_cap = excluded.market_cap
+        WHERE closing_price IS NOT excluded.closing_price OR market_cap IS NOT excluded.market_cap;
+    END;
+    CREATE TRIGGER daily_data_delete INSTEAD OF DELETE ON daily_data
+    BEGIN
+        DELETE FROM daily_prices
+        WHERE date_id = CAST(strftime('%Y%m%d', OLD.date) AS INTEGER)
+          AND ticker_id = (SELECT ticker_id FROM stocks WHERE ticker = OLD.ticker);
+    END;
+"""
+
+# Schema version 3: a single-row data version stamp, bumped whenever a write changes data,
+# so readers can cache results until the next ingestion commit.
+MIGRATION_3 = """
+    CREATE TABLE data_version (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        version INTEGER NOT NULL
+    );
+    INSERT INTO data_version (id, version) VALUES (1, 0);
+"""
+
+# Schema version 4: persisted index rebalance events and daily turnover. Every stored index
+# date is marked dirty so the next refresh fills them in.
+MIGRATION_4 = """
+    CREATE TABLE index_rebalance_events (
+        date_id INTEGER NOT NULL,
+        ticker_id INTEGER NOT NULL,
+        event TEXT NOT NULL CHECK (event IN ('entry', 'exit')),
+        PRIMARY KEY (date_id, ticker_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE index_turnover (
+        date_id INTEGER PRIMARY KEY,
+        entries INTEGER NOT NULL,
+        exits INTEGER NOT NULL,
+        constituent_count INTEGER NOT NULL,
+        turnover REAL NOT NULL
+    );
+    INSERT INTO index_dirty_dates (date_id) SELECT date_id FROM index_values WHERE true ON CONFLICT DO NOTHING;
+"""
+
+# Schema version 5: per-ticker ingestion coverage as inclusive date ranges that have been
+# fetched. Existing data is assumed to cover each ticker's first to last stored date.
+MIGRATION_5 = """
+    CREATE TABLE ingestion_coverage (
+        ticker_id INTEGER NOT NULL REFERENCES stocks(ticker_id),
+        start_date_id INTEGER NOT NULL,
+        end_date_id INTEGER NOT NULL,
+        PRIMARY KEY (ticker_id, start_date_id)
+    ) WITHOUT ROWID;
+    INSERT INTO ingestion_coverage (ticker_id, start_date_id, end_date_id)
+    SELECT ticker_id, MIN(date_id), MAX(date_id) FROM daily_prices GROUP BY ticker_id;
+"""
+
+# Schema version 6: effective-dated shares outstanding, used to compute market caps.
+MIGRATION_6 = """
+    CREATE TABLE shares_outstanding (
+        ticker_id INTEGER NOT NULL REFERENCES stocks(ticker_id),
+        effective_date_id INTEGER NOT NULL,
+        shares REAL NOT NULL,
+        PRIMARY KEY (ticker_id, effective_date_id)
+    ) WITHOUT ROWID;
+"""
+
+# Schema version 7: persisted data-quality issues and the dates still to be checked. Writes copy
+# the dates their triggers marked in index_dirty_dates; every stored date starts unchecked.
+MIGRATION_7 = """
+    CREATE TABLE quality_dirty_dates (
+        date_id INTEGER PRIMARY KEY
+    );
+    CREATE TABLE quality_issues (
+        date_id INTEGER NOT NULL,
+        ticker_id INTEGER REFERENCES stocks(ticker_id),
+        check_name TEXT NOT NULL,
+        value REAL
+    );
+    CREATE INDEX idx_quality_issues_date ON quality_issues (date_id, check_name);
+    INSERT INTO quality_dirty_dates (date_id) SELECT DISTINCT date_id FROM daily_prices WHERE true
+    ON CONFLICT DO NOTHING;
+"""
+
+# Schema version 8: running index analytics per date (see index_analytics.py). Rows from the
+# first date an index refresh changes onwards are dropped and rebuilt from the last valid row.
+MIGRATION_8 = """
+    CREATE TABLE index_analytics (
+        date_id INTEGER PRIMARY KEY,
+        index_value REAL NOT NULL,
+        daily_return REAL,
+        cum_log_return REAL NOT NULL,
+        return_count INTEGER NOT NULL,
+        return_sum REAL NOT NULL,
+        return_sq_sum REAL NOT NULL,
+        volatility REAL,
+        peak REAL NOT NULL,
+        drawdown REAL NOT NULL,
+        max_drawdown REAL NOT NULL,
+        turnover REAL,
+        cum_turnover REAL NOT NULL,
+        market_return REAL,
+        cum_market_log_return REAL NOT NULL,
+        active_count INTEGER NOT NULL,
+        active_sum REAL NOT NULL,
+        active_sq_sum REAL NOT NULL
+    );
+"""
+
+# Schema version 9: intraday snapshots of the live index (see live_index.py), keyed by the
+# snapshot time in microseconds since the epoch.
+MIGRATION_9 = """
+    CREATE TABLE intraday_index_values (
+        timestamp_us INTEGER PRIMARY KEY,
+        index_value REAL,
+        constituent_count INTEGER NOT NULL
+    );
+"""
+
+# Schema version 10: per-ticker date ranges whose shares outstanding records have been fetched,
+# so a run only requests shares that are stale. Existing tickers start uncovered and are
+# refreshed once.
+MIGRATION_10 = """
+    CREATE TABLE shares_coverage (
+        ticker_id INTEGER NOT NULL REFERENCES stocks(ticker_id),
+        start_date_id INTEGER NOT NULL,
+        end_date_id INTEGER NOT NULL,
+        PRIMARY KEY (ticker_id, start_date_id)
+    ) WITHOUT ROWID;
+"""
+
+MIGRATIONS = [
+    (1, MIGRATION_1),
+    (2, MIGRATION_2),
+    (3, MIGRATION_3),
+    (4, MIGRATION_4),
+    (5, MIGRATION_5),
+    (6, MIGRATION_6),
+    (7, MIGRATION_7),
+    (8, MIGRATION_8),
+    (9, MIGRATION_9),
+    (10, MIGRATION_10),
+]
+
+BUMP_DATA_VERSION = "UPDATE data_version SET version = version + 1 WHERE id = 1"
+
+# Run in the same transaction as a write: every date its triggers marked for index refresh
+# is also pending a data-quality check. Copying per transaction avoids a second per-row trigger.
+MARK_QUALITY_DIRTY = """
+    INSERT INTO quality_dirty_dates (date_id) SELECT date_id FROM index_dirty_dates WHERE true
+    ON CONFLICT DO NOTHING
+"""
+
+# Applied to every connection: a 64 MiB page cache per connection, up to 256 MiB of the file
+# memory-mapped so reads skip the page cache copy, and temporary tables and sorts in memory.
+DEFAULT_PRAGMAS = {
+    'cache_size': -65536,
+    'mmap_size': 268435456,
+    'temp_store': 'MEMORY',
+}
+
+
 class DatabaseManager:
     """
     Class to manage SQLite database operations.
+    Dates are stored as integer YYYYMMDD values and tickers as integer ids; the public
+    methods take and return 'YYYY-MM-DD' strings and ticker symbols.
     """
-    def __init__(self, db_path=":memory:"):
-        self.conn = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
-        self.create_tables()
+    def __init__(self, db_path=":memory:", wal=True, synchronous=None, read_only=False, readers=4,
+                 pragmas=None, timeout=30.0):
+        """
+        Every method may be called from any thread. Writes go through one writer connection and
+        are serialized by transaction(); reads borrow a connection from a pool of read-only
+        connections (see reader()), so in WAL mode readers and the writer never block each other.
+        :param db_path: Path to the SQLite database file.
+        :param wal: Switch the database to write-ahead logging. Without WAL, or for an in-memory
+                    database, there is no reader pool and reads share the writer connection.
+        :param synchronous: Optional synchronous pragma (e.g. 'NORMAL' or 'OFF') for faster bulk loads.
+        :param read_only: Open an existing database read-only and without migrating it; writes fail.
+        :param readers: Maximum number of pooled read connections, opened on demand.
+        :param pragmas: Pragmas overriding DEFAULT_PRAGMAS on every connection.
+        :param timeout: Seconds a connection waits for a lock held by another process.
+        """
+        self.db_path = db_path
+        self.read_only = read_only
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        self.timeout = timeout
+        self.conn = self._connect(read_only)
+        if not read_only:
+            if wal and db_path != ":memory:":
+                self.conn.execute("PRAGMA journal_mode=WAL")
+            if synchronous is not None:
+                self.conn.execute(f"PRAGMA synchronous={synchronous}")
+        self._ticker_ids = {}
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        # Separate readers only help when they do not block the writer, i.e. in WAL mode.
+        journal_mode = self.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        self._max_readers = readers if journal_mode.lower() == "wal" else 0
+        self._idle_readers = queue.LifoQueue()
+        self._reader_count = 0
+        self._pool_lock = threading.Lock()
+        if not read_only:
+            self.create_tables()
+
+    def _connect(self, read_only):
+        if read_only:
+            uri = f"file:{pathname2url(os.path.abspath(self.db_path))}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, detect_types=sqlite3.PARSE_DECLTYPES,
+                                   check_same_thread=False, timeout=self.timeout)
+        else:
+            conn = sqlite3.connect(self.db_path, detect_types=sqlite3.PARSE_DECLTYPES,
+                                   check_same_thread=False, timeout=self.timeout)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Run the block as one write transaction on the writer connection, serialized with every
+        other writer of this manager. Commits on success and rolls back on error; nested blocks
+        join the outer transaction, and reads inside the block see its uncommitted writes.
+        :return: The writer connection.
+        """
+        local = self._local
+        if getattr(local, 'writing', False):
+            yield self.conn
+            return
+        with self._write_lock:
+            if self.conn.in_transaction:
+                # Left open by a caller using conn directly.
+                self.conn.commit()
+            self.conn.execute("BEGIN IMMEDIATE")
+            previous_reader = getattr(local, 'reader', None)
+            local.writing, local.reader = True, self.conn
+            try:
+                yield self.conn
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                # Ids registered in the rolled-back transaction no longer exist.
+                self._ticker_ids.clear()
+                raise
+            finally:
+                local.writing, local.reader = False, previous_reader
+
+    @contextmanager
+    def reader(self, timeout=None):
+        """
+        Borrow a read connection for the block. The block runs in one read transaction, so all
+        of its queries see the same committed snapshot; nested blocks on the same thread share
+        the connection. Without a reader pool the writer connection is used under the write lock.
+        :param timeout: Seconds to wait for a free connection; None waits indefinitely.
+        :raises TimeoutError: If no connection frees up within timeout seconds.
+        :return: A sqlite3 connection.
+        """
+        local = self._local
+        if getattr(local, 'reader', None) is not None:
+            yield local.reader
+            return
+        if not self._max_readers:
+            with self._write_lock:
+                local.reader = self.conn
+                try:
+                    yield self.conn
+                finally:
+                    local.reader = None
+            return
+        conn = self._acquire_reader(timeout)
+        local.reader = conn
+        try:
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            local.reader = None
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle_readers.put(conn)
+
+    def _acquire_reader(self, timeout):
+        # Reuse an idle connection, open another while under the limit, or wait for one.
+        try:
+            return self._idle_readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            if self._reader_count < self._max_readers:
+                conn = self._connect(read_only=True)
+                conn.isolation_level = None
+                self._reader_count += 1
+                return conn
+        try:
+            return self._idle_readers.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No read connection became free within {timeout}s.")
 
     def create_tables(self):
         """
-        Create the required tables: stocks and daily_data.
+        Create the required tables, upgrading an existing database to the latest schema version.
         """
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS stocks (
-                ticker TEXT PRIMARY KEY,
-                name TEXT
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS daily_data (
-                date DATE,
-                ticker TEXT,
-                closing_price REAL,
-                market_cap REAL,
-                PRIMARY KEY (date, ticker),
-                FOREIGN KEY (ticker) REFERENCES stocks(ticker)
+        self.migrate()
+
+    def schema_version(self):
+        """
+        Return the schema version recorded in schema_migrations (0 for a new database).
+        """
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                applied_at TEXT
             )
         """)
-        self.conn.commit()
+        return self.conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations").fetchone()[0]
+
+    def migrate(self):
+        """
+        Apply every pending migration in order, each in its own transaction,
+        and record it in schema_migrations.
+        :return: The schema version after migrating.
+        """
+        with self._write_lock:
+            current = self.schema_version()
+            for version, script in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"Migrating database schema to version {version}")
+                try:
+                    self.conn.executescript(
+                        f"BEGIN;\n{script}\n"
+                        f"INSERT INTO schema_migrations (version, applied_at) VALUES ({version}, datetime('now'));\n"
+                        f"COMMIT;"
+                    )
+                except Exception:
+                    if self.conn.in_transaction:
+                        self.conn.rollback()
+                    raise
+                current = version
+        return current
+
+    def get_data_version(self):
+        """
+        Return the data version stamp. It changes whenever a write through this class
+        commits changed rows or refreshes the materialized index.
+        """
+        with self.reader() as conn:
+            return conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()[0]
 
     def insert_stock(self, ticker, name=None):
         """
         Insert a stock into the stocks table if it doesn't already exist.
         """
-        cursor = self.conn.cursor()
-        cursor.execute("INSERT OR REPLACE INTO stocks (ticker, name) VALUES (?, ?)", (ticker, name))
-        self.conn.commit()
+        with self.transaction() as conn:
+            conn.execute("""
+                INSERT INTO stocks (ticker, name) VALUES (?, ?)
+                ON CONFLICT (ticker) DO UPDATE SET name = excluded.name
+            """, (ticker, name))
+
+    def _resolve_ticker_ids(self, tickers):
+        # Map ticker symbols to ids, registering unknown tickers. Ids never change once assigned.
+        # Called inside transaction(), which also guards the cache.
+        missing = [ticker for ticker in tickers if ticker not in self._ticker_ids]
+        if missing:
+            self.conn.executemany("INSERT INTO stocks (ticker) VALUES (?) ON CONFLICT DO NOTHING",
+                                  ((ticker,) for ticker in missing))
+            for offset in range(0, len(missing), 500):
+                chunk = missing[offset:offset + 500]
+                rows = self.conn.execute(
+                    f"SELECT ticker, ticker_id FROM stocks WHERE ticker IN ({','.join('?' * len(chunk))})", chunk)
+                self._ticker_ids.update(rows)
+        return self._ticker_ids
 
     def insert_daily_data(self, date, ticker, closing_price, market_cap):
         """
         Insert daily stock data into the daily_data table.
         """
-        cursor = self.conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO daily_data (date, ticker, closing_price, market_cap)
-            VALUES (?, ?, ?, ?)
-        """, (date, ticker, closing_price, market_cap))
-        self.conn.commit()
+        with self.transaction() as conn:
+            ticker_id = self._resolve_ticker_ids([ticker])[ticker]
+            if conn.execute(UPSERT_DAILY_PRICES, (encode_date(date), ticker_id, closing_price, market_cap)).rowcount:
+                conn.execute(MARK_QUALITY_DIRTY)
+                conn.execute(BUMP_DATA_VERSION)
+
+    def insert_daily_data_bulk(self, data, batch_size=50_000):
+        """
+        Insert daily stock data in bulk.
+        Accepts a DataFrame or an iterable of DataFrames with columns date, ticker,
+        closing_price and market_cap. Each batch is written with executemany inside a single
+        transaction, and tickers not yet in the stocks table are added to it.
+        :param data: DataFrame or iterable of DataFrames.
+        :param batch_size: Maximum number of rows written per transaction.
+        :return: dict with the rows written, elapsed seconds and rows per second.
+        """
+        frames = [data] if isinstance(data, pd.DataFrame) else data
+        rows_written = 0
+        started = time.perf_counter()
+        for frame in frames:
+            for offset in range(0, len(frame), batch_size):
+                batch = frame.iloc[offset:offset + batch_size]
+                rows_written += self._write_daily_batch(batch)
+        elapsed = time.perf_counter() - started
+        stats = {
+            'rows': rows_written,
+            'seconds': elapsed,
+            'rows_per_sec': rows_written / elapsed if elapsed > 0 else 0.0,
+        }
+        logger.info(f"Inserted {rows_written} daily rows in {elapsed:.2f}s ({stats['rows_per_sec']:.0f} rows/sec)")
+        return stats
+
+    def _write_daily_batch(self, batch):
+        # Encode dates and tickers for the whole batch and write it in one transaction.
+        dates = pd.to_datetime(batch['date'])
+        date_ids = dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day
+        tickers = batch['ticker'].astype(str)
+        with self.transaction() as conn:
+            ticker_ids = tickers.map(self._resolve_ticker_ids(tickers.unique().tolist()))
+            changed = conn.executemany(UPSERT_DAILY_PRICES, zip(
+                date_ids.tolist(),
+                ticker_ids.tolist(),
+                batch['closing_price'].astype(float).tolist(),
+                batch['market_cap'].astype(float).tolist(),
+            )).rowcount
+            if changed:
+                conn.execute(MARK_QUALITY_DIRTY)
+                conn.execute(BUMP_DATA_VERSION)
+        return len(batch)
 
     def query_top_stocks(self, date, limit=100):
         """
@@ -63,10 +629,620 @@ class DatabaseManager:
         Returns a pandas DataFrame.
         """
         query = """
-            SELECT ticker, closing_price, market_cap FROM daily_data
-            WHERE date = ?
-            ORDER BY market_cap DESC
+            SELECT s.ticker, p.closing_price, p.market_cap
+            FROM daily_prices p JOIN stocks s ON s.ticker_id = p.ticker_id
+            WHERE p.date_id = ?
+            ORDER BY p.market_cap DESC
             LIMIT ?
         """
-        df = pd.read_sql_query(query, self.conn, params=(date, limit))
-        return df
\ No newline at end of file
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(encode_date(date), limit))
+
+    def iter_daily_arrays(self, start_date, end_date, chunksize=100_000, float32=False):
+        """
+        Stream the daily rows between start_date and end_date (inclusive), ordered by date and
+        market cap, as typed column arrays.
+        Only the integer date and ticker ids are read, and each fetched chunk of row tuples is
+        converted to NumPy arrays before the next one is fetched, so no per-row strings are built.
+        :param chunksize: Rows per chunk.
+        :param float32: Return closing prices as float32. Market caps stay float64, so the
+                        ranking by market cap is unchanged.
+        :return: Tuple (tickers, chunks): the ticker names and an iterator of dicts of arrays
+                 date_id, ticker_code, closing_price and market_cap (see compact_daily_frame).
+        """
+        with self.reader() as conn:
+            stocks = conn.execute("SELECT ticker_id, ticker FROM stocks ORDER BY ticker_id").fetchall()
+        ids = np.array([ticker_id for ticker_id, _ in stocks], dtype=np.int64)
+        codes = np.full(int(ids.max()) + 1 if len(ids) else 1, -1, dtype=np.int32)
+        codes[ids] = np.arange(len(ids), dtype=np.int32)
+        tickers = [ticker for _, ticker in stocks]
+
+        def chunks():
+            query = """
+                SELECT date_id, ticker_id, closing_price, market_cap
+                FROM daily_prices
+                WHERE date_id BETWEEN ? AND ?
+                ORDER BY date_id, market_cap DESC
+            """
+            # The connection stays borrowed until the last chunk has been read.
+            with self.reader() as conn:
+                cursor = conn.execute(query, (encode_date(start_date), encode_date(end_date)))
+                while True:
+                    rows = cursor.fetchmany(chunksize)
+                    if not rows:
+                        break
+                    values = np.array(rows, dtype=np.float64)
+                    del rows
+                    yield {
+                        'date_id': values[:, 0].astype(np.int32),
+                        'ticker_code': codes[values[:, 1].astype(np.int64)],
+                        'closing_price': values[:, 2].astype(np.float32 if float32 else np.float64),
+                        'market_cap': values[:, 3].copy(),
+                    }
+
+        return tickers, chunks()
+
+    def iter_daily_data(self, start_date, end_date, chunksize=100_000, float32=False, date_ids=False):
+        """
+        Stream the daily rows between start_date and end_date (inclusive) as compact DataFrames,
+        for ranges too large to hold at once.
+        :param float32: Return closing prices as float32.
+        :param date_ids: Return dates as int32 YYYYMMDD instead of datetime64.
+        :return: Iterator of DataFrames with columns ticker (categorical over every stored ticker),
+                 closing_price, market_cap and date, ordered by date and market cap.
+        """
+        tickers, chunks = self.iter_daily_arrays(start_date, end_date, chunksize=chunksize, float32=float32)
+        for columns in chunks:
+            yield compact_daily_frame(columns, tickers, date_ids=date_ids)
+
+    def query_daily_data_range(self, start_date, end_date, compact=False, float32=False, date_ids=False):
+        """
+        Query all daily rows between start_date and end_date (inclusive),
+        ordered by date and market cap.
+        Returns a pandas DataFrame with columns ticker, closing_price, market_cap and date.
+        :param compact: Return the typed representation of iter_daily_data (categorical tickers,
+                        datetime64 dates) instead of ticker and 'YYYY-MM-DD' strings, built from
+                        chunked reads at a fraction of the memory.
+        :param float32: With compact, return closing prices as float32.
+        :param date_ids: With compact, return dates as int32 YYYYMMDD.
+        """
+        if compact:
+            tickers, chunks = self.iter_daily_arrays(start_date, end_date, float32=float32)
+            return compact_daily_frame(join_daily_chunks(list(chunks), float32=float32), tickers,
+                                       date_ids=date_ids)
+        query = f"""
+            SELECT s.ticker, p.closing_price, p.market_cap, {_date_text('p.date_id')} AS date
+            FROM daily_prices p JOIN stocks s ON s.ticker_id = p.ticker_id
+            WHERE p.date_id BETWEEN ? AND ?
+            ORDER BY p.date_id, p.market_cap DESC
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(encode_date(start_date), encode_date(end_date)))
+
+    def query_daily_data_since(self, starts):
+        """
+        Query the daily rows of each given ticker from its own start date on.
+        Only those tickers' rows are read, so a revision of a few tickers does not load the
+        whole table from the earliest revised date.
+        :param starts: Dict mapping ticker -> first date to return.
+        :return: DataFrame with columns ticker, closing_price, market_cap and date, ordered by date and ticker.
+        """
+        items = [(ticker, encode_date(date)) for ticker, date in starts.items()]
+        frames = []
+        with self.reader() as conn:
+            for offset in range(0, len(items), 400):
+                chunk = items[offset:offset + 400]
+                query = f"""
+                    WITH revised (ticker, start_id) AS (VALUES {','.join(['(?, ?)'] * len(chunk))})
+                    SELECT s.ticker, p.closing_price, p.market_cap, {_date_text('p.date_id')} AS date
+                    FROM revised r JOIN stocks s ON s.ticker = r.ticker
+                    JOIN daily_prices p ON p.ticker_id = s.ticker_id AND p.date_id >= r.start_id
+                    WHERE p.date_id >= ?
+                    ORDER BY p.date_id, s.ticker
+                """
+                params = [value for item in chunk for value in item] + [min(start_id for _, start_id in chunk)]
+                frames.append(pd.read_sql_query(query, conn, params=params))
+        if not frames:
+            return pd.DataFrame({'ticker': pd.Series(dtype=object), 'closing_price': pd.Series(dtype=float),
+                                 'market_cap': pd.Series(dtype=float), 'date': pd.Series(dtype=object)})
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True).sort_values(['date', 'ticker'], kind='stable') \
+            .reset_index(drop=True)
+
+    def query_date_bounds(self):
+        """
+        Return the earliest and latest dates in daily_data as 'YYYY-MM-DD' strings,
+        or (None, None) if the table is empty.
+        """
+        with self.reader() as conn:
+            # Separate subqueries, so each bound is one primary-key lookup instead of a table scan.
+            first, last = conn.execute("SELECT (SELECT MIN(date_id) FROM daily_prices), "
+                                       "(SELECT MAX(date_id) FROM daily_prices)").fetchone()
+        if first is None:
+            return None, None
+        return decode_date(first), decode_date(last)
+
+    def query_top_stocks_range(self, start_date, end_date, limit=100):
+        """
+        Query the top stocks by market cap for every date between start_date and end_date
+        (inclusive) in a single pass.
+        Tickers are ranked per date with a window function over the covering
+        (date_id, market_cap DESC) index, so the range is read once and needs no sort.
+        Returns a pandas DataFrame with columns date, ticker, closing_price, market_cap and rank.
+        """
+        query = f"""
+            SELECT {_date_text('r.date_id')} AS date, s.ticker, r.closing_price, r.market_cap, r.rank
+            FROM (
+                SELECT date_id, ticker_id, closing_price, market_cap,
+                       ROW_NUMBER() OVER (PARTITION BY date_id ORDER BY market_cap DESC) AS rank
+                FROM daily_prices
+                WHERE date_id BETWEEN ? AND ?
+            ) r
+            JOIN stocks s ON s.ticker_id = r.ticker_id
+            WHERE r.rank <= ?
+            ORDER BY r.date_id, r.rank
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(encode_date(start_date), encode_date(end_date), limit))
+
+    def refresh_index_tables(self, limit=100):
+        """
+        Recompute index_values and index_constituents for the dates marked dirty since the
+        last refresh, in one transaction, together with the rebalance events and turnover of
+        those dates and the dates that follow them.
+        Constituents are the top stocks by market cap and the index value is the average of
+        their closing prices.
+        :param limit: Number of constituents per date.
+        :return: Number of dates recomputed.
+        """
+        with self.transaction() as conn:
+            cursor = conn.cursor()
+            dirty_ids = [row[0] for row in cursor.execute("SELECT date_id FROM index_dirty_dates")]
+            dirty_count = len(dirty_ids)
+            if dirty_count:
+                cursor.execute("DELETE FROM index_constituents WHERE date_id IN (SELECT date_id FROM index_dirty_dates)")
+                cursor.execute("DELETE FROM index_values WHERE date_id IN (SELECT date_id FROM index_dirty_dates)")
+                cursor.execute("""
+                    INSERT INTO index_constituents (date_id, rank, ticker_id)
+                    SELECT date_id, rank, ticker_id
+                    FROM (
+                        SELECT date_id, ticker_id,
+                               ROW_NUMBER() OVER (PARTITION BY date_id ORDER BY market_cap DESC) AS rank
+                        FROM daily_prices
+                        WHERE date_id IN (SELECT date_id FROM index_dirty_dates)
+                    )
+                    WHERE rank <= ?
+                """, (limit,))
+                cursor.execute("""
+                    INSERT INTO index_values (date_id, index_value, constituent_count)
+                    SELECT c.date_id, AVG(p.closing_price), COUNT(*)
+                    FROM index_constituents c
+                    JOIN daily_prices p ON p.date_id = c.date_id AND p.ticker_id = c.ticker_id
+                    WHERE c.date_id IN (SELECT date_id FROM index_dirty_dates)
+                    GROUP BY c.date_id
+                """)
+                self._refresh_rebalance_events(cursor, dirty_ids)
+                # Running analytics accumulate over dates, so every row after a change is stale.
+                cursor.execute("DELETE FROM index_analytics WHERE date_id >= ?", (min(dirty_ids),))
+                # Also catches dates changed by writes that bypass this class, e.g. through the daily_data view.
+                cursor.execute(MARK_QUALITY_DIRTY)
+                cursor.execute("DELETE FROM index_dirty_dates")
+                cursor.execute(BUMP_DATA_VERSION)
+        if dirty_count:
+            logger.info(f"Refreshed materialized index for {dirty_count} dates.")
+        return dirty_count
+
+    def _refresh_rebalance_events(self, cursor, dirty_ids):
+        # Diff the constituents of each affected date against its predecessor.
+        stored = np.array([row[0] for row in cursor.execute("SELECT date_id FROM index_values ORDER BY date_id")],
+                          dtype=np.int64)
+        refresh, needed = rebalance_dates_to_refresh(stored, dirty_ids)
+        stale = sorted(refresh.union(dirty_ids))
+        cursor.executemany("DELETE FROM index_rebalance_events WHERE date_id = ?", ((d,) for d in stale))
+        cursor.executemany("DELETE FROM index_turnover WHERE date_id = ?", ((d,) for d in stale))
+        if not refresh:
+            return
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS rebalance_dates (date_id INTEGER PRIMARY KEY)")
+        cursor.execute("DELETE FROM temp.rebalance_dates")
+        cursor.executemany("INSERT INTO temp.rebalance_dates (date_id) VALUES (?)", ((d,) for d in sorted(needed)))
+        constituents_df = pd.read_sql_query("""
+            SELECT c.date_id, c.ticker_id
+            FROM index_constituents c JOIN temp.rebalance_dates r ON r.date_id = c.date_id
+        """, cursor.connection)
+        events_df, turnover_df = compute_rebalance_events(constituents_df, 'date_id', 'ticker_id')
+        events_df = events_df[events_df['date_id'].isin(refresh)]
+        turnover_df = turnover_df[turnover_df['date_id'].isin(refresh)]
+        cursor.executemany(
+            "INSERT INTO index_rebalance_events (date_id, ticker_id, event) VALUES (?, ?, ?)",
+            zip(events_df['date_id'].tolist(), events_df['ticker_id'].tolist(), events_df['event'].tolist()))
+        cursor.executemany(
+            "INSERT INTO index_turnover (date_id, entries, exits, constituent_count, turnover) VALUES (?, ?, ?, ?, ?)",
+            zip(turnover_df['date_id'].tolist(), turnover_df['entries'].tolist(), turnover_df['exits'].tolist(),
+                turnover_df['constituent_count'].tolist(), turnover_df['turnover'].tolist()))
+
+    def query_rebalance_events(self, start_date, end_date):
+        """
+        Read the persisted index entries and exits between start_date and end_date (inclusive).
+        Returns a pandas DataFrame with columns date, ticker and event ('entry' or 'exit').
+        """
+        query = f"""
+            SELECT {_date_text('e.date_id')} AS date, s.ticker, e.event
+            FROM index_rebalance_events e JOIN stocks s ON s.ticker_id = e.ticker_id
+            WHERE e.date_id BETWEEN ? AND ?
+            ORDER BY e.date_id, e.event, s.ticker
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(encode_date(start_date), encode_date(end_date)))
+
+    def query_turnover(self, start_date, end_date):
+        """
+        Read the persisted daily index turnover between start_date and end_date (inclusive).
+        Returns a pandas DataFrame with columns date, entries, exits, constituent_count and turnover.
+        """
+        query = f"""
+            SELECT {_date_text('date_id')} AS date, entries, exits, constituent_count, turnover
+            FROM index_turnover
+            WHERE date_id BETWEEN ? AND ?
+            ORDER BY date_id
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(encode_date(start_date), encode_date(end_date)))
+
+    def query_index_values(self, start_date, end_date):
+        """
+        Read the materialized index values between start_date and end_date (inclusive).
+        Returns a pandas DataFrame with columns date, index_value and constituent_count.
+        """
+        query = f"""
+            SELECT {_date_text('date_id')} AS date, index_value, constituent_count FROM index_values
+            WHERE date_id BETWEEN ? AND ?
+            ORDER BY date_id
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(encode_date(start_date), encode_date(end_date)))
+
+    def query_market_returns(self, start_date, end_date):
+        """
+        Compute the market-cap-weighted price return of every stored ticker on each index date
+        between start_date and end_date (inclusive), relative to the previous index date. Only
+        tickers priced on both dates count, weighted by their previous market cap.
+        Returns a pandas DataFrame with columns date and market_return.
+        """
+        start_id, end_id = encode_date(start_date), encode_date(end_date)
+        query = f"""
+            WITH dates AS (
+                SELECT date_id, LAG(date_id) OVER (ORDER BY date_id) AS prev_id
+                FROM index_values
+                WHERE date_id BETWEEN COALESCE((SELECT MAX(date_id) FROM index_values WHERE date_id < ?), ?) AND ?
+            )
+            SELECT {_date_text('d.date_id')} AS date,
+                   SUM(q.market_cap * p.closing_price / q.closing_price) / SUM(q.market_cap) - 1 AS market_return
+            FROM dates d
+            JOIN daily_prices p ON p.date_id = d.date_id
+            JOIN daily_prices q ON q.date_id = d.prev_id AND q.ticker_id = p.ticker_id
+            WHERE d.date_id >= ? AND q.closing_price > 0 AND q.market_cap > 0
+            GROUP BY d.date_id
+            ORDER BY d.date_id
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(start_id, start_id, end_id, start_id))
+
+    def query_index_analytics(self, start_date=None, end_date=None):
+        """
+        Read the stored running index analytics, optionally between start_date and end_date (inclusive).
+        Returns a pandas DataFrame with the columns of index_analytics.ANALYTICS_COLUMNS.
+        """
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("date_id >= ?")
+            params.append(encode_date(start_date))
+        if end_date is not None:
+            conditions.append("date_id <= ?")
+            params.append(encode_date(end_date))
+        query = f"""
+            SELECT {_date_text('date_id')} AS date, {', '.join(ANALYTICS_COLUMNS[1:])} FROM index_analytics
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY date_id
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def query_last_index_analytics(self, n=1):
+        """
+        Read the n most recent stored index analytics rows, oldest first.
+        """
+        query = f"""
+            SELECT * FROM (
+                SELECT date_id, {_date_text('date_id')} AS date, {', '.join(ANALYTICS_COLUMNS[1:])}
+                FROM index_analytics ORDER BY date_id DESC LIMIT ?
+            ) ORDER BY date_id
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(n,)).drop(columns=['date_id'])
+
+    def append_index_analytics(self, analytics_df):
+        """
+        Store index analytics rows, replacing any stored rows of the same dates.
+        :param analytics_df: DataFrame with the columns of index_analytics.ANALYTICS_COLUMNS.
+        """
+        dates = pd.to_datetime(analytics_df['date'])
+        columns = ANALYTICS_COLUMNS[1:]
+        values = analytics_df[columns].astype(object).where(analytics_df[columns].notna(), None)
+        with self.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO index_analytics (date_id, {', '.join(columns)}) "
+                f"VALUES ({', '.join('?' * (len(columns) + 1))})",
+                zip((dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).tolist(),
+                    *(values[column].tolist() for column in columns)))
+
+    def append_intraday_index_values(self, snapshots_df):
+        """
+        Store a batch of live index snapshots in one transaction, replacing any stored snapshot
+        with the same timestamp.
+        :param snapshots_df: DataFrame with columns timestamp, index_value and constituent_count.
+        """
+        timestamps = pd.to_datetime(snapshots_df['timestamp']).astype('datetime64[us]').astype(np.int64)
+        values = snapshots_df['index_value'].astype(object).where(snapshots_df['index_value'].notna(), None)
+        with self.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO intraday_index_values (timestamp_us, index_value, constituent_count) "
+                "VALUES (?, ?, ?)",
+                zip(timestamps.tolist(), values.tolist(), snapshots_df['constituent_count'].astype(int).tolist()))
+
+    def query_intraday_index_values(self, start=None, end=None):
+        """
+        Read the stored live index snapshots, optionally between the start and end timestamps (inclusive).
+        Returns a pandas DataFrame with columns timestamp (datetime64), index_value and constituent_count.
+        """
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("timestamp_us >= ?")
+            params.append(pd.Timestamp(start).value // 1000)
+        if end is not None:
+            conditions.append("timestamp_us <= ?")
+            params.append(pd.Timestamp(end).value // 1000)
+        query = f"""
+            SELECT timestamp_us, index_value, constituent_count FROM intraday_index_values
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY timestamp_us
+        """
+        with self.reader() as conn:
+            df = pd.read_sql_query(query, conn, params=params)
+        df.insert(0, 'timestamp', pd.to_datetime(df.pop('timestamp_us'), unit='us'))
+        return df
+
+    def query_index_constituents(self, date):
+        """
+        Read the materialized index constituents for a given date, ordered by rank.
+        Returns a pandas DataFrame with columns ticker and rank.
+        """
+        query = """
+            SELECT s.ticker, c.rank
+            FROM index_constituents c JOIN stocks s ON s.ticker_id = c.ticker_id
+            WHERE c.date_id = ?
+            ORDER BY c.rank
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=(encode_date(date),))
+
+    def query_ingestion_coverage(self, tickers=None):
+        """
+        Return the covered (already fetched) inclusive date ranges of each ticker.
+        :param tickers: Optional list of tickers to restrict to.
+        :return: DataFrame with columns ticker, start_date and end_date, ordered by ticker and start.
+        """
+        return self._query_coverage("ingestion_coverage", tickers)
+
+    def query_shares_coverage(self, tickers=None):
+        """
+        Return the inclusive date ranges whose shares outstanding records have been fetched,
+        like query_ingestion_coverage.
+        """
+        return self._query_coverage("shares_coverage", tickers)
+
+    def _query_coverage(self, table, tickers):
+        query = f"""
+            SELECT s.ticker, {_date_text('c.start_date_id')} AS start_date, {_date_text('c.end_date_id')} AS end_date
+            FROM {table} c JOIN stocks s ON s.ticker_id = c.ticker_id
+            {{where}}
+            ORDER BY s.ticker, c.start_date_id
+        """
+        return self._query_for_tickers(query, tickers, ['ticker', 'start_date'])
+
+    def _query_for_tickers(self, query, tickers, order_by):
+        # Run query, whose {where} placeholder filters on s.ticker, for all tickers or for the
+        # given ones in chunks that stay under SQLite's parameter limit.
+        with self.reader() as conn:
+            if tickers is None:
+                return pd.read_sql_query(query.format(where=""), conn)
+            tickers = list(dict.fromkeys(tickers))
+            frames = [
+                pd.read_sql_query(query.format(where=f"WHERE s.ticker IN ({','.join('?' * len(chunk))})"),
+                                  conn, params=chunk)
+                for chunk in (tickers[offset:offset + 500] for offset in range(0, len(tickers), 500))
+            ]
+            if not frames:
+                return pd.read_sql_query(query.format(where="WHERE 0"), conn)
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True).sort_values(order_by, kind='stable').reset_index(drop=True)
+
+    def record_ingestion_coverage(self, tickers, start_date, end_date):
+        """
+        Mark [start_date, end_date] (inclusive) as fetched for each ticker, merging it with the
+        ticker's existing ranges so each ticker keeps as few ranges as possible.
+        """
+        self._record_coverage("ingestion_coverage", tickers, start_date, end_date)
+
+    def record_shares_coverage(self, tickers, start_date, end_date):
+        """
+        Mark the shares outstanding of [start_date, end_date] (inclusive) as fetched for each
+        ticker, like record_ingestion_coverage.
+        """
+        self._record_coverage("shares_coverage", tickers, start_date, end_date)
+
+    def _record_coverage(self, table, tickers, start_date, end_date):
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return
+        with self.transaction() as conn:
+            known_ids = self._resolve_ticker_ids(tickers)
+            ids = [known_ids[ticker] for ticker in tickers]
+            ranges = {ticker_id: [(start_date, end_date)] for ticker_id in ids}
+            for offset in range(0, len(ids), 500):
+                chunk = ids[offset:offset + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT ticker_id, start_date_id, end_date_id FROM {table} "
+                    f"WHERE ticker_id IN ({placeholders})", chunk).fetchall()
+                for ticker_id, start_id, end_id in rows:
+                    ranges[ticker_id].append((decode_date(start_id), decode_date(end_id)))
+                conn.execute(f"DELETE FROM {table} WHERE ticker_id IN ({placeholders})", chunk)
+            conn.executemany(
+                f"INSERT INTO {table} (ticker_id, start_date_id, end_date_id) VALUES (?, ?, ?)",
+                [(ticker_id, encode_date(start), encode_date(end))
+                 for ticker_id, ticker_ranges in ranges.items() for start, end in merge_ranges(ticker_ranges)])
+
+    def query_shares_outstanding(self, tickers=None):
+        """
+        Return the effective-dated shares outstanding records.
+        :param tickers: Optional list of tickers to restrict to.
+        :return: DataFrame with columns ticker, effective_date and shares, ordered by ticker and date.
+        """
+        query = f"""
+            SELECT s.ticker, {_date_text('o.effective_date_id')} AS effective_date, o.shares
+            FROM shares_outstanding o JOIN stocks s ON s.ticker_id = o.ticker_id
+            {{where}}
+            ORDER BY s.ticker, o.effective_date_id
+        """
+        return self._query_for_tickers(query, tickers, ['ticker', 'effective_date'])
+
+    def upsert_shares_outstanding(self, shares_df):
+        """
+        Insert or revise shares outstanding records.
+        :param shares_df: DataFrame with columns ticker, effective_date and shares.
+        :return: Dict mapping each ticker with new or changed records to its earliest such
+                 effective date ('YYYY-MM-DD'), i.e. where its market caps must be recomputed.
+        """
+        if shares_df.empty:
+            return {}
+        dates = pd.to_datetime(shares_df['effective_date'])
+        date_ids = (dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).tolist()
+        tickers = shares_df['ticker'].astype(str)
+        revised = {}
+        with self.transaction() as conn:
+            ticker_ids = tickers.map(self._resolve_ticker_ids(tickers.unique().tolist())).tolist()
+            cursor = conn.cursor()
+            for ticker, ticker_id, date_id, shares in zip(tickers.tolist(), ticker_ids, date_ids,
+                                                          shares_df['shares'].astype(float).tolist()):
+                if cursor.execute(UPSERT_SHARES_OUTSTANDING, (ticker_id, date_id, shares)).rowcount:
+                    revised[ticker] = min(revised.get(ticker, date_id), date_id)
+        return {ticker: decode_date(date_id) for ticker, date_id in revised.items()}
+
+    def query_quality_dirty_dates(self):
+        """
+        Return the dates whose rows changed since their last data-quality check.
+        :return: Sorted list of 'YYYY-MM-DD' strings.
+        """
+        with self.reader() as conn:
+            rows = conn.execute("SELECT date_id FROM quality_dirty_dates ORDER BY date_id").fetchall()
+        return [decode_date(date_id) for date_id, in rows]
+
+    def replace_quality_issues(self, start_date, end_date, issues_df):
+        """
+        Replace the stored data-quality issues between start_date and end_date (inclusive) and
+        mark those dates as checked, in one transaction.
+        :param issues_df: DataFrame with columns date, ticker (None for date-level issues), check and value.
+        """
+        start_id, end_id = encode_date(start_date), encode_date(end_date)
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM quality_issues WHERE date_id BETWEEN ? AND ?", (start_id, end_id))
+            if len(issues_df):
+                tickers = issues_df['ticker']
+                ticker_ids = self._resolve_ticker_ids(tickers.dropna().unique().tolist())
+                dates = pd.to_datetime(issues_df['date'])
+                conn.executemany(
+                    "INSERT INTO quality_issues (date_id, ticker_id, check_name, value) VALUES (?, ?, ?, ?)",
+                    zip((dates.dt.year * 10000 + dates.dt.month * 100 + dates.dt.day).tolist(),
+                        [None if pd.isna(ticker) else ticker_ids[ticker] for ticker in tickers.tolist()],
+                        issues_df['check'].tolist(), issues_df['value'].astype(float).tolist()))
+            conn.execute("DELETE FROM quality_dirty_dates WHERE date_id BETWEEN ? AND ?", (start_id, end_id))
+
+    def query_quality_issues(self, start_date=None, end_date=None, checks=None):
+        """
+        Read the persisted data-quality issues, optionally between start_date and end_date
+        (inclusive) and for the given checks only.
+        Returns a pandas DataFrame with columns date, ticker, check and value, ordered by date,
+        check and ticker.
+        """
+        conditions, params = [], []
+        if start_date is not None:
+            conditions.append("q.date_id >= ?")
+            params.append(encode_date(start_date))
+        if end_date is not None:
+            conditions.append("q.date_id <= ?")
+            params.append(encode_date(end_date))
+        if checks is not None:
+            checks = list(checks)
+            conditions.append(f"q.check_name IN ({','.join('?' * len(checks))})")
+            params.extend(checks)
+        query = f"""
+            SELECT {_date_text('q.date_id')} AS date, s.ticker, q.check_name AS "check", q.value
+            FROM quality_issues q LEFT JOIN stocks s ON s.ticker_id = q.ticker_id
+            {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+            ORDER BY q.date_id, q.check_name, s.ticker
+        """
+        with self.reader() as conn:
+            return pd.read_sql_query(query, conn, params=params)
+
+    def iter_index_composition(self, start_date, end_date, chunksize=50_000):
+        """
+        Stream the materialized index composition between start_date and end_date (inclusive)
+        in chunks, for exports of long histories that should not be loaded at once.
+        :return: Iterator of DataFrames with columns date, rank, ticker, closing_price and market_cap,
+                 ordered by date and rank.
+        """
+        query = f"""
+            SELECT {_date_text('c.date_id')} AS date, c.rank, s.ticker, p.closing_price, p.market_cap
+            FROM index_constituents c
+            JOIN stocks s ON s.ticker_id = c.ticker_id
+            JOIN daily_prices p ON p.date_id = c.date_id AND p.ticker_id = c.ticker_id
+            WHERE c.date_id BETWEEN ? AND ?
+            ORDER BY c.date_id, c.rank
+        """
+        # The connection stays borrowed until the last chunk has been read.
+        with self.reader() as conn:
+            yield from pd.read_sql_query(query, conn, params=(encode_date(start_date), encode_date(end_date)),
+                                         chunksize=chunksize)
+
+    def close(self):
+        """
+        Close the writer connection and the idle pooled read connections.
+        """
+        while True:
+            try:
+                self._idle_readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self.conn.close()
+
+
+def open_storage(backend=None, path=None, wal=True, synchronous=None):
+    """
+    Open the storage backend selected by configuration.
+    The backend defaults to the HEDGINEER_STORAGE_BACKEND environment variable ('sqlite' or
+    'parquet', default 'sqlite') and the path to HEDGINEER_STORAGE_PATH (default 'data.db'
+    for SQLite and 'data_parquet' for Parquet).
+    :param wal: Enable write-ahead logging (SQLite only).
+    :param synchronous: Optional synchronous pragma (SQLite only).
+    :return: DatabaseManager or ParquetStorageManager.
+    """
+    backend = backend or os.environ.get("HEDGINEER_STORAGE_BACKEND", "sqlite")
+    path = path or os.environ.get("HEDGINEER_STORAGE_PATH")
+    if backend == "sqlite":
+        return DatabaseManager(db_path=path or "data.db", wal=wal, synchronous=synchronous)
+    if backend == "parquet":
+        from parquet_storage import ParquetStorageManager
+        return ParquetStorageManager(root_dir=path or "data_parquet")
+    raise ValueError(f"Unknown storage backend: {backend}")
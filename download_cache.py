@@ -0,0 +1,260 @@
+import datetime
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import quote, unquote
+import pandas as pd
+from data_fetcher import DataProvider
+from ingestion_state import ONE_DAY, as_date, merge_ranges, missing_ranges
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+# A cached download: inclusive date range, fetch time (epoch seconds) and Parquet file.
+Segment = namedtuple('Segment', ['start', 'end', 'fetched_at', 'path'])
+
+# Cached datasets, by the file name prefix of their segments: daily bars and shares outstanding
+# records, with the date column a segment's range applies to and the columns of an empty frame.
+PRICES, SHARES = "", "shares_"
+DATE_COLUMNS = {PRICES: 'Date', SHARES: 'effective_date'}
+EMPTY_COLUMNS = {PRICES: ['Date', 'Close'], SHARES: ['ticker', 'effective_date', 'shares']}
+
+
+class CachingProvider(DataProvider):
+    """
+    DataProvider that keeps every downloaded per-ticker frame in a local Parquet cache and only
+    asks the wrapped provider for the date ranges it does not hold.
+    Each ticker has a directory of segments named by their inclusive date range and fetch time.
+    Days that were already settle_days old when they were fetched never expire; more recent days
+    are refetched once the segment is older than ttl seconds, since the provider may still revise
+    them. A new download is merged with the cached segments it touches, so each ticker keeps
+    one file per contiguous range. Shares outstanding records are cached the same way, in
+    segments over their effective dates.
+    :param provider: Provider used for cache misses; None is allowed only when offline.
+    :param cache_dir: Root directory of the cache.
+    :param ttl: Seconds during which recent days are served from the cache.
+    :param settle_days: Age in days after which a downloaded day is final.
+    :param offline: Serve everything cached, expired or not, and never call the provider.
+    :param clock: Function returning the current time in epoch seconds.
+    """
+    def __init__(self, provider, cache_dir="download_cache", ttl=6 * 3600, settle_days=5, offline=False,
+                 metrics=None, clock=time.time):
+        if provider is None and not offline:
+            raise ValueError("A provider is required unless the cache is offline.")
+        self.provider = provider
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.settle_days = settle_days
+        self.offline = offline
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.clock = clock
+        self._segments = {}
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _ticker_dir(self, ticker):
+        return os.path.join(self.cache_dir, quote(ticker, safe=""))
+
+    def segments(self, ticker, kind=PRICES):
+        """
+        Return the cached segments of a ticker, oldest fetch first.
+        :param kind: PRICES or SHARES.
+        """
+        with self._lock:
+            if (ticker, kind) not in self._segments:
+                found = []
+                ticker_dir = self._ticker_dir(ticker)
+                for name in os.listdir(ticker_dir) if os.path.isdir(ticker_dir) else []:
+                    if not name.endswith(".parquet"):
+                        continue
+                    parts = name[:-len(".parquet")].split("_")
+                    if len(parts) != 3 + bool(kind) or (kind and parts[0] != kind.rstrip("_")):
+                        continue
+                    start, end, fetched_at = parts[-3:]
+                    found.append(Segment(as_date(start), as_date(end), int(fetched_at),
+                                         os.path.join(ticker_dir, name)))
+                self._segments[ticker, kind] = sorted(found, key=lambda s: (s.fetched_at, s.start))
+            return list(self._segments[ticker, kind])
+
+    def tickers(self):
+        """
+        Return every ticker with cached data.
+        """
+        return sorted(unquote(name) for name in os.listdir(self.cache_dir)
+                      if os.path.isdir(os.path.join(self.cache_dir, name)))
+
+    def _valid_end(self, segment, now):
+        # Last day of the segment that may still be served at time now.
+        if self.offline or now - segment.fetched_at < self.ttl:
+            return segment.end
+        return min(segment.end, self._settled_until(segment.fetched_at) - ONE_DAY)
+
+    def _settled_until(self, fetched_at):
+        # Days before this date were final when fetched_at's download ran.
+        return datetime.date.fromtimestamp(fetched_at) - datetime.timedelta(days=self.settle_days)
+
+    @staticmethod
+    def _read(path, start, end, kind=PRICES):
+        df = pd.read_parquet(path)
+        dates = pd.to_datetime(df[DATE_COLUMNS[kind]])
+        return df[(dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))]
+
+    def _gaps(self, ticker, start, last, now, kind):
+        # The days of [start, last] a ticker has no valid cached segment for.
+        valid = [(s.start, self._valid_end(s, now)) for s in self.segments(ticker, kind)]
+        return missing_ranges([(s, e) for s, e in valid if e >= s], start, last)
+
+    def _plan(self, tickers, start, last, now, kind):
+        # Group the tickers by the uncached window of [start, last] they need.
+        windows = {}
+        for ticker in dict.fromkeys(tickers):
+            if self.offline:
+                continue
+            # Bridging a few cached days is cheaper than another request.
+            for window in merge_ranges(self._gaps(ticker, start, last, now, kind), gap_days=7):
+                windows.setdefault(window, []).append(ticker)
+        hits = set(tickers) - {ticker for group in windows.values() for ticker in group}
+        dataset = "shares" if kind == SHARES else "prices"
+        self.metrics.inc("download_cache_tickers_total", len(hits), result="hit", dataset=dataset)
+        self.metrics.inc("download_cache_tickers_total", len(set(tickers)) - len(hits), result="miss", dataset=dataset)
+        return windows
+
+    def download(self, tickers, start_date, end_date):
+        """
+        Return the frames for [start_date, end_date), downloading only the uncached ranges.
+        A ticker the provider confirmed to have no rows (left out of its answer) is cached as an
+        empty segment, so the range is not downloaded again. A ticker the provider answered as
+        failed (None) caches nothing and is returned as failed, and a failed download raises and
+        caches nothing, so a transient failure is never kept as "no data".
+        """
+        start, last = as_date(start_date), as_date(end_date) - ONE_DAY
+        if last < start:
+            return {}
+        now = self.clock()
+        failed = set()
+        for (window_start, window_end), group in sorted(self._plan(tickers, start, last, now, PRICES).items()):
+            fetched = self.provider.download(group, window_start.strftime('%Y-%m-%d'),
+                                             (window_end + ONE_DAY).strftime('%Y-%m-%d'))
+            for ticker in group:
+                if ticker in fetched and fetched[ticker] is None:
+                    failed.add(ticker)
+                    continue
+                df = fetched.get(ticker)
+                if df is None:
+                    df = pd.DataFrame({'Date': pd.to_datetime([]), 'Close': pd.Series(dtype=float)})
+                self._store(ticker, window_start, window_end, df, now)
+
+        data = {}
+        for ticker in dict.fromkeys(tickers):
+            if ticker in failed:
+                data[ticker] = None
+                continue
+            df = self.load(ticker, start, last, now)
+            if not df.empty:
+                data[ticker] = df
+        return data
+
+    @property
+    def shares_request_size(self):
+        # Misses are forwarded, so they are batched the way the wrapped provider needs.
+        return None if self.offline else self.provider.shares_request_size
+
+    def shares_cached(self, tickers, start_date, end_date):
+        start, last = as_date(start_date), as_date(end_date) - ONE_DAY
+        if self.offline or last < start:
+            return True
+        now = self.clock()
+        return not any(self._gaps(ticker, start, last, now, SHARES) for ticker in tickers)
+
+    def shares_outstanding(self, tickers, start_date, end_date):
+        """
+        Return the shares outstanding records effective in [start_date, end_date), requesting only
+        the uncached ranges from the provider, with the expiry rules of download.
+        """
+        start, last = as_date(start_date), as_date(end_date) - ONE_DAY
+        if last < start:
+            return super().shares_outstanding(tickers, start_date, end_date)
+        now = self.clock()
+        for (window_start, window_end), group in sorted(self._plan(tickers, start, last, now, SHARES).items()):
+            fetched = self.provider.shares_outstanding(group, window_start.strftime('%Y-%m-%d'),
+                                                       (window_end + ONE_DAY).strftime('%Y-%m-%d'))
+            for ticker, records in fetched.groupby('ticker'):
+                if ticker in group:
+                    self._store(ticker, window_start, window_end, records, now, SHARES)
+            # Tickers without records in the window are cached as empty.
+            for ticker in set(group) - set(fetched['ticker']):
+                self._store(ticker, window_start, window_end, fetched.iloc[:0], now, SHARES)
+        frames = [self.load(ticker, start, last, now, SHARES) for ticker in dict.fromkeys(tickers)]
+        frames = [df for df in frames if not df.empty]
+        if not frames:
+            return super().shares_outstanding(tickers, start_date, end_date)
+        return pd.concat(frames, ignore_index=True)
+
+    def load(self, ticker, start=None, end=None, now=None, kind=PRICES):
+        """
+        Read the cached rows of a ticker between start and end (inclusive), newest fetch winning
+        where segments overlap. Expired days are skipped unless the cache is offline.
+        :param kind: PRICES for daily bars or SHARES for shares outstanding records.
+        """
+        now = self.clock() if now is None else now
+        column = DATE_COLUMNS[kind]
+        frames = []
+        for segment in self.segments(ticker, kind):
+            lo = segment.start if start is None else max(segment.start, as_date(start))
+            hi = self._valid_end(segment, now) if end is None else min(self._valid_end(segment, now), as_date(end))
+            if lo <= hi:
+                frames.append(self._read(segment.path, lo, hi, kind))
+        if not frames:
+            return pd.DataFrame(columns=EMPTY_COLUMNS[kind])
+        df = pd.concat(frames, ignore_index=True).drop_duplicates(column, keep='last')
+        return df.sort_values(column).reset_index(drop=True)
+
+    def _store(self, ticker, start, end, df, now, kind=PRICES):
+        # Write the downloaded range merged with the segments it overlaps or touches.
+        column = DATE_COLUMNS[kind]
+        df = df.copy()
+        if isinstance(df.columns, pd.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
+        df[column] = pd.to_datetime(df[column])
+        if df[column].dt.tz is not None:
+            df[column] = df[column].dt.tz_localize(None)
+        frames, merged, fetched_at = [], [], int(now)
+        new_start, new_end = start, end
+        for segment in self.segments(ticker, kind):
+            valid_end = self._valid_end(segment, now)
+            if segment.start > end + ONE_DAY or valid_end < start - ONE_DAY:
+                continue
+            merged.append(segment)
+            # Keep the cached days outside the new download; it wins where they overlap.
+            kept = [(segment.start, min(valid_end, start - ONE_DAY)), (max(segment.start, end + ONE_DAY), valid_end)]
+            for lo, hi in kept:
+                if lo > hi:
+                    continue
+                frames.append(self._read(segment.path, lo, hi, kind))
+                # Unsettled days keep their original fetch time, so they still expire on schedule.
+                if hi >= self._settled_until(segment.fetched_at):
+                    fetched_at = min(fetched_at, segment.fetched_at)
+            new_start, new_end = min(new_start, segment.start), max(new_end, valid_end)
+        frames.append(df)
+        combined = pd.concat(frames, ignore_index=True).sort_values(column).reset_index(drop=True)
+
+        ticker_dir = self._ticker_dir(ticker)
+        os.makedirs(ticker_dir, exist_ok=True)
+        path = os.path.join(ticker_dir, f"{kind}{new_start:%Y%m%d}_{new_end:%Y%m%d}_{fetched_at}.parquet")
+        tmp_path = f"{path}.tmp"
+        combined.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        for segment in merged:
+            if segment.path != path:
+                os.remove(segment.path)
+        with self._lock:
+            self._segments.pop((ticker, kind), None)
+        self.metrics.inc("download_cache_rows_written_total", len(df))
+
+    def cached_ranges(self, ticker):
+        """
+        Return the merged inclusive date ranges cached for a ticker, ignoring expiry.
+        """
+        return merge_ranges((segment.start, segment.end) for segment in self.segments(ticker))
@@ -1,37 +1,320 @@
 import pandas as pd
+import contextlib
 import logging
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import os
+import zlib
 
 logger = logging.getLogger(__name__)
 
+# Rows per worksheet allowed by the xlsx format, including the header row.
+EXCEL_MAX_ROWS = 1_048_576
+# Columns of the composition rows yielded by iter_index_composition.
+COMPOSITION_COLUMNS = ['date', 'rank', 'ticker', 'closing_price', 'market_cap']
 
-def export_to_excel(df, filename):
+
+@contextlib.contextmanager
+def _replace_on_success(filename):
+    # Yield a temporary path next to filename, which replaces filename once the block completes.
+    # If the block raises, the temporary file is removed and filename is left as it was, so a
+    # failed export never leaves a truncated file behind.
+    tmp_path = f"{filename}.tmp"
+    try:
+        yield tmp_path
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, filename)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def iter_chunks(data, chunk_rows=50_000):
+    """
+    Yield DataFrame chunks from either a single DataFrame or an iterable of DataFrames
+    (e.g. a chunked database read), so every exporter consumes rows chunk by chunk.
+    """
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, max(len(data), 1), chunk_rows):
+            yield data.iloc[start:start + chunk_rows]
+    else:
+        yield from data
+
+
+def export_to_csv(data, filename, columns=None):
+    """
+    Export a DataFrame or an iterable of DataFrame chunks to a CSV file, written to a temporary
+    file that replaces filename once every chunk is written.
+    :param columns: Column names to write as the header when data yields no chunks at all, so an
+                    empty export is still a readable CSV file.
+    :return: Number of rows written, or None if the export failed.
+    """
+    try:
+        rows, header_written = 0, False
+        with _replace_on_success(filename) as tmp_path, open(tmp_path, "w", newline="") as f:
+            for chunk in iter_chunks(data):
+                chunk.to_csv(f, header=not header_written, index=False)
+                header_written = True
+                rows += len(chunk)
+            if not header_written and columns is not None:
+                pd.DataFrame(columns=list(columns)).to_csv(f, index=False)
+        logger.info(f"Exported {rows} rows to CSV file: {filename}")
+        return rows
+    except Exception as e:
+        logger.error(f"Error exporting to CSV: {e}")
+
+
+def export_to_excel(data, filename, sheet_name="Sheet1"):
     """
-    Export the given DataFrame to an Excel file.
+    Export a DataFrame or an iterable of DataFrame chunks to an Excel file.
+    The workbook is written in openpyxl's write-only mode, which streams rows to disk, so memory
+    does not grow with the row count. Rows beyond the xlsx sheet limit continue on new sheets.
+    The workbook is saved to a temporary file that replaces filename once it is complete.
+    :return: Number of rows written, or None if the export failed.
     """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
     try:
-        df.to_excel(filename, index=False)
+        sheet, sheet_rows, header, rows = None, 0, None, 0
+        for chunk in iter_chunks(data):
+            if header is None:
+                header = [str(column) for column in chunk.columns]
+            # Missing values become empty cells, as with DataFrame.to_excel.
+            values = chunk.astype(object).where(chunk.notna(), None)
+            for row in values.itertuples(index=False, name=None):
+                if sheet is None or sheet_rows == EXCEL_MAX_ROWS:
+                    suffix = f"_{len(workbook.worksheets) + 1}" if workbook.worksheets else ""
+                    sheet = workbook.create_sheet(f"{sheet_name}{suffix}")
+                    sheet.append(header)
+                    sheet_rows = 1
+                sheet.append(row)
+                sheet_rows += 1
+                rows += 1
+        if sheet is None:
+            workbook.create_sheet(sheet_name).append(header or [])
+        with _replace_on_success(filename) as tmp_path:
+            workbook.save(tmp_path)
         logger.info(f"Data exported to Excel file: {filename}")
+        return rows
     except Exception as e:
+        # Close the sheets' row streams, which hold temporary files until the workbook is saved.
+        # A sheet already closed by a failed save raises, which is ignored.
+        for worksheet in workbook.worksheets:
+            with contextlib.suppress(Exception):
+                worksheet.close()
         logger.error(f"Error exporting to Excel: {e}")
 
-def export_to_pdf(df, filename):
+
+def _format_cell(value):
+    if value is None or (isinstance(value, float) and value != value):
+        return ""
+    if isinstance(value, float):
+        return f"{value:.4f}"
+    return str(value)
+
+
+class StreamingPdfWriter:
+    """
+    Minimal PDF writer that writes every page to disk as soon as it is complete.
+    Pages hold lines of text in the standard Courier font, which PDF readers provide without
+    embedding. Only the byte offset of each object is kept until the cross-reference table is
+    written on close, so memory stays flat however many pages are produced.
+    The document is written to a temporary file next to filename and moved into place by close(),
+    so a failed export never leaves a truncated PDF behind. Use it as a context manager: leaving
+    the block closes the writer, or discards the temporary file if an exception was raised.
+    :param filename: Output path.
+    :param pagesize: (width, height) in points; letter by default.
+    """
+    CATALOG, PAGES, FONT = 1, 2, 3
+
+    def __init__(self, filename, pagesize=(612, 792), font_size=8, margin=40):
+        self.width, self.height = pagesize
+        self.font_size = font_size
+        self.line_height = font_size + 2
+        self.margin = margin
+        self.lines_per_page = int((self.height - 2 * margin) / self.line_height)
+        self.page_count = 0
+        self._offsets = [0, 0, 0, 0]
+        self.filename = filename
+        self._tmp_path = f"{filename}.tmp"
+        self._file = open(self._tmp_path, "wb")
+        try:
+            self._file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            self._write_object(self.CATALOG, b"<< /Type /Catalog /Pages 2 0 R >>")
+            self._write_object(self.FONT, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier "
+                                          b"/Encoding /WinAnsiEncoding >>")
+        except BaseException:
+            self.abort()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def _write_object(self, number, body):
+        if number >= len(self._offsets):
+            self._offsets.extend([0] * (number + 1 - len(self._offsets)))
+        self._offsets[number] = self._file.tell()
+        self._file.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    @staticmethod
+    def _escape(line):
+        text = line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        return text.encode("cp1252", errors="replace")
+
+    def add_page(self, lines):
+        """
+        Write one page with the given lines of text, top to bottom.
+        """
+        top = self.height - self.margin - self.font_size
+        content = [f"BT /F1 {self.font_size} Tf {self.line_height} TL {self.margin} {top} Td".encode()]
+        content.extend(b"(" + self._escape(line) + b") Tj T*" for line in lines)
+        content.append(b"ET")
+        stream = zlib.compress(b"\n".join(content))
+        contents_number = 4 + 2 * self.page_count
+        self._write_object(contents_number, f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode()
+                           + stream + b"\nendstream")
+        self._write_object(contents_number + 1, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.width} {self.height}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {contents_number} 0 R >>").encode())
+        self.page_count += 1
+
+    def close(self):
+        """
+        Write the page tree, cross-reference table and trailer, close the file and move it to
+        filename.
+        """
+        kids = " ".join(f"{5 + 2 * i} 0 R" for i in range(self.page_count))
+        self._write_object(self.PAGES, f"<< /Type /Pages /Kids [{kids}] /Count {self.page_count} >>".encode())
+        xref_offset = self._file.tell()
+        entries = [b"0000000000 65535 f \n"] + [f"{offset:010d} 00000 n \n".encode() for offset in self._offsets[1:]]
+        self._file.write(f"xref\n0 {len(self._offsets)}\n".encode() + b"".join(entries))
+        self._file.write(f"trailer\n<< /Size {len(self._offsets)} /Root 1 0 R >>\n"
+                         f"startxref\n{xref_offset}\n%%EOF\n".encode())
+        self._file.close()
+        os.replace(self._tmp_path, self.filename)
+
+    def abort(self):
+        """
+        Close and remove the temporary file without writing the document.
+        """
+        self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+
+def export_to_pdf(data, filename, title=None, font_size=8, max_column_width=24):
+    """
+    Export a DataFrame or an iterable of DataFrame chunks to a paginated PDF table.
+    Column widths are fixed from the header and the first chunk, the header is repeated at the top
+    of every page, and each page is written out as soon as it is full, so only the current page
+    and chunk are held in memory.
+    :param title: Optional title printed above the header on every page.
+    :return: Number of rows written, or None if the export failed.
+    """
+    try:
+        with StreamingPdfWriter(filename, font_size=font_size) as writer:
+            header, page_lines, rows, rows_per_page = [], [], 0, None
+
+            def flush_page():
+                writer.add_page(header + page_lines + ["", f"Page {writer.page_count + 1}"])
+                page_lines.clear()
+
+            for chunk in iter_chunks(data):
+                cells = [chunk[column].map(_format_cell).tolist() for column in chunk.columns]
+                if rows_per_page is None:
+                    columns = [str(column) for column in chunk.columns]
+                    numeric = [pd.api.types.is_numeric_dtype(chunk[column]) for column in chunk.columns]
+                    widths = [min(max([len(name)] + [len(v) for v in values]), max_column_width)
+                              for name, values in zip(columns, cells)]
+                    header = ([title] if title else []) + [
+                        "  ".join(name[:w].ljust(w) for name, w in zip(columns, widths)),
+                        "  ".join("-" * w for w in widths),
+                    ]
+                    # Each page also ends with a blank line and its page number.
+                    rows_per_page = writer.lines_per_page - len(header) - 2
+                for line_cells in zip(*cells):
+                    page_lines.append("  ".join(
+                        (v[:w].rjust(w) if is_numeric else v[:w].ljust(w))
+                        for v, w, is_numeric in zip(line_cells, widths, numeric)))
+                    rows += 1
+                    if len(page_lines) == rows_per_page:
+                        flush_page()
+            if page_lines or writer.page_count == 0:
+                if not header:
+                    header = [title or "No data"]
+                flush_page()
+        logger.info(f"Data exported to PDF file: {filename} ({rows} rows on {writer.page_count} pages)")
+        return rows
+    except Exception as e:
+        logger.error(f"Error exporting to PDF: {e}")
+
+
+def export_to_parquet(data, filename):
     """
-    Export the given DataFrame to a PDF file using reportlab.
-    This is a basic implementation that writes the DataFrame text to a PDF.
+    Export a DataFrame or an iterable of DataFrame chunks to a Parquet file.
+    Each chunk is written as its own row group, with the schema taken from the first chunk, to a
+    temporary file that replaces filename once every chunk is written.
+    :return: Number of rows written, or None if the export failed.
     """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
     try:
-        c = canvas.Canvas(filename, pagesize=letter)
-        width, height = letter
-        text = c.beginText(40, height - 40)
-        text.setFont("Helvetica", 10)
-        # Convert DataFrame to string lines
-        lines = df.to_string(index=False).split('\n')
-        for line in lines:
-            text.textLine(line)
-        c.drawText(text)
-        c.save()
-        logger.info(f"Data exported to PDF file: {filename}")
+        rows = 0
+        with _replace_on_success(filename) as tmp_path:
+            writer = None
+            try:
+                for chunk in iter_chunks(data):
+                    if writer is None:
+                        table = pa.Table.from_pandas(chunk, preserve_index=False)
+                        writer = pq.ParquetWriter(tmp_path, table.schema)
+                    else:
+                        table = pa.Table.from_pandas(chunk, schema=writer.schema, preserve_index=False)
+                    writer.write_table(table)
+                    rows += len(chunk)
+            finally:
+                if writer is not None:
+                    writer.close()
+        logger.info(f"Exported {rows} rows to Parquet file: {filename}")
+        return rows
     except Exception as e:
-        logger.error(f"Error exporting to PDF: {e}")
\ No newline at end of file
+        logger.error(f"Error exporting to Parquet: {e}")
+
+
+def export_index_reports(db_manager, start_date, end_date, output_dir=".", metrics=None):
+    """
+    Export the materialized index between start_date and end_date (inclusive) from storage:
+    index_history.xlsx and .pdf, index_rebalances.xlsx, index_analytics.xlsx and the full
+    composition streamed to index_composition.csv. Nothing is recomputed, so the index should
+    have been refreshed (by ingestion or the compute command) first.
+    :param db_manager: DatabaseManager or ParquetStorageManager.
+    :param metrics: Optional MetricsRegistry that counts the composition rows exported.
+    :return: dict of rows written per file name.
+    """
+    from custom_index_calculator import calculate_index_for_date_range
+
+    os.makedirs(output_dir, exist_ok=True)
+    rows = {}
+    index_history_df = calculate_index_for_date_range(db_manager, start_date, end_date, refresh=False)
+    rows["index_history.xlsx"] = export_to_excel(index_history_df, os.path.join(output_dir, "index_history.xlsx"))
+    rows["index_history.pdf"] = export_to_pdf(index_history_df, os.path.join(output_dir, "index_history.pdf"))
+    # Rebalance events (tickers entering and leaving the index) over the same window
+    rows["index_rebalances.xlsx"] = export_to_excel(db_manager.query_rebalance_events(start_date, end_date),
+                                                    os.path.join(output_dir, "index_rebalances.xlsx"))
+    # Running analytics, from which the statistics of any sub-horizon are row differences
+    rows["index_analytics.xlsx"] = export_to_excel(db_manager.query_index_analytics(start_date, end_date),
+                                                   os.path.join(output_dir, "index_analytics.xlsx"))
+    # Full composition history, streamed from storage in chunks
+    rows["index_composition.csv"] = export_to_csv(db_manager.iter_index_composition(start_date, end_date),
+                                                  os.path.join(output_dir, "index_composition.csv"),
+                                                  columns=COMPOSITION_COLUMNS)
+    if metrics is not None:
+        metrics.inc("rows_exported_total", rows["index_composition.csv"] or 0, file="index_composition.csv")
+    logger.info(f"Exported the index from {start_date} to {end_date} to {output_dir}.")
+    return rows
@@ -0,0 +1,160 @@
+import datetime
+import logging
+import numpy as np
+import pandas as pd
+from ingestion_state import as_date
+
+logger = logging.getLogger(__name__)
+
+PERIODS_PER_YEAR = 252
+
+# Per-date running accumulators. Sums run from the first stored date, so the statistics of any
+# horizon are differences of two rows.
+ANALYTICS_COLUMNS = [
+    'date', 'index_value', 'daily_return', 'cum_log_return', 'return_count', 'return_sum', 'return_sq_sum',
+    'volatility', 'peak', 'drawdown', 'max_drawdown', 'turnover', 'cum_turnover', 'market_return',
+    'cum_market_log_return', 'active_count', 'active_sum', 'active_sq_sum',
+]
+
+# Accumulator values before the first date.
+_INITIAL_STATE = {'index_value': np.nan, 'cum_log_return': 0.0, 'return_count': 0, 'return_sum': 0.0,
+                  'return_sq_sum': 0.0, 'peak': -np.inf, 'max_drawdown': 0.0, 'cum_turnover': 0.0,
+                  'cum_market_log_return': 0.0, 'active_count': 0, 'active_sum': 0.0, 'active_sq_sum': 0.0}
+
+
+def _running(previous, column, increments):
+    # Continue a prefix sum from the last stored row.
+    start = previous[column].iloc[-1] if len(previous) else _INITIAL_STATE[column]
+    return start + np.cumsum(increments)
+
+
+def _variance(sums, sq_sums, counts):
+    # Sample variance from sums of values and squares over counts observations.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(counts >= 2, (sq_sums - sums ** 2 / counts) / (counts - 1), np.nan)
+
+
+def compute_index_analytics(history_df, previous=None, window=21):
+    """
+    Extend the running index analytics over new consecutive dates.
+    Each date costs O(1): every accumulator continues from the last row of previous, and the
+    rolling volatility subtracts the prefix sums of the row window dates back.
+    :param history_df: DataFrame with columns date, index_value, turnover and market_return for
+                       the dates after previous, in order. Missing turnover or market returns are NaN.
+    :param previous: DataFrame of the last (up to window) stored analytics rows, or None at the start.
+    :param window: Trading days in the rolling volatility.
+    :return: DataFrame with ANALYTICS_COLUMNS, one row per date of history_df.
+    """
+    previous = pd.DataFrame(columns=ANALYTICS_COLUMNS) if previous is None else previous.tail(window)
+    values = history_df['index_value'].to_numpy(dtype=float)
+    last_value = previous['index_value'].iloc[-1] if len(previous) else np.nan
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = values / np.concatenate([[last_value], values[:-1]]) - 1
+    has_return = np.isfinite(returns)
+    r = np.where(has_return, returns, 0.0)
+    result = pd.DataFrame({'date': history_df['date'].to_numpy(), 'index_value': values,
+                           'daily_return': np.where(has_return, returns, np.nan)})
+    result['cum_log_return'] = _running(previous, 'cum_log_return', np.log1p(r))
+    result['return_count'] = _running(previous, 'return_count', has_return.astype(np.int64))
+    result['return_sum'] = _running(previous, 'return_sum', r)
+    result['return_sq_sum'] = _running(previous, 'return_sq_sum', r ** 2)
+
+    # Rolling volatility from the prefix sums window rows back (zero before the first stored row).
+    lag = np.arange(len(result)) + len(previous) - window
+    sums = {}
+    for column in ('return_count', 'return_sum', 'return_sq_sum'):
+        prefix = np.concatenate([previous[column].to_numpy(dtype=float), result[column].to_numpy(dtype=float)])
+        sums[column] = result[column].to_numpy(dtype=float) - np.where(lag >= 0, prefix[np.maximum(lag, 0)], 0.0)
+    volatility = np.sqrt(_variance(sums['return_sum'], sums['return_sq_sum'], sums['return_count']) * PERIODS_PER_YEAR)
+    result['volatility'] = np.where(sums['return_count'] >= window, volatility, np.nan)
+
+    last_peak = previous['peak'].iloc[-1] if len(previous) else _INITIAL_STATE['peak']
+    result['peak'] = np.maximum.accumulate(np.concatenate([[last_peak], values]))[1:]
+    result['drawdown'] = values / result['peak'].to_numpy() - 1
+    last_max_drawdown = previous['max_drawdown'].iloc[-1] if len(previous) else _INITIAL_STATE['max_drawdown']
+    result['max_drawdown'] = np.minimum.accumulate(np.concatenate([[last_max_drawdown],
+                                                                   result['drawdown'].to_numpy()]))[1:]
+
+    turnover = history_df['turnover'].to_numpy(dtype=float)
+    result['turnover'] = turnover
+    result['cum_turnover'] = _running(previous, 'cum_turnover', np.nan_to_num(turnover))
+
+    market = history_df['market_return'].to_numpy(dtype=float)
+    has_market = np.isfinite(market)
+    result['market_return'] = market
+    result['cum_market_log_return'] = _running(previous, 'cum_market_log_return',
+                                               np.log1p(np.where(has_market, market, 0.0)))
+    has_active = has_return & has_market
+    active = np.where(has_active, r - np.where(has_market, market, 0.0), 0.0)
+    result['active_count'] = _running(previous, 'active_count', has_active.astype(np.int64))
+    result['active_sum'] = _running(previous, 'active_sum', active)
+    result['active_sq_sum'] = _running(previous, 'active_sq_sum', active ** 2)
+    return result[ANALYTICS_COLUMNS]
+
+
+def summarize_horizon(analytics_df):
+    """
+    Summarize index performance from the first to the last row of a range of stored analytics.
+    Everything except the drawdown is a difference of the two end rows, so any horizon costs
+    the same; the drawdown scans the range's cumulative log returns once.
+    :param analytics_df: Consecutive analytics rows, as returned by query_index_analytics.
+    :return: dict with total_return, annualized_return, mean_daily_return, volatility (annualized),
+             max_drawdown, average_turnover, market_return, excess_return, tracking_error
+             (annualized) and information_ratio; None if there are fewer than two rows.
+    """
+    if len(analytics_df) < 2:
+        return None
+    first, last = analytics_df.iloc[0], analytics_df.iloc[-1]
+    count = last['return_count'] - first['return_count']
+    active_count = last['active_count'] - first['active_count']
+    total_return = np.expm1(last['cum_log_return'] - first['cum_log_return'])
+    market_return = np.expm1(last['cum_market_log_return'] - first['cum_market_log_return'])
+    cum_log = analytics_df['cum_log_return'].to_numpy(dtype=float)
+    variance = _variance(last['return_sum'] - first['return_sum'], last['return_sq_sum'] - first['return_sq_sum'],
+                         count)
+    active_variance = _variance(last['active_sum'] - first['active_sum'],
+                                last['active_sq_sum'] - first['active_sq_sum'], active_count)
+    tracking_error = float(np.sqrt(active_variance * PERIODS_PER_YEAR))
+    mean_active = (last['active_sum'] - first['active_sum']) / active_count if active_count else np.nan
+    return {
+        'start': first['date'],
+        'end': last['date'],
+        'days': int(count),
+        'total_return': float(total_return),
+        'annualized_return': float((1 + total_return) ** (PERIODS_PER_YEAR / count) - 1) if count else np.nan,
+        'mean_daily_return': float((last['return_sum'] - first['return_sum']) / count) if count else np.nan,
+        'volatility': float(np.sqrt(variance * PERIODS_PER_YEAR)),
+        'max_drawdown': float(np.min(np.expm1(cum_log - np.maximum.accumulate(cum_log)))),
+        'average_turnover': float((last['cum_turnover'] - first['cum_turnover']) / count) if count else np.nan,
+        'market_return': float(market_return),
+        'excess_return': float(total_return - market_return),
+        'tracking_error': tracking_error,
+        'information_ratio': float(mean_active * PERIODS_PER_YEAR / tracking_error) if tracking_error else np.nan,
+    }
+
+
+def update_index_analytics(db_manager, window=21):
+    """
+    Append the analytics of the materialized index dates that have none yet.
+    An index refresh drops the analytics from its first changed date on, so this extends the
+    accumulators from the last valid row: a daily run computes one row.
+    :param db_manager: DatabaseManager or ParquetStorageManager.
+    :return: Number of dates appended.
+    """
+    previous = db_manager.query_last_index_analytics(window)
+    first, last = db_manager.query_date_bounds()
+    if last is None:
+        return 0
+    start = first if previous.empty else (as_date(previous['date'].iloc[-1]) + datetime.timedelta(days=1)).strftime('%Y-%m-%d')
+    if start > last:
+        return 0
+    values = db_manager.query_index_values(start, last)
+    if values.empty:
+        return 0
+    history = values[['date', 'index_value']] \
+        .merge(db_manager.query_turnover(start, last)[['date', 'turnover']], on='date', how='left') \
+        .merge(db_manager.query_market_returns(start, last), on='date', how='left')
+    rows = compute_index_analytics(history, previous, window=window)
+    db_manager.append_index_analytics(rows)
+    logger.info(f"Updated index analytics for {len(rows)} dates.")
+    return len(rows)
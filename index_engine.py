@@ -0,0 +1,244 @@
+import logging
+import numpy as np
+import pandas as pd
+from database_manager import decode_date, join_daily_chunks
+
+logger = logging.getLogger(__name__)
+
+
+class WeightingScheme:
+    """
+    Interface for index weighting schemes used by IndexEngine.
+    weights() receives the market caps of the selected names at every rebalance date
+    (rebalances x top_n) and a boolean mask of the same shape marking real members, and
+    returns weights that sum to 1 per row over the members (0 elsewhere). All rebalance
+    dates are processed at once.
+    """
+    def weights(self, market_caps, members):
+        raise NotImplementedError
+
+    def __repr__(self):
+        return f"{type(self).__name__}()"
+
+
+class EqualWeight(WeightingScheme):
+    """
+    Every member gets the same weight.
+    """
+    def weights(self, market_caps, members):
+        counts = members.sum(axis=1, keepdims=True)
+        return np.where(members, 1.0 / np.maximum(counts, 1), 0.0)
+
+
+class MarketCapWeight(WeightingScheme):
+    """
+    Members are weighted by market cap.
+    """
+    def weights(self, market_caps, members):
+        caps = np.where(members, market_caps, 0.0)
+        totals = caps.sum(axis=1, keepdims=True)
+        return np.divide(caps, totals, out=np.zeros_like(caps), where=totals > 0)
+
+
+class CappedMarketCapWeight(MarketCapWeight):
+    """
+    Market-cap weights with no member above weight_cap. Weight above the cap is redistributed
+    pro rata over the uncapped members until no weight exceeds the cap.
+    A date with fewer than 1 / weight_cap members cannot meet the cap; its members are equally
+    weighted instead, which is the allocation closest to it, so the weights still sum to 1.
+    :param weight_cap: Maximum weight per member, e.g. 0.1 for 10%.
+    """
+    def __init__(self, weight_cap=0.1):
+        self.weight_cap = weight_cap
+
+    def __repr__(self):
+        return f"{type(self).__name__}(weight_cap={self.weight_cap})"
+
+    def weights(self, market_caps, members):
+        weights = super().weights(market_caps, members)
+        capped = np.zeros_like(members)
+        # Each pass caps at least one more name per violating row, so this ends within
+        # the number of members; every pass works on all rebalance dates at once.
+        for _ in range(members.shape[1]):
+            over = weights > self.weight_cap + 1e-12
+            if not over.any():
+                break
+            capped |= over
+            excess = np.where(over, weights - self.weight_cap, 0.0).sum(axis=1, keepdims=True)
+            weights = np.where(over, self.weight_cap, weights)
+            free = np.where(members & ~capped, weights, 0.0)
+            free_total = free.sum(axis=1, keepdims=True)
+            share = np.divide(free, free_total, out=np.zeros_like(free), where=free_total > 0)
+            weights = weights + share * excess
+        counts = members.sum(axis=1, keepdims=True)
+        infeasible = counts * self.weight_cap < 1 - 1e-12
+        return np.where(infeasible, EqualWeight().weights(market_caps, members), weights)
+
+
+WEIGHTING_SCHEMES = {
+    'equal': EqualWeight,
+    'market_cap': MarketCapWeight,
+    'capped': CappedMarketCapWeight,
+}
+
+
+def build_market_matrices(daily_df):
+    """
+    Pivot long daily rows (date, ticker, closing_price, market_cap) into dates x tickers matrices.
+    :return: Tuple (prices, market_caps) of DataFrames indexed by date with one column per ticker.
+    """
+    prices = daily_df.pivot(index='date', columns='ticker', values='closing_price').sort_index()
+    market_caps = daily_df.pivot(index='date', columns='ticker', values='market_cap').reindex_like(prices)
+    return prices, market_caps
+
+
+def load_market_matrices(db_manager, start_date, end_date, chunksize=100_000):
+    """
+    Load the prices and market caps between start_date and end_date as dates x tickers matrices.
+    The rows are read as typed chunks of integer ids (see DatabaseManager.iter_daily_arrays) and
+    scattered straight into the matrices, so no long DataFrame of ticker and date strings is
+    built and pivoted.
+    :return: Tuple (prices, market_caps) as returned by build_market_matrices.
+    """
+    tickers, chunks = db_manager.iter_daily_arrays(start_date, end_date, chunksize=chunksize)
+    columns = join_daily_chunks(list(chunks))
+    known = columns['ticker_code'] >= 0
+    if not known.all():
+        columns = {name: values[known] for name, values in columns.items()}
+    # Dates and tickers are mapped to matrix rows and columns through lookup tables over their
+    # id ranges, which needs no sort of the rows.
+    first = int(columns['date_id'].min()) if len(columns['date_id']) else 0
+    offsets = columns.pop('date_id') - first
+    date_present = np.bincount(offsets) > 0
+    rows = (np.cumsum(date_present) - 1)[offsets]
+    del offsets
+    ticker_present = np.zeros(len(tickers), dtype=bool)
+    ticker_present[columns['ticker_code']] = True
+    # Columns in ticker order, as the pivot of build_market_matrices returns them.
+    codes = np.flatnonzero(ticker_present)
+    names = np.asarray(tickers, dtype=object)[codes]
+    order = np.argsort(names, kind='stable')
+    position = np.zeros(len(tickers), dtype=np.intp)
+    position[codes[order]] = np.arange(len(codes))
+    cols = position[columns.pop('ticker_code')]
+
+    index = pd.Index([decode_date(int(date_id)) for date_id in np.flatnonzero(date_present) + first], name='date')
+    matrices = []
+    for name in ('closing_price', 'market_cap'):
+        matrix = np.full((len(index), len(codes)), np.nan)
+        matrix[rows, cols] = columns.pop(name)
+        matrices.append(pd.DataFrame(matrix, index=index, columns=pd.Index(names[order], name='ticker')))
+    return tuple(matrices)
+
+
+def rebalance_flags(dates, frequency):
+    """
+    Mark the rebalance dates: the first date of every period of the given frequency.
+    :param dates: Sorted dates.
+    :param frequency: 'D' (daily), 'W', 'M', 'Q' or 'Y', or an integer number of trading days.
+    :return: Boolean NumPy array, always True for the first date.
+    """
+    dates = pd.DatetimeIndex(pd.to_datetime(dates))
+    if isinstance(frequency, (int, np.integer)):
+        flags = np.arange(len(dates)) % int(frequency) == 0
+    elif frequency == 'D':
+        flags = np.ones(len(dates), dtype=bool)
+    else:
+        periods = dates.to_period({'W': 'W', 'M': 'M', 'Q': 'Q', 'Y': 'Y'}[frequency]).asi8
+        flags = np.r_[True, periods[1:] != periods[:-1]] if len(periods) else np.zeros(0, dtype=bool)
+    if len(flags):
+        flags[0] = True
+    return flags
+
+
+class IndexEngine:
+    """
+    Vectorized index engine over a dates x tickers price and market-cap matrix.
+    On each rebalance date the top_n tickers by market cap become members with weights from
+    the weighting scheme, and the basket is held until the next rebalance. The divisor is
+    adjusted at every rebalance so the index level is continuous across membership and weight
+    changes; between rebalances the index moves only with member prices.
+    :param top_n: Number of members selected by market cap.
+    :param weighting: Name in WEIGHTING_SCHEMES or a WeightingScheme instance.
+    :param rebalance: Rebalance frequency, see rebalance_flags.
+    :param base_value: Index level on the first date.
+    :param chunk_rows: Dates processed per block when valuing the basket, bounding memory.
+    """
+    def __init__(self, top_n=100, weighting='equal', rebalance='D', base_value=100.0, chunk_rows=1024):
+        self.top_n = top_n
+        self.weighting = WEIGHTING_SCHEMES[weighting]() if isinstance(weighting, str) else weighting
+        self.rebalance = rebalance
+        self.base_value = base_value
+        self.chunk_rows = chunk_rows
+
+    def select_members(self, market_caps):
+        """
+        Select the top_n tickers by market cap in each row.
+        :param market_caps: Array (rows x tickers); NaN marks tickers that are not eligible.
+        :return: Tuple (columns, members): the selected column indices (rows x top_n) and a mask
+                 that is False where a row had fewer than top_n eligible tickers.
+        """
+        caps = np.where(np.isnan(market_caps), -np.inf, market_caps)
+        n_tickers = caps.shape[1]
+        n = min(self.top_n, n_tickers)
+        columns = np.argpartition(caps, n_tickers - n, axis=1)[:, n_tickers - n:] if n else \
+            np.zeros((len(caps), 0), dtype=np.intp)
+        members = np.isfinite(np.take_along_axis(caps, columns, axis=1))
+        return columns, members
+
+    def compute(self, prices, market_caps):
+        """
+        Compute the index history.
+        After selection, all work is done on the rebalances x top_n member slots rather than
+        the full ticker universe, so the cost is dominated by one pass over the price matrix.
+        :param prices: DataFrame (dates x tickers) of closing prices.
+        :param market_caps: DataFrame of market caps aligned with prices.
+        :return: DataFrame with columns date, index_value, divisor, constituent_count and rebalance.
+        """
+        dates = prices.index
+        flags = rebalance_flags(dates, self.rebalance)
+        rebalance_rows = np.flatnonzero(flags)
+        segment = np.cumsum(flags) - 1
+
+        # Held names keep their last known price on days without a quote; before the first
+        # quote the price is 0, which also keeps the name out of the basket.
+        filled = prices.ffill().to_numpy(dtype=float, copy=True)
+        filled[np.isnan(filled)] = 0.0
+        # Only tickers quoted on the rebalance date itself are eligible.
+        caps = market_caps.reindex_like(prices).to_numpy(dtype=float)[rebalance_rows]
+        caps[np.isnan(prices.to_numpy(dtype=float)[rebalance_rows])] = np.nan
+
+        columns, members = self.select_members(caps)
+        weights = self.weighting.weights(np.take_along_axis(caps, columns, axis=1), members)
+        rebalance_prices = filled[rebalance_rows[:, None], columns]
+        # Units held per unit of index value: the basket is worth exactly 1 on its rebalance date.
+        units = np.divide(weights, rebalance_prices, out=np.zeros_like(weights),
+                          where=members & (rebalance_prices > 0))
+
+        # The old basket valued on each new rebalance date is the growth carried into the next
+        # segment; chaining these keeps the level continuous, which is the divisor adjustment.
+        growth = np.ones(len(rebalance_rows))
+        if len(rebalance_rows) > 1:
+            carried = filled[rebalance_rows[1:, None], columns[:-1]]
+            growth[1:] = np.einsum('ij,ij->i', units[:-1], carried)
+        level_at_rebalance = self.base_value * np.cumprod(growth)
+
+        basket_value = np.empty(len(dates))
+        for start in range(0, len(dates), self.chunk_rows):
+            stop = min(start + self.chunk_rows, len(dates))
+            rows = segment[start:stop]
+            held = filled[np.arange(start, stop)[:, None], columns[rows]]
+            basket_value[start:stop] = np.einsum('ij,ij->i', units[rows], held)
+        index_values = level_at_rebalance[segment] * basket_value
+
+        # Divisor in price terms: the members' price sum on the rebalance date over the level.
+        price_sum = np.where(members, rebalance_prices, 0.0).sum(axis=1)
+        divisor = np.divide(price_sum, level_at_rebalance, out=np.full(len(price_sum), np.nan),
+                            where=level_at_rebalance > 0)
+        return pd.DataFrame({
+            'date': np.asarray(dates),
+            'index_value': index_values,
+            'divisor': divisor[segment],
+            'constituent_count': members.sum(axis=1)[segment],
+            'rebalance': flags,
+        })
@@ -0,0 +1,76 @@
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def compute_rebalance_events(constituents_df, date_column='date', ticker_column='ticker'):
+    """
+    Compute index membership entries and exits between consecutive dates in one vectorized pass.
+    Each (date, ticker) membership is encoded as a single integer key, and a ticker entered on
+    a date if its key for the previous date is missing (exits are the mirror image). The first
+    date has no previous day and produces no events.
+    :param constituents_df: DataFrame with one row per constituent per date.
+    :return: Tuple (events_df, turnover_df). events_df has columns date, ticker and event
+             ('entry' or 'exit'); turnover_df has date, entries, exits, constituent_count and
+             turnover (entries divided by the number of constituents).
+    """
+    dates, date_idx = np.unique(constituents_df[date_column].to_numpy(), return_inverse=True)
+    tickers, ticker_idx = np.unique(constituents_df[ticker_column].to_numpy(), return_inverse=True)
+    n_tickers = max(len(tickers), 1)
+    date_idx = date_idx.astype(np.int64)
+    keys = date_idx * n_tickers + ticker_idx
+    sorted_keys = np.sort(keys)
+
+    def _has_member(query_keys):
+        positions = np.searchsorted(sorted_keys, query_keys)
+        found = positions < len(sorted_keys)
+        found[found] = sorted_keys[positions[found]] == query_keys[found]
+        return found
+
+    entered = (date_idx > 0) & ~_has_member(keys - n_tickers)
+    exited = (date_idx < len(dates) - 1) & ~_has_member(keys + n_tickers)
+
+    events_df = pd.concat([
+        pd.DataFrame({date_column: dates[date_idx[entered]], ticker_column: tickers[ticker_idx[entered]],
+                      'event': 'entry'}),
+        # An exit is reported on the first date the ticker is no longer a member.
+        pd.DataFrame({date_column: dates[date_idx[exited] + 1], ticker_column: tickers[ticker_idx[exited]],
+                      'event': 'exit'}),
+    ], ignore_index=True).sort_values([date_column, 'event', ticker_column], kind='stable').reset_index(drop=True)
+
+    counts = np.bincount(date_idx, minlength=len(dates))
+    entries = np.bincount(date_idx[entered], minlength=len(dates))
+    exits = np.bincount(date_idx[exited] + 1, minlength=len(dates))
+    turnover_df = pd.DataFrame({
+        date_column: dates,
+        'entries': entries,
+        'exits': exits,
+        'constituent_count': counts,
+        'turnover': entries / np.maximum(counts, 1),
+    }).iloc[1:].reset_index(drop=True)
+    return events_df, turnover_df
+
+
+def rebalance_dates_to_refresh(stored_dates, dirty_dates):
+    """
+    Return the dates whose rebalance events must be recomputed after dirty_dates changed:
+    the dirty dates themselves and the stored date that follows each of them.
+    :param stored_dates: Sorted array of dates that currently have index constituents.
+    :param dirty_dates: Iterable of dates whose constituents were recomputed.
+    :return: Tuple (refresh_dates, needed_dates). needed_dates adds each refresh date's
+             predecessor, which is required to diff against.
+    """
+    stored_dates = np.asarray(stored_dates)
+    dirty_dates = np.unique(np.asarray(list(dirty_dates), dtype=stored_dates.dtype))
+    if len(stored_dates) == 0 or len(dirty_dates) == 0:
+        return set(), set()
+    following = np.searchsorted(stored_dates, dirty_dates, side='right')
+    refresh = set(dirty_dates[np.isin(dirty_dates, stored_dates)].tolist())
+    refresh.update(stored_dates[following[following < len(stored_dates)]].tolist())
+    refresh_array = np.array(sorted(refresh), dtype=stored_dates.dtype)
+    previous = np.searchsorted(stored_dates, refresh_array, side='left') - 1
+    needed = set(refresh)
+    needed.update(stored_dates[previous[previous >= 0]].tolist())
+    return refresh, needed
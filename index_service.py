@@ -0,0 +1,217 @@
+import argparse
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+import pandas as pd
+from custom_index_calculator import calculate_index_for_date_range
+from database_manager import DatabaseManager
+from metrics import MetricsRegistry
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceError(Exception):
+    """
+    Error returned to the client with an HTTP status code.
+    """
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache of serialized responses for the current data version.
+    Responses are stored per data version; the first lookup with a newer version (i.e. after an
+    ingestion committed) empties the cache. The version only moves forward: a reader still on an
+    older snapshot misses without clearing the cache, and its response is not cached.
+    :param maxsize: Maximum number of cached responses; 0 disables caching.
+    """
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+
+    def get(self, version, key):
+        with self._lock:
+            if self._version is None or version > self._version:
+                self._entries.clear()
+                self._version = version
+                return None
+            if version < self._version:
+                return None
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, version, key, body):
+        with self._lock:
+            if version != self._version or self.maxsize <= 0:
+                return
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def _date_param(params, name):
+    values = params.get(name)
+    if not values:
+        raise ServiceError(400, f"Missing query parameter: {name}")
+    try:
+        return pd.Timestamp(values[0]).strftime('%Y-%m-%d')
+    except (ValueError, TypeError):
+        raise ServiceError(400, f"Invalid date for {name}: {values[0]}")
+
+
+def _records(df):
+    # JSON has no NaN; missing values become null.
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+class IndexService:
+    """
+    Read-only JSON API over the materialized index, independent of the HTTP transport.
+    Endpoints:
+    - /index?start=YYYY-MM-DD&end=YYYY-MM-DD: index value per business day (null without data),
+      for at most max_index_days calendar days;
+    - /constituents?date=YYYY-MM-DD: members with rank, closing price and market cap;
+    - /health: status and current data version;
+    - /metrics: request metrics in the Prometheus text format.
+    Queries run on the read-only connection pool of DatabaseManager, so at most pool_size run at
+    once; in WAL mode they see the last committed ingestion and never block it. Each query reads
+    the data version and the data in one read transaction, and the serialized response is cached
+    under that version.
+    :param max_index_days: Longest /index range served; longer ones are rejected with 400, so one
+                           request cannot build an unbounded business-day range.
+    """
+    def __init__(self, db_path, pool_size=4, cache_size=256, metrics=None, timeout=5.0, max_index_days=3660):
+        self.db_manager = DatabaseManager(db_path=db_path, read_only=True, readers=pool_size)
+        self.timeout = timeout
+        self.max_index_days = max_index_days
+        self.cache = ResponseCache(maxsize=cache_size)
+        self.metrics = metrics if metrics is not None else MetricsRegistry()
+        self.routes = {'/index': self._index, '/constituents': self._constituents, '/health': self._health}
+
+    def _index(self, db_manager, params):
+        start, end = _date_param(params, 'start'), _date_param(params, 'end')
+        if start > end:
+            raise ServiceError(400, "start must not be after end.")
+        if (pd.Timestamp(end) - pd.Timestamp(start)).days >= self.max_index_days:
+            raise ServiceError(400, f"The range must span fewer than {self.max_index_days} days.")
+        history = calculate_index_for_date_range(db_manager, start, end, refresh=False)
+        return (start, end), {'start': start, 'end': end, 'values': _records(history)}
+
+    def _constituents(self, db_manager, params):
+        date = _date_param(params, 'date')
+        chunks = list(db_manager.iter_index_composition(date, date))
+        composition = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame(
+            columns=['date', 'rank', 'ticker', 'closing_price', 'market_cap'])
+        return (date,), {'date': date, 'constituents': _records(composition.drop(columns=['date']))}
+
+    def _health(self, db_manager, params):
+        return None, {'status': 'ok'}
+
+    def handle(self, path, params):
+        """
+        Serve one request.
+        :param path: URL path, e.g. '/index'.
+        :param params: Query parameters as returned by urllib.parse.parse_qs.
+        :return: Tuple (status, content_type, body bytes).
+        """
+        started = time.perf_counter()
+        endpoint = path if path in self.routes or path == '/metrics' else 'unknown'
+        try:
+            if path == '/metrics':
+                status, content_type, body = 200, "text/plain; version=0.0.4", self.metrics.to_prometheus().encode()
+            elif path not in self.routes:
+                raise ServiceError(404, f"Unknown endpoint: {path}")
+            else:
+                status, content_type, body = 200, "application/json", self._query(path, params)
+        except ServiceError as e:
+            status, content_type, body = e.status, "application/json", json.dumps({'error': str(e)}).encode()
+        except Exception as e:
+            logger.error(f"Error serving {path}: {e}")
+            status, content_type, body = 500, "application/json", json.dumps({'error': "Internal error"}).encode()
+        self.metrics.inc("service_requests_total", endpoint=endpoint, status=str(status))
+        self.metrics.observe("service_request_seconds", time.perf_counter() - started, endpoint=endpoint)
+        return status, content_type, body
+
+    def _query(self, path, params):
+        try:
+            # One read transaction, so the version always matches the data read with it.
+            with self.db_manager.reader(timeout=self.timeout):
+                version = self.db_manager.get_data_version()
+                key = (path, tuple(sorted((name, tuple(values)) for name, values in params.items())))
+                body = self.cache.get(version, key)
+                if body is not None:
+                    self.metrics.inc("service_cache_total", result="hit")
+                    return body
+                self.metrics.inc("service_cache_total", result="miss")
+                _, payload = self.routes[path](self.db_manager, params)
+        except TimeoutError:
+            raise ServiceError(503, "All database connections are busy.")
+        body = json.dumps(dict(payload, data_version=version)).encode()
+        self.cache.put(version, key, body)
+        return body
+
+    def make_server(self, host="127.0.0.1", port=8050):
+        """
+        Create a threaded HTTP server for this service; port 0 picks a free port.
+        """
+        server = ThreadingHTTPServer((host, port), _RequestHandler)
+        server.daemon_threads = True
+        server.service = self
+        return server
+
+    def close(self):
+        self.db_manager.close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so clients reuse their connection across requests. Headers and body are
+    # written separately, so Nagle's algorithm would delay every response by a delayed ACK.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        status, content_type, body = self.server.service.handle(url.path, parse_qs(url.query))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve index values and constituents as JSON over HTTP.")
+    parser.add_argument("--db_path", default="data.db", help="SQLite database to serve. Default is data.db.")
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on. Default is 127.0.0.1.")
+    parser.add_argument("--port", type=int, default=8050, help="Port to listen on. Default is 8050.")
+    parser.add_argument("--pool_size", type=int, default=4, help="Read-only connections. Default is 4.")
+    parser.add_argument("--cache_size", type=int, default=256, help="Cached responses. Default is 256.")
+    parser.add_argument("--max_index_days", type=int, default=3660,
+                        help="Longest /index range in calendar days. Default is 3660.")
+    args = parser.parse_args()
+    service = IndexService(args.db_path, pool_size=args.pool_size, cache_size=args.cache_size,
+                           max_index_days=args.max_index_days)
+    server = service.make_server(args.host, args.port)
+    logger.info(f"Serving index data from {args.db_path} on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
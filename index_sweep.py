@@ -0,0 +1,176 @@
+import itertools
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+from index_engine import WEIGHTING_SCHEMES, rebalance_flags
+
+logger = logging.getLogger(__name__)
+
+# One index definition of a sweep. weighting is a name in WEIGHTING_SCHEMES or a WeightingScheme.
+SweepConfig = namedtuple('SweepConfig', ['top_n', 'rebalance', 'weighting'])
+
+
+def sweep_configs(top_ns=(50, 100, 200), rebalances=('D', 'W', 'M', 'Q'), weightings=('equal', 'market_cap', 'capped')):
+    """
+    Every combination of the given top-N sizes, rebalance frequencies and weighting schemes.
+    :return: List of SweepConfig.
+    """
+    return [SweepConfig(top_n, rebalance, weighting)
+            for top_n, rebalance, weighting in itertools.product(top_ns, rebalances, weightings)]
+
+
+def config_label(config):
+    """
+    Readable name of a configuration, e.g. 'top100_M_capped', used as its result column.
+    """
+    weighting = config.weighting if isinstance(config.weighting, str) else repr(config.weighting)
+    return f"top{config.top_n}_{config.rebalance}_{weighting}"
+
+
+def _prepare_matrices(prices, market_caps):
+    # The IndexEngine inputs shared by every configuration: held names keep their last price
+    # (0 before the first quote), and only tickers quoted on a date are eligible on it.
+    raw = prices.to_numpy(dtype=float)
+    filled = prices.ffill().to_numpy(dtype=float, copy=True)
+    filled[np.isnan(filled)] = 0.0
+    caps = market_caps.reindex_like(prices).to_numpy(dtype=float, copy=True)
+    caps[np.isnan(raw)] = np.nan
+    return filled, caps
+
+
+def _sweep_schedule(filled, caps, flags, variants, base_value, chunk_rows):
+    """
+    Index values of several (top_n, weighting) variants that share one rebalance schedule.
+    The top max(top_n) names of every rebalance date are sorted by market cap once, so each
+    top_n takes a prefix of the same selection; the held prices are gathered once per block of
+    dates and every variant's basket is valued from them in one einsum.
+    :return: Array (dates x variants).
+    """
+    rebalance_rows = np.flatnonzero(flags)
+    segment = np.cumsum(flags) - 1
+    rebalance_caps = np.where(np.isnan(caps[rebalance_rows]), -np.inf, caps[rebalance_rows])
+    n_tickers = rebalance_caps.shape[1]
+    width = min(max(top_n for top_n, _ in variants), n_tickers)
+    top = np.argpartition(-rebalance_caps, width - 1, axis=1)[:, :width] if width < n_tickers else \
+        np.broadcast_to(np.arange(n_tickers), rebalance_caps.shape)
+    order = np.argsort(-np.take_along_axis(rebalance_caps, top, axis=1), axis=1, kind='stable')
+    columns = np.take_along_axis(top, order, axis=1)
+    selected_caps = np.take_along_axis(rebalance_caps, columns, axis=1)
+    members = np.isfinite(selected_caps)
+    rebalance_prices = filled[rebalance_rows[:, None], columns]
+
+    # Units held per unit of index value, padded with zeros past each variant's top_n.
+    units = np.zeros((len(variants), len(rebalance_rows), width))
+    for v, (top_n, weighting) in enumerate(variants):
+        n = min(top_n, width)
+        scheme = WEIGHTING_SCHEMES[weighting]() if isinstance(weighting, str) else weighting
+        weights = scheme.weights(selected_caps[:, :n], members[:, :n])
+        np.divide(weights, rebalance_prices[:, :n], out=units[v, :, :n],
+                  where=members[:, :n] & (rebalance_prices[:, :n] > 0))
+
+    # Chain the value of each basket on the next rebalance date, as IndexEngine does.
+    growth = np.ones((len(variants), len(rebalance_rows)))
+    if len(rebalance_rows) > 1:
+        carried = filled[rebalance_rows[1:, None], columns[:-1]]
+        growth[:, 1:] = np.einsum('vrk,rk->vr', units[:, :-1], carried)
+    level_at_rebalance = base_value * np.cumprod(growth, axis=1)
+
+    values = np.empty((len(filled), len(variants)))
+    step = max(chunk_rows // len(variants), 1)
+    for start in range(0, len(filled), step):
+        stop = min(start + step, len(filled))
+        rows = segment[start:stop]
+        held = filled[np.arange(start, stop)[:, None], columns[rows]]
+        values[start:stop] = np.einsum('vck,ck->cv', units[:, rows], held) * level_at_rebalance[:, rows].T
+    return values
+
+
+# Matrices attached from shared memory in each worker process.
+_shared = {}
+
+
+def _attach_shared(specs):
+    for name, (shm_name, shape) in specs.items():
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _shared[name] = (shm, np.ndarray(shape, dtype=np.float64, buffer=shm.buf))
+
+
+def _sweep_shared(flags, variants, base_value, chunk_rows):
+    return _sweep_schedule(_shared['filled'][1], _shared['caps'][1], flags, variants, base_value, chunk_rows)
+
+
+def run_sweep(prices, market_caps, configs, base_value=100.0, chunk_rows=4096, processes=None):
+    """
+    Compute the index history of many configurations from one load of the market matrices.
+    Configurations with the same rebalance frequency share the selection and the held-price
+    gathers (see _sweep_schedule), so a variant costs little more than its own weights and
+    basket sums. Each value equals IndexEngine(top_n, weighting, rebalance).compute(), except
+    that ties in market cap at the top-N cut-off may be broken differently.
+    With processes > 1, the (frequency, top_n) groups run in a process pool. The prepared price
+    and market-cap matrices are placed in shared memory once and attached by every worker, so
+    they are neither copied nor pickled per task.
+    :param prices: DataFrame (dates x tickers) of closing prices.
+    :param market_caps: DataFrame of market caps aligned with prices.
+    :param configs: Iterable of SweepConfig (see sweep_configs).
+    :param chunk_rows: Bound on dates x variants valued per block, which bounds memory.
+    :param processes: Worker processes; None or 1 runs in this process.
+    :return: DataFrame of index values indexed by date, one column per config_label.
+    """
+    configs = list(configs)
+    dates = prices.index
+    filled, caps = _prepare_matrices(prices, market_caps)
+    groups = {}
+    for i, config in enumerate(configs):
+        key = (config.rebalance,) if not processes or processes <= 1 else (config.rebalance, config.top_n)
+        groups.setdefault(key, []).append(i)
+    flags = {rebalance: rebalance_flags(dates, rebalance) for rebalance in {config.rebalance for config in configs}}
+    values = np.empty((len(dates), len(configs)))
+
+    def variants(indices):
+        return [(configs[i].top_n, configs[i].weighting) for i in indices]
+
+    if not processes or processes <= 1:
+        for (rebalance,), indices in groups.items():
+            values[:, indices] = _sweep_schedule(filled, caps, flags[rebalance], variants(indices), base_value,
+                                                 chunk_rows)
+    else:
+        segments = {}
+        try:
+            for name, array in (('filled', filled), ('caps', caps)):
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=np.float64, buffer=shm.buf)[:] = array
+                segments[name] = (shm, array.shape)
+            specs = {name: (shm.name, shape) for name, (shm, shape) in segments.items()}
+            with ProcessPoolExecutor(max_workers=processes, initializer=_attach_shared, initargs=(specs,)) as pool:
+                futures = {pool.submit(_sweep_shared, flags[key[0]], variants(indices), base_value, chunk_rows):
+                           indices for key, indices in groups.items()}
+                for future, indices in futures.items():
+                    values[:, indices] = future.result()
+        finally:
+            for shm, _ in segments.values():
+                shm.close()
+                shm.unlink()
+    logger.info(f"Swept {len(configs)} index configurations over {len(dates)} dates in {len(groups)} groups.")
+    return pd.DataFrame(values, index=pd.Index(dates, name='date'), columns=[config_label(c) for c in configs])
+
+
+def summarize_sweep(levels, periods_per_year=252):
+    """
+    Compare the swept index histories column by column.
+    :param levels: DataFrame returned by run_sweep.
+    :return: DataFrame indexed by config label with total_return, annualized_return,
+             volatility (annualized) and max_drawdown, ordered by total_return descending.
+    """
+    values = levels.to_numpy(dtype=float)
+    returns = values[1:] / values[:-1] - 1
+    total = values[-1] / values[0] - 1
+    summary = pd.DataFrame({
+        'total_return': total,
+        'annualized_return': (1 + total) ** (periods_per_year / max(len(returns), 1)) - 1,
+        'volatility': returns.std(axis=0, ddof=1) * np.sqrt(periods_per_year),
+        'max_drawdown': (values / np.maximum.accumulate(values, axis=0) - 1).min(axis=0),
+    }, index=pd.Index(levels.columns, name='config'))
+    return summary.sort_values('total_return', ascending=False)
@@ -0,0 +1,101 @@
+import datetime
+import logging
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def as_date(value):
+    """
+    Convert a date, datetime, 'YYYY-MM-DD' string or anything pandas parses to a datetime.date.
+    """
+    # Fast paths for dates and 'YYYY-MM-DD' strings, which is what callers almost always pass.
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    if isinstance(value, str) and len(value) == 10:
+        return datetime.date.fromisoformat(value)
+    return pd.to_datetime(value).date()
+
+
+def merge_ranges(ranges, gap_days=0):
+    """
+    Merge inclusive (start, end) date ranges that overlap, touch, or are separated by at most
+    gap_days uncovered days.
+    :param ranges: Iterable of (start, end) pairs; dates or 'YYYY-MM-DD' strings.
+    :return: Sorted list of merged (start, end) datetime.date pairs.
+    """
+    merged = []
+    for start, end in sorted((as_date(start), as_date(end)) for start, end in ranges):
+        if merged and start <= merged[-1][1] + ONE_DAY * (gap_days + 1):
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_ranges(covered, start, end):
+    """
+    Return the inclusive sub-ranges of [start, end] that are not covered.
+    :param covered: Iterable of inclusive (start, end) ranges already ingested.
+    :return: Sorted list of (start, end) datetime.date pairs.
+    """
+    start, end = as_date(start), as_date(end)
+    gaps = []
+    cursor = start
+    for covered_start, covered_end in merge_ranges(covered):
+        if covered_end < cursor:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > cursor:
+            gaps.append((cursor, covered_start - ONE_DAY))
+        cursor = covered_end + ONE_DAY
+    if cursor <= end:
+        gaps.append((cursor, end))
+    return gaps
+
+
+def plan_fetch_windows(coverage_df, tickers, start, end, gap_days=7):
+    """
+    Plan the provider requests that bring every ticker's coverage up to [start, end].
+    Each ticker's gaps are computed from its covered ranges; gaps separated by at most gap_days
+    covered days are merged, since refetching a few stored days is cheaper than another request.
+    Tickers with identical windows are grouped so DataFetcher can request them together.
+    :param coverage_df: DataFrame with columns ticker, start_date and end_date (inclusive ranges).
+    :param tickers: Tickers to ingest.
+    :return: Dict mapping an inclusive (start, end) window to the list of tickers missing it,
+             ordered by window.
+    """
+    covered = {ticker: list(zip(group['start_date'], group['end_date']))
+               for ticker, group in coverage_df.groupby('ticker')} if len(coverage_df) else {}
+    windows = {}
+    for ticker in dict.fromkeys(tickers):
+        gaps = missing_ranges(covered.get(ticker, []), start, end)
+        for window in merge_ranges(gaps, gap_days=gap_days):
+            windows.setdefault(window, []).append(ticker)
+    return dict(sorted(windows.items()))
+
+
+def plan_shares_windows(covered, tickers, start, end, lookback_days=366, refresh_days=30, gap_days=7):
+    """
+    Plan the shares outstanding requests needed to compute market caps for daily rows in
+    [start, end]. Records are needed from lookback_days before start, so the one in effect on
+    start is known. Shares change a few times a year, so a fetched range counts as fresh for
+    refresh_days after its end; once stale, it is requested again from the day after it.
+    :param covered: Dict mapping ticker -> inclusive (start, end) ranges whose shares were fetched.
+    :param tickers: Tickers whose daily rows are being written.
+    :return: Dict mapping an inclusive (start, end) request window to the list of tickers that
+             need it, ordered by window.
+    """
+    first, last = as_date(start) - datetime.timedelta(days=lookback_days), as_date(end)
+    refresh = datetime.timedelta(days=refresh_days)
+    windows = {}
+    for ticker in dict.fromkeys(tickers):
+        fresh = [(range_start, as_date(range_end) + refresh) for range_start, range_end in covered.get(ticker, [])]
+        for gap_start, gap_end in merge_ranges(missing_ranges(fresh, first, last), gap_days=gap_days):
+            windows.setdefault((max(first, gap_start - refresh), gap_end), []).append(ticker)
+    return dict(sorted(windows.items()))
@@ -0,0 +1,279 @@
+import datetime
+import heapq
+import logging
+import math
+import time
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class LiveIndex:
+    """
+    Equal-weighted top-N index kept current from a stream of quotes.
+    The value is the mean price of the top_n tickers by market cap, the definition of
+    CustomIndexCalculator.calculate_index_value, but nothing is re-read or re-sorted per quote.
+    Members sit in a min-heap and the other tickers in a max-heap, both keyed by market cap, and
+    the members' price sum is kept as a running total. A quote pushes one heap entry and adjusts
+    the sum; the membership is then repaired by swapping the largest outsider with the smallest
+    member while the outsider is bigger. So a batch of quotes costs O(k log n) for k changed
+    tickers. Superseded heap entries are skipped when they reach the top and the heaps are
+    rebuilt once they hold twice as many entries as tickers.
+    :param shares: dict of ticker to shares outstanding, so market cap is price x shares.
+    :param prices: dict of ticker to starting price.
+    :param top_n: Number of members.
+    """
+    def __init__(self, shares, prices, top_n=100):
+        self.top_n = top_n
+        self.shares = {ticker: float(count) for ticker, count in shares.items()
+                       if ticker in prices and count > 0}
+        self.prices = {ticker: float(prices[ticker]) for ticker in self.shares}
+        self.quotes = 0
+        self.membership_changes = 0
+        self._entry = {}
+        self._sequence = 0
+        self._rebuild(initial=True)
+
+    @classmethod
+    def from_storage(cls, db_manager, date=None, top_n=100):
+        """
+        Start a live index from the closes of a stored date, by default the latest one. The
+        shares outstanding are the stored market cap over the closing price, so the starting
+        value equals the end-of-day index value of that date.
+        :param db_manager: DatabaseManager or ParquetStorageManager.
+        """
+        if date is None:
+            date = db_manager.query_date_bounds()[1]
+        if date is None:
+            raise ValueError("No stored daily data to start the live index from.")
+        closes = db_manager.query_daily_data_range(date, date, compact=True)
+        closes = closes[(closes['closing_price'] > 0) & (closes['market_cap'] > 0)]
+        tickers = closes['ticker'].astype(str).tolist()
+        prices = closes['closing_price'].to_numpy(dtype=float)
+        shares = closes['market_cap'].to_numpy(dtype=float) / prices
+        logger.info(f"Starting the live index from {len(tickers)} closes of {date}.")
+        return cls(dict(zip(tickers, shares)), dict(zip(tickers, prices)), top_n=top_n)
+
+    def _push(self, heap, ticker, key):
+        # A heap entry is current while it is the ticker's latest one.
+        self._sequence += 1
+        entry = [key, self._sequence, ticker]
+        self._entry[ticker] = entry
+        heapq.heappush(heap, entry)
+
+    def _rebuild(self, initial=False):
+        # Rebuild both heaps from the current prices, dropping superseded entries. The initial
+        # build selects the members; later rebuilds keep them.
+        caps = {ticker: price * self.shares[ticker] for ticker, price in self.prices.items()}
+        if initial:
+            ranked = sorted(caps, key=caps.get, reverse=True)
+            self.members = set(ranked[:self.top_n])
+        self._members_heap, self._others_heap, self._entry = [], [], {}
+        for ticker, cap in caps.items():
+            self._sequence += 1
+            entry = [cap, self._sequence, ticker] if ticker in self.members else [-cap, self._sequence, ticker]
+            self._entry[ticker] = entry
+            (self._members_heap if ticker in self.members else self._others_heap).append(entry)
+        heapq.heapify(self._members_heap)
+        heapq.heapify(self._others_heap)
+        self.resync()
+
+    def _top(self, heap):
+        # The current entry at the top of heap, discarding superseded ones.
+        while heap and self._entry.get(heap[0][2]) is not heap[0]:
+            heapq.heappop(heap)
+        return heap[0] if heap else None
+
+    def _repair(self):
+        # Swap members and outsiders until every member is at least as big as every outsider.
+        while True:
+            outsider = self._top(self._others_heap)
+            if outsider is None:
+                return
+            member = self._top(self._members_heap) if len(self.members) >= self.top_n else None
+            if member is not None and -outsider[0] <= member[0]:
+                return
+            heapq.heappop(self._others_heap)
+            ticker = outsider[2]
+            self.members.add(ticker)
+            self.price_sum += self.prices[ticker]
+            self._push(self._members_heap, ticker, -outsider[0])
+            if member is not None:
+                heapq.heappop(self._members_heap)
+                ticker = member[2]
+                self.members.discard(ticker)
+                self.price_sum -= self.prices[ticker]
+                self._push(self._others_heap, ticker, -member[0])
+            self.membership_changes += 1
+
+    def _apply(self, ticker, price):
+        shares = self.shares.get(ticker)
+        if shares is None or not price > 0 or math.isinf(price):
+            return
+        self.quotes += 1
+        if ticker in self.members:
+            self.price_sum += price - self.prices[ticker]
+            self.prices[ticker] = price
+            self._push(self._members_heap, ticker, price * shares)
+        else:
+            self.prices[ticker] = price
+            self._push(self._others_heap, ticker, -price * shares)
+
+    def update(self, ticker, price):
+        """
+        Apply one quote. Quotes for unknown tickers and non-positive prices are ignored.
+        :return: The index value after the quote.
+        """
+        self._apply(ticker, price)
+        self._repair()
+        self._compact()
+        return self.value
+
+    def update_many(self, quotes):
+        """
+        Apply a batch of (ticker, price) quotes and repair the membership once.
+        :return: The index value after the batch.
+        """
+        for ticker, price in quotes:
+            self._apply(ticker, price)
+        self._repair()
+        self._compact()
+        return self.value
+
+    def _compact(self):
+        if len(self._members_heap) + len(self._others_heap) > 2 * len(self.prices) + 64:
+            self._rebuild()
+
+    def resync(self):
+        """
+        Recompute the members' price sum exactly, clearing the rounding that the running total
+        accumulates. Costs O(top_n).
+        """
+        self.price_sum = math.fsum(self.prices[ticker] for ticker in self.members)
+
+    @property
+    def value(self):
+        """
+        The current index value, or None without members.
+        """
+        return self.price_sum / len(self.members) if self.members else None
+
+    def constituents(self):
+        """
+        The current members by market cap, largest first.
+        :return: pandas DataFrame with columns ticker, price and market_cap.
+        """
+        tickers = list(self.members)
+        df = pd.DataFrame({'ticker': tickers, 'price': [self.prices[t] for t in tickers],
+                           'market_cap': [self.prices[t] * self.shares[t] for t in tickers]})
+        return df.sort_values('market_cap', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def simulated_quotes(prices, batches, batch_size=50, volatility=0.001, interval=0.01, start=None, seed=0):
+    """
+    Generate a reproducible quote stream for testing and benchmarks: every batch moves batch_size
+    randomly chosen tickers by a normal log return.
+    :param prices: dict of ticker to starting price, e.g. LiveIndex.prices.
+    :param batches: Number of batches.
+    :param volatility: Standard deviation of the log return of one quote.
+    :param interval: Simulated seconds between batches.
+    :param start: Timestamp of the first batch; defaults to now.
+    :return: Iterator of (timestamp, [(ticker, price), ...]).
+    """
+    rng = np.random.default_rng(seed)
+    tickers = np.array(list(prices), dtype=object)
+    current = np.array([prices[ticker] for ticker in tickers], dtype=float)
+    timestamp = start or datetime.datetime.now()
+    step = datetime.timedelta(seconds=interval)
+    batch_size = min(batch_size, len(tickers))
+    # Draw many batches at a time, so generating quotes costs little next to applying them.
+    block = max(1, 65_536 // max(batch_size, 1))
+    for first in range(0, batches, block):
+        count = min(block, batches - first)
+        chosen = rng.integers(0, len(tickers), size=(count, batch_size))
+        moves = np.exp(rng.normal(0.0, volatility, size=(count, batch_size)))
+        for rows, factors in zip(chosen, moves):
+            current[rows] *= factors
+            yield timestamp, list(zip(tickers[rows].tolist(), current[rows].tolist()))
+            timestamp += step
+
+
+class SnapshotWriter:
+    """
+    Buffer live index snapshots and write them to storage in batches, so the feed is not slowed
+    by one write transaction per quote. A batch is written once it holds flush_rows snapshots
+    or flush_seconds have passed since the last write, and on close().
+    :param db_manager: DatabaseManager or ParquetStorageManager.
+    """
+    def __init__(self, db_manager, flush_rows=1000, flush_seconds=1.0):
+        self.db_manager = db_manager
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.rows_written = 0
+        self.flushes = 0
+        self._buffer = []
+        self._last_flush = time.monotonic()
+
+    def add(self, timestamp, index_value, constituent_count):
+        """
+        Buffer one snapshot, writing the buffer if it is due.
+        """
+        self._buffer.append((timestamp, index_value, constituent_count))
+        if len(self._buffer) >= self.flush_rows or time.monotonic() - self._last_flush >= self.flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered snapshots in one batch.
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        self.db_manager.append_intraday_index_values(
+            pd.DataFrame(self._buffer, columns=['timestamp', 'index_value', 'constituent_count']))
+        self.rows_written += len(self._buffer)
+        self.flushes += 1
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+
+
+def run_live_index(live_index, feed, writer=None):
+    """
+    Apply a quote feed to a live index, recording a snapshot after every batch of quotes.
+    The running price sum is resynced at every write, which bounds its rounding drift.
+    :param live_index: LiveIndex.
+    :param feed: Iterator of (timestamp, [(ticker, price), ...]), e.g. simulated_quotes().
+    :param writer: Optional SnapshotWriter; it is flushed at the end.
+    :return: dict with quotes, batches, seconds, quotes_per_sec, membership_changes, snapshots_written,
+             flushes and the last index value.
+    """
+    quotes, batches, flushes = live_index.quotes, 0, writer.flushes if writer else 0
+    changes = live_index.membership_changes
+    started = time.perf_counter()
+    for timestamp, batch in feed:
+        value = live_index.update_many(batch)
+        batches += 1
+        if writer is not None:
+            writer.add(timestamp, value, len(live_index.members))
+            if writer.flushes != flushes:
+                flushes = writer.flushes
+                live_index.resync()
+    if writer is not None:
+        writer.close()
+    seconds = time.perf_counter() - started
+    quotes = live_index.quotes - quotes
+    stats = {
+        'quotes': quotes,
+        'batches': batches,
+        'seconds': seconds,
+        'quotes_per_sec': quotes / seconds if seconds > 0 else None,
+        'membership_changes': live_index.membership_changes - changes,
+        'snapshots_written': writer.rows_written if writer else 0,
+        'flushes': writer.flushes if writer else 0,
+        'value': live_index.value,
+    }
+    logger.info(f"Live index run: {stats}")
+    return stats
@@ -0,0 +1,56 @@
+import logging
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def apply_shares_outstanding(daily_df, shares_df):
+    """
+    Compute market caps from effective-dated shares outstanding with one vectorized as-of join.
+    Each daily row takes the latest shares record of its ticker effective on or before its date.
+    Rows without such a record keep their existing market_cap.
+    :param daily_df: DataFrame with columns date, ticker, closing_price and market_cap.
+    :param shares_df: DataFrame with columns ticker, effective_date and shares.
+    :return: Copy of daily_df, in the same order, with market_cap = closing_price * shares.
+    """
+    result = daily_df.copy()
+    if result.empty or shares_df.empty:
+        return result
+    left = pd.DataFrame({
+        'asof': pd.to_datetime(result['date']).to_numpy(),
+        'ticker': result['ticker'].astype(str).to_numpy(),
+        'row': np.arange(len(result)),
+    }).sort_values('asof', kind='stable')
+    right = pd.DataFrame({
+        'asof': pd.to_datetime(shares_df['effective_date']).to_numpy(),
+        'ticker': shares_df['ticker'].astype(str).to_numpy(),
+        'shares': shares_df['shares'].astype(float).to_numpy(),
+    }).sort_values('asof', kind='stable')
+    merged = pd.merge_asof(left, right, on='asof', by='ticker', direction='backward')
+    shares = np.empty(len(result))
+    shares[merged['row'].to_numpy()] = merged['shares'].to_numpy()
+    caps = result['closing_price'].to_numpy(dtype=float) * shares
+    result['market_cap'] = np.where(np.isnan(shares), result['market_cap'].to_numpy(dtype=float), caps)
+    return result
+
+
+def recompute_market_caps(db_manager, revised):
+    """
+    Recompute the stored market caps affected by new or revised shares records.
+    Only the rows of the revised tickers, each from its own earliest revised effective date, are
+    read, recomputed in one as-of join and written back where the value changed; the storage
+    marks those dates for the next index refresh.
+    :param db_manager: DatabaseManager or ParquetStorageManager.
+    :param revised: Dict mapping ticker -> earliest revised effective date ('YYYY-MM-DD').
+    :return: Number of daily rows whose market cap changed.
+    """
+    if not revised:
+        return 0
+    daily = db_manager.query_daily_data_since(revised)
+    updated = apply_shares_outstanding(daily, db_manager.query_shares_outstanding(list(revised)))
+    changed = updated[updated['market_cap'].to_numpy() != daily['market_cap'].to_numpy()]
+    if not changed.empty:
+        db_manager.insert_daily_data_bulk(changed[['date', 'ticker', 'closing_price', 'market_cap']])
+    logger.info(f"Recomputed {len(changed)} market caps for {len(revised)} tickers with revised shares outstanding.")
+    return len(changed)
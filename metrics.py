@@ -0,0 +1,222 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds for latency histograms; the +Inf bucket is implicit.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _key(name, labels):
+    # Canonical identity of a metric sample: its name plus sorted labels.
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_value(value):
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram. Keeps only bucket counts, count, sum, min and max, so memory does
+    not grow with the number of observations.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        Estimate a quantile as the upper bound of the bucket containing it (max for +Inf).
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5), 'p95': self.quantile(0.95), 'p99': self.quantile(0.99),
+        }
+
+
+class MetricsRegistry:
+    """
+    Thread-safe registry of counters, gauges and histograms for one pipeline run.
+    Metrics are identified by name and keyword labels, e.g. inc("rows_written_total", 500, table="daily").
+    The registry renders a structured JSON summary and the Prometheus text exposition format.
+    :param prefix: Prepended to every metric name in the Prometheus output.
+    """
+    def __init__(self, prefix="hedgineer_"):
+        self.prefix = prefix
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        """
+        Add amount to a counter.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        """
+        Set a gauge to value.
+        """
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def observe(self, name, value, buckets=DEFAULT_BUCKETS, **labels):
+        """
+        Record value in a histogram.
+        """
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """
+        Time the enclosed block into the histogram name (seconds).
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    @contextmanager
+    def stage(self, stage):
+        """
+        Time one pipeline stage. The duration is added to the stage_seconds gauge, so a stage
+        entered once per chunk reports its total, and a stage_failures_total counter is
+        incremented if the block raises.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("stage_failures_total", stage=stage)
+            raise
+        finally:
+            key = _key("stage_seconds", {'stage': stage})
+            with self._lock:
+                self.gauges[key] = self.gauges.get(key, 0.0) + time.perf_counter() - started
+
+    def summary(self):
+        """
+        Return the run summary as a JSON-serializable dict. Samples are keyed by name plus labels
+        in Prometheus notation, e.g. 'stage_seconds{stage="fetch"}'.
+        """
+        with self._lock:
+            return {
+                'started': self.started,
+                'duration_seconds': time.time() - self.started,
+                'counters': {name + _format_labels(labels): value for (name, labels), value in self.counters.items()},
+                'gauges': {name + _format_labels(labels): value for (name, labels), value in self.gauges.items()},
+                'histograms': {name + _format_labels(labels): histogram.to_dict()
+                               for (name, labels), histogram in self.histograms.items()},
+            }
+
+    def to_prometheus(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self._lock:
+            for kind, samples in (("counter", self.counters), ("gauge", self.gauges)):
+                for name in sorted({name for name, _ in samples}):
+                    lines.append(f"# TYPE {self.prefix}{name} {kind}")
+                    for (sample_name, labels), value in sorted(samples.items()):
+                        if sample_name == name:
+                            lines.append(f"{self.prefix}{name}{_format_labels(labels)} {_format_value(value)}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {self.prefix}{name} histogram")
+                for (sample_name, labels), histogram in sorted(self.histograms.items()):
+                    if sample_name != name:
+                        continue
+                    cumulative = 0
+                    bounds = [repr(float(bound)) for bound in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{self.prefix}{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{self.prefix}{name}_sum{_format_labels(labels)} {_format_value(histogram.sum)}")
+                    lines.append(f"{self.prefix}{name}_count{_format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path=None, prometheus_path=None):
+        """
+        Write the JSON summary and/or the Prometheus text file. Files are replaced atomically so
+        a collector (e.g. the node_exporter textfile collector) never reads a partial file.
+        """
+        for path, content in ((json_path, lambda: json.dumps(self.summary(), indent=2)),
+                              (prometheus_path, self.to_prometheus)):
+            if path is None:
+                continue
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(content())
+            os.replace(tmp_path, path)
+            logger.info(f"Wrote metrics to {path}")
+
+
+class SampledLogger:
+    """
+    Log only the first message and then every Nth message of a repeated event, counting the rest.
+    Use it instead of logging inside hot loops; flush() reports how many messages were suppressed.
+    :param every: Log one message out of every `every`.
+    """
+    def __init__(self, target_logger, every=100):
+        self.logger = target_logger
+        self.every = every
+        self.seen = 0
+        self._lock = threading.Lock()
+
+    def log(self, level, message):
+        with self._lock:
+            self.seen += 1
+            emit = self.seen == 1 or self.seen % self.every == 0
+        if emit:
+            self.logger.log(level, f"{message} (occurrence {self.seen})")
+
+    def flush(self, level=logging.INFO, event="messages"):
+        if self.seen > 1:
+            self.logger.log(level, f"{self.seen} {event} in total; logged 1 in {self.every}.")
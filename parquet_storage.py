@@ -0,0 +1,832 @@
+import argparse
+import json
+import logging
+import os
+import time
+import numpy as np
+import pandas as pd
+from database_manager import compact_daily_frame, join_daily_chunks
+from ingestion_state import merge_ranges
+from index_analytics import ANALYTICS_COLUMNS
+from index_rebalance import compute_rebalance_events, rebalance_dates_to_refresh
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pc = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+
+class ParquetStorageManager:
+    """
+    Columnar storage backend with the same operations as DatabaseManager.
+    daily_data is stored as one partition per date under root_dir/daily_data/date=YYYY-MM-DD/,
+    so analytical reads only open the partitions and columns they need and are memory-mapped
+    straight into Arrow buffers. A write adds its changed rows to a partition as a new part file
+    (part-N.parquet, later parts winning per ticker), and the parts are compacted into one file
+    by the next index refresh or once MAX_PARTS accumulate. The materialized index tables are
+    kept as single Parquet files, except the running index analytics: they are appended daily,
+    so they are kept as segment files over date ranges under root_dir/index_analytics/ (see
+    append_index_analytics).
+    """
+    DAILY_SCHEMA_COLUMNS = ['ticker', 'closing_price', 'market_cap']
+    # Part files a date partition may collect before a write compacts it.
+    MAX_PARTS = 16
+    ANALYTICS_DIR = "index_analytics"
+
+    def __init__(self, root_dir="data_parquet"):
+        if pq is None:
+            raise ImportError("The parquet storage backend requires pyarrow (pip install pyarrow).")
+        self.root_dir = root_dir
+        self.daily_dir = os.path.join(root_dir, "daily_data")
+        self.create_tables()
+
+    def create_tables(self):
+        """
+        Create the storage directory layout.
+        """
+        os.makedirs(self.daily_dir, exist_ok=True)
+        # Stores written before analytics were segmented keep them in one file: it becomes the
+        # first segment.
+        legacy = self._path("index_analytics.parquet")
+        if os.path.exists(legacy):
+            dates = pq.read_table(legacy, columns=['date']).column('date').to_pylist()
+            if dates:
+                os.makedirs(self._path(self.ANALYTICS_DIR), exist_ok=True)
+                os.replace(legacy, self._analytics_path(min(dates), max(dates), 0))
+            else:
+                os.remove(legacy)
+
+    def _path(self, name):
+        return os.path.join(self.root_dir, name)
+
+    def _partition_parts(self, date):
+        # The part files of a date partition, oldest first; later parts win for the same ticker.
+        partition_dir = os.path.join(self.daily_dir, f"date={date}")
+        if not os.path.isdir(partition_dir):
+            return []
+        numbers = sorted(int(name[len("part-"):-len(".parquet")]) for name in os.listdir(partition_dir)
+                         if name.startswith("part-") and name.endswith(".parquet"))
+        return [os.path.join(partition_dir, f"part-{number}.parquet") for number in numbers]
+
+    def _read_partition(self, date, columns=None, parts=None):
+        # Read a date partition as one Arrow table with a single row per ticker, or None.
+        parts = self._partition_parts(date) if parts is None else parts
+        if not parts:
+            return None
+        read_columns = None if columns is None else list(dict.fromkeys(['ticker'] + list(columns)))
+        tables = [pq.read_table(path, columns=read_columns, memory_map=True) for path in parts]
+        table = tables[0] if len(tables) == 1 else pa.concat_tables(tables)
+        if len(tables) > 1:
+            latest = ~pd.Series(table.column('ticker').to_numpy(zero_copy_only=False)).duplicated(keep='last')
+            table = table.filter(pa.array(latest.to_numpy()))
+        return table if columns is None else table.select(list(columns))
+
+    def _compact_partition(self, date, parts=None):
+        # Merge the parts of a partition into one file. The merged file is written as the newest
+        # part before the older ones are removed, so a crash in between loses nothing.
+        parts = self._partition_parts(date) if parts is None else parts
+        if len(parts) < 2:
+            return
+        table = self._read_partition(date, parts=parts)
+        path = os.path.join(os.path.dirname(parts[-1]), f"part-{self._part_number(parts[-1]) + 1}.parquet")
+        tmp_path = path + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, path)
+        for part in parts:
+            os.remove(part)
+
+    @staticmethod
+    def _part_number(path):
+        return int(os.path.basename(path)[len("part-"):-len(".parquet")])
+
+    def _read_file(self, name, columns=None):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return None
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+    def _write_file(self, df, path):
+        # Write to a temporary file first so readers never see a partial file.
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+        os.replace(tmp_path, path)
+
+    def _load_dirty_dates(self, name="dirty_dates.json"):
+        path = self._path(name)
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            return set(json.load(f))
+
+    def _save_dirty_dates(self, dates, name="dirty_dates.json"):
+        self._write_json(sorted(dates), name)
+
+    def _write_json(self, value, name):
+        # Replace the file atomically, so a crash mid-write never leaves it truncated.
+        path = self._path(name)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def get_data_version(self):
+        """
+        Return the data version stamp, bumped by every write and index refresh.
+        """
+        path = self._path("data_version.json")
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return json.load(f)
+
+    def _bump_data_version(self):
+        self._write_json(self.get_data_version() + 1, "data_version.json")
+
+    def insert_stock(self, ticker, name=None):
+        """
+        Insert a stock into the stocks table if it doesn't already exist.
+        """
+        self._register_stocks(pd.DataFrame({'ticker': [ticker], 'name': [name]}), replace=True)
+
+    def _register_stocks(self, stocks_df, replace=False):
+        existing = self._read_file("stocks.parquet")
+        if existing is not None:
+            if replace:
+                stocks_df = pd.concat([existing, stocks_df]).drop_duplicates('ticker', keep='last')
+            else:
+                stocks_df = stocks_df[~stocks_df['ticker'].isin(existing['ticker'])]
+                if stocks_df.empty:
+                    return
+                stocks_df = pd.concat([existing, stocks_df])
+        self._write_file(stocks_df.astype({'ticker': str, 'name': object}), self._path("stocks.parquet"))
+
+    def insert_daily_data(self, date, ticker, closing_price, market_cap):
+        """
+        Insert daily stock data for one ticker and date.
+        """
+        self.insert_daily_data_bulk(pd.DataFrame({
+            'date': [date], 'ticker': [ticker], 'closing_price': [closing_price], 'market_cap': [market_cap],
+        }))
+
+    def insert_daily_data_bulk(self, data, batch_size=50_000):
+        """
+        Insert daily stock data in bulk.
+        Accepts a DataFrame or an iterable of DataFrames with columns date, ticker,
+        closing_price and market_cap. Rows are merged into their date partitions, replacing
+        existing rows for the same ticker. Rows identical to the stored ones are skipped, so only
+        dates whose rows changed are marked for index refresh and bump the data version, as the
+        SQLite upsert does.
+        :return: dict with the rows written, elapsed seconds and rows per second.
+        """
+        frames = [data] if isinstance(data, pd.DataFrame) else data
+        rows_written = 0
+        written_dates = set()
+        started = time.perf_counter()
+        for frame in frames:
+            for offset in range(0, len(frame), batch_size):
+                batch = frame.iloc[offset:offset + batch_size]
+                rows_written += self._write_daily_batch(batch, written_dates)
+        if written_dates:
+            self._save_dirty_dates(self._load_dirty_dates() | written_dates)
+            self._save_dirty_dates(self._load_dirty_dates("quality_dirty_dates.json") | written_dates,
+                                   "quality_dirty_dates.json")
+            self._bump_data_version()
+        elapsed = time.perf_counter() - started
+        stats = {
+            'rows': rows_written,
+            'seconds': elapsed,
+            'rows_per_sec': rows_written / elapsed if elapsed > 0 else 0.0,
+        }
+        logger.info(f"Inserted {rows_written} daily rows in {elapsed:.2f}s ({stats['rows_per_sec']:.0f} rows/sec)")
+        return stats
+
+    def _write_daily_batch(self, batch, dirty_dates):
+        batch = pd.DataFrame({
+            'date': pd.to_datetime(batch['date']).dt.strftime('%Y-%m-%d'),
+            'ticker': batch['ticker'].astype(str),
+            'closing_price': batch['closing_price'].astype(float),
+            'market_cap': batch['market_cap'].astype(float),
+        })
+        self._register_stocks(pd.DataFrame({'ticker': batch['ticker'].unique(), 'name': None}))
+        for date, rows in batch.groupby('date', sort=False):
+            parts = self._partition_parts(date)
+            rows = rows[self.DAILY_SCHEMA_COLUMNS].drop_duplicates('ticker', keep='last')
+            if parts:
+                existing = self._read_partition(date, self.DAILY_SCHEMA_COLUMNS, parts=parts).to_pandas()
+                # Drop the rows whose values are already stored; NaN matches NaN, like IS NOT.
+                stored = rows.merge(existing, on='ticker', how='left', suffixes=('', '_stored'), indicator=True)
+                unchanged = (stored['_merge'] == 'both').to_numpy(copy=True)
+                for column in ('closing_price', 'market_cap'):
+                    new, old = stored[column].to_numpy(), stored[f"{column}_stored"].to_numpy()
+                    unchanged &= (new == old) | (np.isnan(new) & np.isnan(old))
+                rows = rows[~unchanged]
+                if rows.empty:
+                    continue
+            # The changed rows go to a new part file instead of rewriting the partition, so
+            # streaming many small chunks costs one small write each. Partitions with too many
+            # parts are compacted here, and every partition changed since the last index refresh
+            # is compacted by it.
+            number = self._part_number(parts[-1]) + 1 if parts else 0
+            path = os.path.join(self.daily_dir, f"date={date}", f"part-{number}.parquet")
+            self._write_file(rows.reset_index(drop=True), path)
+            if len(parts) + 1 >= self.MAX_PARTS:
+                self._compact_partition(date)
+            dirty_dates.add(date)
+        return len(batch)
+
+    def _read_daily(self, start_date, end_date, columns):
+        # Read only the date partitions in range and the requested columns.
+        start = pd.to_datetime(start_date).strftime('%Y-%m-%d')
+        end = pd.to_datetime(end_date).strftime('%Y-%m-%d')
+        dates = sorted(
+            name[len("date="):] for name in os.listdir(self.daily_dir)
+            if name.startswith("date=") and start <= name[len("date="):] <= end
+        )
+        return self._read_partitions(dates, columns)
+
+    def _read_partitions(self, dates, columns, tickers=None):
+        # With tickers, other tickers' rows are dropped in Arrow, before conversion to pandas.
+        tickers = pa.array(list(tickers), pa.string()) if tickers is not None else None
+        tables = []
+        for date in dates:
+            table = self._read_partition(date, columns)
+            if table is None:
+                continue
+            if tickers is not None:
+                table = table.filter(pc.is_in(table['ticker'], value_set=tickers))
+            tables.append(table.append_column('date', pa.array([date] * table.num_rows, pa.string())))
+        if not tables:
+            empty = {column: pd.Series(dtype=object if column == 'ticker' else float) for column in columns}
+            empty['date'] = pd.Series(dtype=object)
+            return pd.DataFrame(empty)
+        return pa.concat_tables(tables).to_pandas()
+
+    @staticmethod
+    def _rank(df, limit):
+        # Rank tickers by market cap within each date and keep the top `limit`.
+        df = df.sort_values(['date', 'market_cap'], ascending=[True, False], kind='stable')
+        df['rank'] = df.groupby('date').cumcount() + 1
+        return df[df['rank'] <= limit].reset_index(drop=True)
+
+    def query_top_stocks(self, date, limit=100):
+        """
+        Query the top stocks by market cap for a given date.
+        Returns a pandas DataFrame.
+        """
+        df = self._read_daily(date, date, self.DAILY_SCHEMA_COLUMNS)
+        df = df.sort_values('market_cap', ascending=False, kind='stable').head(limit)
+        return df[self.DAILY_SCHEMA_COLUMNS].reset_index(drop=True)
+
+    def iter_daily_arrays(self, start_date, end_date, chunksize=100_000, float32=False):
+        """
+        Stream the daily rows between start_date and end_date (inclusive), ordered by date and
+        market cap, as typed column arrays built from whole date partitions of about chunksize rows.
+        Tickers are mapped to their position in the stocks file, so no per-row strings reach pandas.
+        :param float32: Return closing prices as float32; market caps stay float64.
+        :return: Tuple (tickers, chunks) as in DatabaseManager.iter_daily_arrays.
+        """
+        stocks = self._read_file("stocks.parquet")
+        tickers = pd.Index([] if stocks is None else stocks['ticker'].tolist(), dtype=object)
+        start = pd.to_datetime(start_date).strftime('%Y-%m-%d')
+        end = pd.to_datetime(end_date).strftime('%Y-%m-%d')
+        dates = sorted(
+            name[len("date="):] for name in os.listdir(self.daily_dir)
+            if name.startswith("date=") and start <= name[len("date="):] <= end
+        )
+
+        def to_arrays(date, table):
+            caps = table.column('market_cap').to_numpy(zero_copy_only=False).astype(np.float64)
+            order = np.argsort(-np.nan_to_num(caps, nan=-np.inf), kind='stable')
+            return {
+                'date_id': np.full(table.num_rows, int(date.replace('-', '')), dtype=np.int32),
+                'ticker_code': tickers.get_indexer(table.column('ticker').to_numpy(zero_copy_only=False))
+                                      .astype(np.int32)[order],
+                'closing_price': table.column('closing_price').to_numpy(zero_copy_only=False)
+                                      .astype(np.float32 if float32 else np.float64)[order],
+                'market_cap': caps[order],
+            }
+
+        def chunks():
+            pending, rows = [], 0
+            for date in dates:
+                table = self._read_partition(date, self.DAILY_SCHEMA_COLUMNS)
+                if table is None:
+                    continue
+                pending.append(to_arrays(date, table))
+                rows += len(pending[-1]['date_id'])
+                if rows >= chunksize:
+                    yield join_daily_chunks(pending, float32=float32)
+                    pending, rows = [], 0
+            if pending:
+                yield join_daily_chunks(pending, float32=float32)
+
+        return tickers, chunks()
+
+    def iter_daily_data(self, start_date, end_date, chunksize=100_000, float32=False, date_ids=False):
+        """
+        Stream the daily rows between start_date and end_date (inclusive) as compact DataFrames.
+        :return: Iterator of DataFrames as in DatabaseManager.iter_daily_data.
+        """
+        tickers, chunks = self.iter_daily_arrays(start_date, end_date, chunksize=chunksize, float32=float32)
+        for columns in chunks:
+            yield compact_daily_frame(columns, tickers, date_ids=date_ids)
+
+    def query_daily_data_range(self, start_date, end_date, compact=False, float32=False, date_ids=False):
+        """
+        Query all daily rows between start_date and end_date (inclusive),
+        ordered by date and market cap.
+        :param compact: Return categorical tickers and datetime64 dates, as in DatabaseManager.
+        :param float32: With compact, return closing prices as float32.
+        :param date_ids: With compact, return dates as int32 YYYYMMDD.
+        """
+        if compact:
+            tickers, chunks = self.iter_daily_arrays(start_date, end_date, float32=float32)
+            return compact_daily_frame(join_daily_chunks(list(chunks), float32=float32), tickers,
+                                       date_ids=date_ids)
+        df = self._read_daily(start_date, end_date, self.DAILY_SCHEMA_COLUMNS)
+        df = df.sort_values(['date', 'market_cap'], ascending=[True, False], kind='stable')
+        return df[['ticker', 'closing_price', 'market_cap', 'date']].reset_index(drop=True)
+
+    def query_daily_data_since(self, starts):
+        """
+        Query the daily rows of each given ticker from its own start date on, ordered by date and
+        ticker. Only the partitions from the earliest start are opened, and other tickers' rows
+        are dropped before they reach pandas.
+        :param starts: Dict mapping ticker -> first date to return.
+        """
+        starts = {ticker: pd.to_datetime(date).strftime('%Y-%m-%d') for ticker, date in starts.items()}
+        first = min(starts.values(), default='9999-12-31')
+        dates = sorted(name[len("date="):] for name in os.listdir(self.daily_dir)
+                       if name.startswith("date=") and name[len("date="):] >= first)
+        df = self._read_partitions(dates, self.DAILY_SCHEMA_COLUMNS, tickers=starts)
+        df = df[df['date'] >= df['ticker'].map(starts)]
+        return df.sort_values(['date', 'ticker'], kind='stable')[['ticker', 'closing_price', 'market_cap', 'date']] \
+            .reset_index(drop=True)
+
+    def query_date_bounds(self):
+        """
+        Return the earliest and latest stored dates, or (None, None) if there is no data.
+        """
+        dates = sorted(name[len("date="):] for name in os.listdir(self.daily_dir) if name.startswith("date="))
+        if not dates:
+            return None, None
+        return dates[0], dates[-1]
+
+    def query_top_stocks_range(self, start_date, end_date, limit=100):
+        """
+        Query the top stocks by market cap for every date between start_date and end_date.
+        Returns a pandas DataFrame with columns date, ticker, closing_price, market_cap and rank.
+        """
+        df = self._read_daily(start_date, end_date, self.DAILY_SCHEMA_COLUMNS)
+        ranked = self._rank(df, limit)
+        return ranked[['date', 'ticker', 'closing_price', 'market_cap', 'rank']]
+
+    def refresh_index_tables(self, limit=100):
+        """
+        Recompute index_values and index_constituents for the dates written since the last refresh,
+        together with the rebalance events and turnover of those dates and the dates that follow them.
+        :return: Number of dates recomputed.
+        """
+        dirty_dates = self._load_dirty_dates()
+        if not dirty_dates:
+            return 0
+        ranked = self._rank(self._read_partitions(sorted(dirty_dates), self.DAILY_SCHEMA_COLUMNS), limit)
+        values = ranked.groupby('date').agg(index_value=('closing_price', 'mean'),
+                                            constituent_count=('ticker', 'size')).reset_index()
+        for name, new_rows in (("index_values.parquet", values),
+                               ("index_constituents.parquet", ranked[['date', 'ticker', 'rank']])):
+            self._replace_dates(name, new_rows, dirty_dates)
+        self._refresh_rebalance_events(dirty_dates)
+        # Running analytics accumulate over dates, so every row after a change is stale.
+        self._truncate_analytics(min(dirty_dates))
+        self._compact_analytics()
+        # The changed partitions were just read; merge their part files once per refresh.
+        for date in dirty_dates:
+            self._compact_partition(date)
+        self._save_dirty_dates(set())
+        self._bump_data_version()
+        logger.info(f"Refreshed materialized index for {len(dirty_dates)} dates.")
+        return len(dirty_dates)
+
+    def _replace_dates(self, name, new_rows, dates):
+        # Swap the rows of the given dates in a single-file table for new_rows.
+        existing = self._read_file(name)
+        if existing is not None:
+            new_rows = pd.concat([existing[~existing['date'].isin(dates)], new_rows])
+        self._write_file(new_rows.sort_values('date', kind='stable').reset_index(drop=True), self._path(name))
+
+    def _refresh_rebalance_events(self, dirty_dates):
+        stored = np.array(sorted(self._read_file("index_values.parquet", columns=['date'])['date']), dtype=str)
+        refresh, needed = rebalance_dates_to_refresh(stored, dirty_dates)
+        constituents = self._read_file("index_constituents.parquet", columns=['date', 'ticker'])
+        events_df, turnover_df = compute_rebalance_events(constituents[constituents['date'].isin(needed)])
+        stale = refresh.union(dirty_dates)
+        self._replace_dates("index_rebalance_events.parquet", events_df[events_df['date'].isin(refresh)], stale)
+        self._replace_dates("index_turnover.parquet", turnover_df[turnover_df['date'].isin(refresh)], stale)
+
+    def _read_date_range(self, name, start_date, end_date, empty_columns):
+        df = self._read_file(name)
+        if df is None:
+            return pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in empty_columns.items()})
+        return df[(df['date'] >= start_date) & (df['date'] <= end_date)].reset_index(drop=True)
+
+    def query_rebalance_events(self, start_date, end_date):
+        """
+        Read the persisted index entries and exits between start_date and end_date (inclusive).
+        """
+        return self._read_date_range("index_rebalance_events.parquet", start_date, end_date,
+                                     {'date': object, 'ticker': object, 'event': object})
+
+    def query_turnover(self, start_date, end_date):
+        """
+        Read the persisted daily index turnover between start_date and end_date (inclusive).
+        """
+        return self._read_date_range("index_turnover.parquet", start_date, end_date,
+                                     {'date': object, 'entries': 'int64', 'exits': 'int64',
+                                      'constituent_count': 'int64', 'turnover': float})
+
+    def query_index_values(self, start_date, end_date):
+        """
+        Read the materialized index values between start_date and end_date (inclusive).
+        """
+        return self._read_date_range("index_values.parquet", start_date, end_date,
+                                     {'date': object, 'index_value': float, 'constituent_count': 'int64'})
+
+    def query_market_returns(self, start_date, end_date):
+        """
+        Compute the market-cap-weighted price return of every stored ticker on each index date
+        between start_date and end_date (inclusive), relative to the previous index date.
+        """
+        stored = self._read_file("index_values.parquet", columns=['date'])
+        dates = np.array(sorted(stored['date']) if stored is not None else [], dtype=object)
+        in_range = np.flatnonzero((dates >= start_date) & (dates <= end_date))
+        in_range = in_range[in_range > 0]
+        if not len(in_range):
+            return pd.DataFrame({'date': pd.Series(dtype=object), 'market_return': pd.Series(dtype=float)})
+        previous = dict(zip(dates[in_range], dates[in_range - 1]))
+        prices = self._read_partitions(sorted(set(previous) | set(previous.values())), self.DAILY_SCHEMA_COLUMNS)
+        current = prices[prices['date'].isin(previous)].assign(prev_date=lambda df: df['date'].map(previous))
+        merged = current.merge(prices, left_on=['prev_date', 'ticker'], right_on=['date', 'ticker'],
+                               suffixes=('', '_prev'))
+        merged = merged[(merged['closing_price_prev'] > 0) & (merged['market_cap_prev'] > 0)]
+        merged['weighted'] = merged['market_cap_prev'] * merged['closing_price'] / merged['closing_price_prev']
+        sums = merged.groupby('date')[['weighted', 'market_cap_prev']].sum()
+        return (sums['weighted'] / sums['market_cap_prev'] - 1).rename('market_return').reset_index()
+
+    def _analytics_path(self, first, last, sequence):
+        return self._path(os.path.join(self.ANALYTICS_DIR, f"{first}_{last}_{sequence}.parquet"))
+
+    def _analytics_segments(self):
+        # The analytics segment files as (first date, last date, sequence, path), in date order.
+        # Segments cover disjoint date ranges; should a crash leave an overlap behind, the segment
+        # with the higher sequence number wins.
+        root = self._path(self.ANALYTICS_DIR)
+        segments = []
+        for name in os.listdir(root) if os.path.isdir(root) else []:
+            if name.endswith(".parquet"):
+                first, last, sequence = name[:-len(".parquet")].split("_")
+                segments.append((first, last, int(sequence), os.path.join(root, name)))
+        return sorted(segments)
+
+    def _read_analytics(self, segments):
+        tables = [pq.read_table(path, memory_map=True) for *_, path in sorted(segments, key=lambda s: s[2])]
+        if not tables:
+            return pd.DataFrame({column: pd.Series(dtype=object if column == 'date' else float)
+                                 for column in ANALYTICS_COLUMNS})
+        df = pa.concat_tables(tables).to_pandas().drop_duplicates('date', keep='last')
+        return df.sort_values('date', kind='stable').reset_index(drop=True)
+
+    def _write_analytics(self, rows, replaced):
+        # Write rows as one new segment, then remove the segments it replaces, so a crash in
+        # between leaves rows that are read twice rather than lost.
+        if not rows.empty:
+            sequence = max((segment[2] for segment in self._analytics_segments()), default=0) + 1
+            self._write_file(rows.reset_index(drop=True),
+                             self._analytics_path(rows['date'].min(), rows['date'].max(), sequence))
+        for *_, path in replaced:
+            os.remove(path)
+
+    def _truncate_analytics(self, date):
+        # Drop the analytics rows from date on, rewriting only the segment that straddles it.
+        stale = [segment for segment in self._analytics_segments() if segment[1] >= date]
+        kept = self._read_analytics([segment for segment in stale if segment[0] < date])
+        self._write_analytics(kept[kept['date'] < date], stale)
+
+    def _compact_analytics(self):
+        # Merge the newest segments while together they hold at least half as many rows as the
+        # segment before them. Segment sizes then grow geometrically, so there are O(log n) of
+        # them and each row is rewritten O(log n) times over the life of the store.
+        segments = self._analytics_segments()
+        rows = [pq.read_metadata(path).num_rows for *_, path in segments]
+        merged, total = 1, rows[-1] if rows else 0
+        while merged < len(segments) and 2 * total >= rows[-merged - 1]:
+            total += rows[-merged - 1]
+            merged += 1
+        if merged > 1:
+            self._write_analytics(self._read_analytics(segments[-merged:]), segments[-merged:])
+
+    def query_index_analytics(self, start_date=None, end_date=None):
+        """
+        Read the stored running index analytics, optionally between start_date and end_date (inclusive).
+        Only the segments overlapping the range are opened.
+        """
+        segments = [segment for segment in self._analytics_segments()
+                    if (start_date is None or segment[1] >= start_date) and (end_date is None or segment[0] <= end_date)]
+        df = self._read_analytics(segments)
+        if start_date is not None:
+            df = df[df['date'] >= start_date]
+        if end_date is not None:
+            df = df[df['date'] <= end_date]
+        return df.reset_index(drop=True)
+
+    def query_last_index_analytics(self, n=1):
+        """
+        Read the n most recent stored index analytics rows, oldest first, from the newest segments only.
+        """
+        segments, rows = self._analytics_segments(), 0
+        newest = len(segments)
+        while newest > 0 and rows < n:
+            newest -= 1
+            rows += pq.read_metadata(segments[newest][3]).num_rows
+        return self._read_analytics(segments[newest:]).tail(n).reset_index(drop=True)
+
+    def append_index_analytics(self, analytics_df):
+        """
+        Store index analytics rows, replacing any stored rows of the same dates.
+        The rows are written as a new segment file, so a daily append costs the size of the new
+        rows rather than of the stored history; only segments holding dates being replaced are
+        merged into it. The next index refresh compacts the segments.
+        """
+        rows = analytics_df[ANALYTICS_COLUMNS]
+        if rows.empty:
+            return
+        first, last = rows['date'].min(), rows['date'].max()
+        overlapping = [segment for segment in self._analytics_segments() if segment[1] >= first and segment[0] <= last]
+        if overlapping:
+            kept = self._read_analytics(overlapping)
+            rows = pd.concat([kept[~kept['date'].isin(set(rows['date']))], rows])
+        self._write_analytics(rows.sort_values('date', kind='stable'), overlapping)
+
+    def append_intraday_index_values(self, snapshots_df):
+        """
+        Store a batch of live index snapshots as one new file per date under intraday_index_values/,
+        so a flush costs the size of the batch rather than of the stored history.
+        :param snapshots_df: DataFrame with columns timestamp, index_value and constituent_count.
+        """
+        df = snapshots_df[['timestamp', 'index_value', 'constituent_count']].copy()
+        df['timestamp'] = pd.to_datetime(df['timestamp']).astype('datetime64[us]')
+        for date, rows in df.groupby(df['timestamp'].dt.strftime('%Y-%m-%d'), sort=True):
+            first, last = rows['timestamp'].astype(np.int64).agg(['min', 'max'])
+            self._write_file(rows.reset_index(drop=True),
+                             self._path(os.path.join("intraday_index_values", f"date={date}", f"{first}-{last}.parquet")))
+
+    def query_intraday_index_values(self, start=None, end=None):
+        """
+        Read the stored live index snapshots, optionally between the start and end timestamps (inclusive).
+        """
+        root = self._path("intraday_index_values")
+        start = pd.Timestamp(start) if start is not None else None
+        end = pd.Timestamp(end) if end is not None else None
+        tables = []
+        for partition in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+            date = partition[len("date="):]
+            if (start is not None and date < start.strftime('%Y-%m-%d')) or \
+                    (end is not None and date > end.strftime('%Y-%m-%d')):
+                continue
+            for name in sorted(os.listdir(os.path.join(root, partition))):
+                if name.endswith(".parquet"):
+                    tables.append(pq.read_table(os.path.join(root, partition, name), memory_map=True))
+        if not tables:
+            return pd.DataFrame({'timestamp': pd.Series(dtype='datetime64[us]'), 'index_value': pd.Series(dtype=float),
+                                 'constituent_count': pd.Series(dtype=np.int64)})
+        df = pa.concat_tables(tables).to_pandas()
+        if start is not None:
+            df = df[df['timestamp'] >= start]
+        if end is not None:
+            df = df[df['timestamp'] <= end]
+        df = df.drop_duplicates('timestamp', keep='last').sort_values('timestamp', kind='stable')
+        return df.reset_index(drop=True)
+
+    def query_index_constituents(self, date):
+        """
+        Read the materialized index constituents for a given date, ordered by rank.
+        """
+        df = self._read_file("index_constituents.parquet")
+        if df is None:
+            return pd.DataFrame({'ticker': pd.Series(dtype=object), 'rank': pd.Series(dtype='int64')})
+        return df.loc[df['date'] == date, ['ticker', 'rank']].sort_values('rank').reset_index(drop=True)
+
+    def query_ingestion_coverage(self, tickers=None):
+        """
+        Return the covered (already fetched) inclusive date ranges of each ticker.
+        :return: DataFrame with columns ticker, start_date and end_date, ordered by ticker and start.
+        """
+        return self._query_coverage("ingestion_coverage.parquet", tickers)
+
+    def query_shares_coverage(self, tickers=None):
+        """
+        Return the inclusive date ranges whose shares outstanding records have been fetched,
+        like query_ingestion_coverage.
+        """
+        return self._query_coverage("shares_coverage.parquet", tickers)
+
+    def _query_coverage(self, name, tickers):
+        df = self._read_file(name)
+        if df is None:
+            return pd.DataFrame({'ticker': pd.Series(dtype=object), 'start_date': pd.Series(dtype=object),
+                                 'end_date': pd.Series(dtype=object)})
+        if tickers is not None:
+            df = df[df['ticker'].isin(list(tickers))]
+        return df.sort_values(['ticker', 'start_date'], kind='stable').reset_index(drop=True)
+
+    def record_ingestion_coverage(self, tickers, start_date, end_date):
+        """
+        Mark [start_date, end_date] (inclusive) as fetched for each ticker, merging it with the
+        ticker's existing ranges.
+        """
+        self._record_coverage("ingestion_coverage.parquet", tickers, start_date, end_date)
+
+    def record_shares_coverage(self, tickers, start_date, end_date):
+        """
+        Mark the shares outstanding of [start_date, end_date] (inclusive) as fetched for each
+        ticker, like record_ingestion_coverage.
+        """
+        self._record_coverage("shares_coverage.parquet", tickers, start_date, end_date)
+
+    def _record_coverage(self, name, tickers, start_date, end_date):
+        tickers = list(dict.fromkeys(tickers))
+        if not tickers:
+            return
+        existing = self._query_coverage(name, None)
+        affected = existing[existing['ticker'].isin(tickers)]
+        ranges = {ticker: [(start_date, end_date)] for ticker in tickers}
+        for ticker, start, end in affected.itertuples(index=False, name=None):
+            ranges[ticker].append((start, end))
+        merged = pd.DataFrame([
+            {'ticker': ticker, 'start_date': start.strftime('%Y-%m-%d'), 'end_date': end.strftime('%Y-%m-%d')}
+            for ticker, ticker_ranges in ranges.items() for start, end in merge_ranges(ticker_ranges)
+        ])
+        coverage = pd.concat([existing[~existing['ticker'].isin(tickers)], merged], ignore_index=True)
+        self._write_file(coverage, self._path(name))
+
+    def query_shares_outstanding(self, tickers=None):
+        """
+        Return the effective-dated shares outstanding records.
+        :return: DataFrame with columns ticker, effective_date and shares, ordered by ticker and date.
+        """
+        df = self._read_file("shares_outstanding.parquet")
+        if df is None:
+            return pd.DataFrame(columns=['ticker', 'effective_date', 'shares'])
+        if tickers is not None:
+            df = df[df['ticker'].isin(list(tickers))]
+        return df.sort_values(['ticker', 'effective_date'], kind='stable').reset_index(drop=True)
+
+    def upsert_shares_outstanding(self, shares_df):
+        """
+        Insert or revise shares outstanding records.
+        :return: Dict mapping each ticker with new or changed records to its earliest such effective date.
+        """
+        if shares_df.empty:
+            return {}
+        new = pd.DataFrame({
+            'ticker': shares_df['ticker'].astype(str),
+            'effective_date': pd.to_datetime(shares_df['effective_date']).dt.strftime('%Y-%m-%d'),
+            'shares': shares_df['shares'].astype(float),
+        }).drop_duplicates(['ticker', 'effective_date'], keep='last')
+        existing = self.query_shares_outstanding()
+        compared = new.merge(existing, on=['ticker', 'effective_date'], how='left', suffixes=('', '_old'))
+        changed = compared[compared['shares'] != compared['shares_old']]
+        if changed.empty:
+            return {}
+        combined = pd.concat([existing, changed[['ticker', 'effective_date', 'shares']]], ignore_index=True)
+        self._write_file(combined.drop_duplicates(['ticker', 'effective_date'], keep='last'),
+                         self._path("shares_outstanding.parquet"))
+        return changed.groupby('ticker')['effective_date'].min().to_dict()
+
+    def query_quality_dirty_dates(self):
+        """
+        Return the dates whose rows changed since their last data-quality check, as sorted strings.
+        """
+        return sorted(self._load_dirty_dates("quality_dirty_dates.json"))
+
+    def replace_quality_issues(self, start_date, end_date, issues_df):
+        """
+        Replace the stored data-quality issues between start_date and end_date (inclusive) and
+        mark those dates as checked.
+        """
+        existing = self._read_file("quality_issues.parquet")
+        issues = issues_df[['date', 'ticker', 'check', 'value']].astype({'ticker': object, 'value': float})
+        if existing is not None:
+            kept = existing[(existing['date'] < start_date) | (existing['date'] > end_date)]
+            issues = pd.concat([kept, issues], ignore_index=True) if len(issues) else kept
+        self._write_file(issues.sort_values(['date', 'check', 'ticker'], kind='stable', na_position='first'),
+                         self._path("quality_issues.parquet"))
+        dirty = self._load_dirty_dates("quality_dirty_dates.json")
+        self._save_dirty_dates({date for date in dirty if not start_date <= date <= end_date},
+                               "quality_dirty_dates.json")
+
+    def query_quality_issues(self, start_date=None, end_date=None, checks=None):
+        """
+        Read the persisted data-quality issues, optionally between start_date and end_date
+        (inclusive) and for the given checks only.
+        """
+        df = self._read_file("quality_issues.parquet")
+        if df is None:
+            return pd.DataFrame({'date': pd.Series(dtype=object), 'ticker': pd.Series(dtype=object),
+                                 'check': pd.Series(dtype=object), 'value': pd.Series(dtype=float)})
+        if start_date is not None:
+            df = df[df['date'] >= start_date]
+        if end_date is not None:
+            df = df[df['date'] <= end_date]
+        if checks is not None:
+            df = df[df['check'].isin(list(checks))]
+        return df.reset_index(drop=True)
+
+    def iter_index_composition(self, start_date, end_date, chunksize=50_000):
+        """
+        Stream the materialized index composition between start_date and end_date (inclusive)
+        in chunks of about chunksize rows, joining prices one group of date partitions at a time.
+        :return: Iterator of DataFrames with columns date, rank, ticker, closing_price and market_cap.
+        """
+        start = pd.to_datetime(start_date).strftime('%Y-%m-%d')
+        end = pd.to_datetime(end_date).strftime('%Y-%m-%d')
+        path = self._path("index_constituents.parquet")
+        if not os.path.exists(path):
+            return
+        constituents = pq.read_table(path, filters=[('date', '>=', start), ('date', '<=', end)],
+                                     memory_map=True).to_pandas()
+        constituents = constituents.sort_values(['date', 'rank'], kind='stable')
+        dates = constituents['date'].unique()
+        per_date = max(len(constituents) // max(len(dates), 1), 1)
+        step = max(chunksize // per_date, 1)
+        for i in range(0, len(dates), step):
+            group = dates[i:i + step]
+            prices = self._read_partitions(group, self.DAILY_SCHEMA_COLUMNS)
+            chunk = constituents[constituents['date'].isin(group)].merge(
+                prices[['date', 'ticker', 'closing_price', 'market_cap']], on=['date', 'ticker'], how='inner')
+            yield chunk[['date', 'rank', 'ticker', 'closing_price', 'market_cap']].reset_index(drop=True)
+
+    def close(self):
+        """
+        Nothing to release; files are opened per read.
+        """
+
+
+def migrate_sqlite_to_parquet(db_path, root_dir, chunksize=500_000):
+    """
+    Convert the daily_data, stocks, ingestion and shares coverage and shares outstanding tables of
+    an SQLite database into the Parquet layout.
+    Rows are streamed in date order so memory stays bounded by chunksize.
+    :return: Number of daily rows migrated.
+    """
+    import sqlite3
+
+    storage = ParquetStorageManager(root_dir=root_dir)
+    conn = sqlite3.connect(db_path)
+    try:
+        stocks_df = pd.read_sql_query("SELECT ticker, name FROM stocks", conn)
+        if not stocks_df.empty:
+            storage._register_stocks(stocks_df, replace=True)
+        chunks = pd.read_sql_query(
+            "SELECT DATE(date) AS date, ticker, closing_price, market_cap FROM daily_data ORDER BY date",
+            conn, chunksize=chunksize)
+        stats = storage.insert_daily_data_bulk(chunks, batch_size=chunksize)
+        for table in ('ingestion_coverage', 'shares_coverage'):
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone():
+                continue
+            coverage = pd.read_sql_query(
+                f"SELECT s.ticker, c.start_date_id, c.end_date_id FROM {table} c "
+                "JOIN stocks s ON s.ticker_id = c.ticker_id", conn)
+            for column in ('start_date', 'end_date'):
+                date_ids = coverage.pop(f"{column}_id")
+                coverage[column] = pd.to_datetime(date_ids.astype(str), format='%Y%m%d').dt.strftime('%Y-%m-%d')
+            storage._write_file(coverage, storage._path(f"{table}.parquet"))
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'shares_outstanding'").fetchone():
+            shares = pd.read_sql_query(
+                "SELECT s.ticker, o.effective_date_id, o.shares FROM shares_outstanding o "
+                "JOIN stocks s ON s.ticker_id = o.ticker_id", conn)
+            date_ids = shares.pop('effective_date_id')
+            shares.insert(1, 'effective_date',
+                          pd.to_datetime(date_ids.astype(str), format='%Y%m%d').dt.strftime('%Y-%m-%d'))
+            storage._write_file(shares, storage._path("shares_outstanding.parquet"))
+    finally:
+        conn.close()
+    storage.refresh_index_tables()
+    logger.info(f"Migrated {stats['rows']} rows from {db_path} to {root_dir}.")
+    return stats['rows']
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Convert an SQLite database into the Parquet storage layout.")
+    parser.add_argument("--db_path", default="data.db", help="Source SQLite database. Default is data.db.")
+    parser.add_argument("--root_dir", default="data_parquet", help="Target directory. Default is data_parquet.")
+    args = parser.parse_args()
+    migrate_sqlite_to_parquet(args.db_path, args.root_dir)
@@ -0,0 +1,63 @@
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def iter_in_background(iterable, maxsize=4, name="producer"):
+    """
+    Consume iterable on a background thread and yield its items through a bounded queue.
+    The producer runs ahead of the consumer by at most maxsize items, so both sides overlap
+    while memory stays bounded. An exception raised by the producer is re-raised in the
+    consumer; if the consumer stops early, the producer stops before its next item.
+    :param maxsize: Maximum number of produced items waiting for the consumer.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        # Block while the queue is full, but give up once the consumer has gone.
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            else:
+                put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()
+        thread.join()
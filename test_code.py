@@ -1,9 +1,20 @@
 import unittest
-from database_manager import DatabaseManager
-from custom_index_calculator import CustomIndexCalculator
-from exports import export_to_excel, export_to_pdf
+import logging
+import json
+from database_manager import DatabaseManager, MIGRATIONS
+from custom_index_calculator import CustomIndexCalculator, calculate_index_for_date_range
+from exports import export_to_csv, export_to_excel, export_to_parquet, export_to_pdf
+import exports
+import re
+import zlib
+from unittest import mock
 from data_ingestion import run_data_ingestion
+from data_fetcher import DataFetcher, FakeDataProvider
+from index_rebalance import compute_rebalance_events
+from index_engine import IndexEngine, CappedMarketCapWeight, build_market_matrices
+import numpy as np
 import os
+import tempfile
 import datetime
 import pandas as pd
 
@@ -67,12 +78,16 @@ class TestCustomIndex(unittest.TestCase):
         os.remove(filename)
 
     def test_run_data_ingestion(self):
-        # Test that run_data_ingestion inserts data into the database
-        run_data_ingestion()
-        # Check if data was inserted into the database
-        cursor = self.db_manager.conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM daily_data")
-        count = cursor.fetchone()[0]
+        # Test that run_data_ingestion inserts data into the database, using the offline provider
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "data.db")
+            run_data_ingestion(backfill_days=30, provider=FakeDataProvider(), db_path=db_path)
+            # Check if data was inserted into the database
+            db_manager = DatabaseManager(db_path=db_path)
+            cursor = db_manager.conn.cursor()
+            cursor.execute("SELECT COUNT(*) FROM daily_data")
+            count = cursor.fetchone()[0]
+            db_manager.conn.close()
         self.assertGreater(count, 0, "No data was ingested into the database.")
 
     def test_empty_data_handling(self):
@@ -92,6 +107,1632 @@ class TestCustomIndex(unittest.TestCase):
         self.assertTrue("TEST4" not in df['ticker'].values, "Unexpected ticker found in results.")
 
 
+class TestDataFetcher(unittest.TestCase):
+    def test_fetch_in_chunks(self):
+        # Tickers are downloaded in chunks and duplicates are only fetched once.
+        provider = FakeDataProvider()
+        fetcher = DataFetcher(tickers=["AAA", "BBB", "CCC", "AAA", "DDD"], provider=provider,
+                              chunk_size=2, requests_per_second=100)
+        data = fetcher.fetch_data("2023-01-02", "2023-01-07")
+        self.assertEqual(sorted(data), ["AAA", "BBB", "CCC", "DDD"])
+        self.assertEqual(provider.calls, 2)
+        df = data["AAA"]
+        self.assertEqual(len(df), 5)
+        self.assertTrue({'Date', 'closing_price', 'market_cap', 'ticker'}.issubset(df.columns))
+
+    def test_retry_only_failed_tickers(self):
+        # A request that raises is retried once the backoff has passed.
+        provider = FakeDataProvider(fail_once=["BBB"])
+        fetcher = DataFetcher(tickers=["AAA", "BBB", "CCC"], provider=provider, chunk_size=3,
+                              requests_per_second=100, retry_backoff=0)
+        data = fetcher.fetch_data("2023-01-02", "2023-01-07")
+        self.assertEqual(sorted(data), ["AAA", "BBB", "CCC"])
+        self.assertEqual(provider.calls, 2)
+
+    def test_empty_tickers_are_not_retried(self):
+        # Tickers answered without rows, here for a weekend, are reported empty and not retried.
+        provider = RecordingProvider(missing=["BBB"])
+        fetcher = DataFetcher(tickers=["AAA", "BBB"], provider=provider, chunk_size=2,
+                              requests_per_second=100, retry_backoff=10)
+        self.assertEqual(sorted(fetcher.fetch_data("2023-01-02", "2023-01-07")), ["AAA"])
+        self.assertEqual(fetcher.fetch_data("2023-01-07", "2023-01-09"), {})
+        self.assertEqual(len(provider.requests), 2)
+        counters = fetcher.metrics.summary()['counters']
+        self.assertEqual(counters['fetch_tickers_total{status="empty"}'], 3)
+        self.assertNotIn('fetch_retried_tickers_total', counters)
+
+    def test_silently_failed_tickers_are_retried(self):
+        # A ticker the provider answers as failed without raising is retried on its own.
+        provider = FakeDataProvider(drop_once=["BBB"])
+        fetcher = DataFetcher(tickers=["AAA", "BBB", "CCC"], provider=provider, chunk_size=3,
+                              requests_per_second=100, retry_backoff=0)
+        self.assertEqual(sorted(fetcher.fetch_data("2023-01-02", "2023-01-07")), ["AAA", "BBB", "CCC"])
+        self.assertEqual(provider.calls, 2)
+        counters = fetcher.metrics.summary()['counters']
+        self.assertEqual(counters['fetch_retried_tickers_total'], 1)
+        self.assertEqual(counters['fetch_ticker_errors_total'], 1)
+
+        # Without retries it is reported as failed, not as answered.
+        provider = FakeDataProvider(drop_once=["BBB"])
+        fetcher = DataFetcher(tickers=["AAA", "BBB"], provider=provider, chunk_size=2,
+                              requests_per_second=100, max_retries=0)
+        [(data, answered)] = fetcher.iter_fetch_chunks("2023-01-02", "2023-01-07")
+        self.assertEqual((sorted(data), answered), (["AAA"], ["AAA"]))
+        counters = fetcher.metrics.summary()['counters']
+        self.assertEqual(counters['fetch_tickers_total{status="failed"}'], 1)
+        self.assertEqual(counters['fetch_tickers_total{status="empty"}'], 0)
+
+    def test_yfinance_tickers_without_rows_are_checked_one_by_one(self):
+        # yf.download drops failed and delisted tickers alike; the single-ticker request tells them apart.
+        from data_fetcher import YFinanceProvider
+        from yfinance.exceptions import YFPricesMissingError
+        dates = pd.bdate_range("2023-01-02", periods=3)
+        raw = pd.concat({"AAA": pd.DataFrame({'Close': [1.0, 2.0, 3.0]}, index=dates),
+                         "BBB": pd.DataFrame({'Close': [np.nan] * 3}, index=dates)}, axis=1)
+
+        class Ticker:
+            def __init__(self, ticker):
+                self.ticker = ticker
+
+            def history(self, **kwargs):
+                if self.ticker == "DEL":
+                    raise YFPricesMissingError(self.ticker, "")
+                if self.ticker == "BBB":
+                    raise ConnectionError("timed out")
+                return pd.DataFrame({'Close': [5.0]}, index=pd.DatetimeIndex(dates[:1], name='Date'))
+
+        with mock.patch("yfinance.download", return_value=raw), mock.patch("yfinance.Ticker", Ticker):
+            data = YFinanceProvider().download(["AAA", "BBB", "CCC", "DEL"], "2023-01-02", "2023-01-05")
+        self.assertEqual(sorted(data), ["AAA", "BBB", "CCC"])
+        self.assertIsNone(data["BBB"])
+        self.assertEqual(list(data["AAA"]['Close']), [1.0, 2.0, 3.0])
+        self.assertEqual(list(data["CCC"]['Close']), [5.0])
+
+    def test_shares_failure_drops_only_its_ticker(self):
+        # A failed request is retried per ticker, each with its own rate-limit token.
+        class FlakySharesProvider(FakeDataProvider):
+            def shares_outstanding(self, tickers, start_date, end_date):
+                if "BAD" in tickers:
+                    raise ConnectionError("no shares")
+                return super().shares_outstanding(tickers, start_date, end_date)
+
+        fetcher = DataFetcher(tickers=["AAA", "BAD", "CCC"], provider=FlakySharesProvider(), requests_per_second=100)
+        shares, fetched = fetcher.fetch_shares_outstanding("2024-01-01", "2024-02-01")
+        self.assertEqual(fetched, ["AAA", "CCC"])
+        self.assertEqual(sorted(shares['ticker'].unique()), ["AAA", "CCC"])
+        counters = fetcher.metrics.summary()['counters']
+        self.assertEqual(counters['fetch_shares_requests_total{status="error"}'], 2)
+        self.assertEqual(counters['fetch_shares_requests_total{status="ok"}'], 2)
+
+    def test_fake_provider_is_deterministic(self):
+        # Overlapping ranges return the same price for the same ticker and day.
+        provider = FakeDataProvider()
+        first = provider.download(["AAA"], "2023-01-02", "2023-01-10")["AAA"]
+        second = provider.download(["AAA"], "2023-01-05", "2023-01-10")["AAA"]
+        merged = first.merge(second, on='Date')
+        self.assertEqual(len(merged), 3)
+        self.assertTrue((merged['Close_x'] == merged['Close_y']).all())
+
+
+class TestBulkInsert(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager()
+
+    def tearDown(self):
+        self.db_manager.conn.close()
+
+    def test_bulk_insert_dataframe(self):
+        # A whole DataFrame is written across several batches and registers its tickers.
+        df = pd.DataFrame({
+            'date': pd.to_datetime(["2023-01-02", "2023-01-02", "2023-01-03"]),
+            'ticker': ["TEST1", "TEST2", "TEST1"],
+            'closing_price': [10.0, 20.0, 11.0],
+            'market_cap': [1_000, 2_000, 1_100],
+        })
+        stats = self.db_manager.insert_daily_data_bulk(df, batch_size=2)
+        self.assertEqual(stats['rows'], 3)
+        top_df = self.db_manager.query_top_stocks("2023-01-02")
+        self.assertEqual(list(top_df['ticker']), ["TEST2", "TEST1"])
+        stocks = self.db_manager.conn.execute("SELECT COUNT(*) FROM stocks").fetchone()[0]
+        self.assertEqual(stocks, 2)
+
+    def test_bulk_insert_batches_replace_rows(self):
+        # An iterator of batches is accepted and later rows replace earlier ones.
+        batches = iter([
+            pd.DataFrame({'date': ["2023-01-02"], 'ticker': ["TEST1"], 'closing_price': [10.0], 'market_cap': [1.0]}),
+            pd.DataFrame({'date': ["2023-01-02"], 'ticker': ["TEST1"], 'closing_price': [12.0], 'market_cap': [1.2]}),
+        ])
+        self.db_manager.insert_daily_data_bulk(batches)
+        top_df = self.db_manager.query_top_stocks("2023-01-02")
+        self.assertEqual(len(top_df), 1)
+        self.assertAlmostEqual(top_df['closing_price'].iloc[0], 12.0)
+
+
+class TestIndexHistory(unittest.TestCase):
+    def setUp(self):
+        # Synthetic market with more tickers than the index holds so membership changes daily
+        from benchmark import generate_synthetic_market, load_synthetic_market
+        self.db_manager = DatabaseManager()
+        self.market_df = generate_synthetic_market(n_tickers=150, n_days=15, start_date="2023-01-02")
+        load_synthetic_market(self.db_manager, self.market_df)
+
+    def tearDown(self):
+        self.db_manager.conn.close()
+
+    def test_range_matches_per_day(self):
+        # The single-pass history must give the same values as the per-day calculation.
+        calc = CustomIndexCalculator(self.db_manager)
+        history_df = calculate_index_for_date_range(self.db_manager, "2023-01-02", "2023-01-20")
+        self.assertEqual(len(history_df), 15)
+        for row in history_df.itertuples(index=False):
+            self.assertAlmostEqual(row.index_value, calc.calculate_index_value(row.date), places=9)
+
+    def test_range_marks_missing_days(self):
+        # Business days without data keep a row with a missing index value.
+        history_df = calculate_index_for_date_range(self.db_manager, "2022-12-29", "2023-01-03")
+        self.assertEqual(list(history_df['date']), ["2022-12-29", "2022-12-30", "2023-01-02", "2023-01-03"])
+        self.assertTrue(history_df['index_value'].iloc[:2].isna().all())
+        self.assertFalse(history_df['index_value'].iloc[2:].isna().any())
+
+
+class TestMaterializedIndex(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager()
+        self.df = pd.DataFrame({
+            'date': ["2023-01-02", "2023-01-02", "2023-01-03", "2023-01-03"],
+            'ticker': ["TEST1", "TEST2", "TEST1", "TEST2"],
+            'closing_price': [10.0, 20.0, 11.0, 21.0],
+            'market_cap': [1_000, 2_000, 1_100, 2_100],
+        })
+        self.db_manager.insert_daily_data_bulk(self.df)
+
+    def tearDown(self):
+        self.db_manager.conn.close()
+
+    def test_refresh_materializes_index(self):
+        # The first refresh computes every date and stores values and constituents.
+        self.assertEqual(self.db_manager.refresh_index_tables(limit=1), 2)
+        values_df = self.db_manager.query_index_values("2023-01-01", "2023-01-31")
+        self.assertEqual(list(values_df['index_value']), [20.0, 21.0])
+        self.assertEqual(list(values_df['constituent_count']), [1, 1])
+        constituents_df = self.db_manager.query_index_constituents("2023-01-03")
+        self.assertEqual(list(constituents_df['ticker']), ["TEST2"])
+
+    def test_data_version_changes_on_commit(self):
+        # The version stamp moves when data changes and stays put for identical rewrites.
+        version = self.db_manager.get_data_version()
+        self.db_manager.insert_daily_data_bulk(self.df)
+        self.assertEqual(self.db_manager.get_data_version(), version)
+        self.db_manager.insert_daily_data("2023-01-03", "TEST1", 12.0, 1_100)
+        self.assertGreater(self.db_manager.get_data_version(), version)
+
+    def test_refresh_only_changed_dates(self):
+        # Rewriting identical rows marks nothing dirty; a changed row marks only its date.
+        self.db_manager.refresh_index_tables()
+        self.db_manager.insert_daily_data_bulk(self.df)
+        self.assertEqual(self.db_manager.refresh_index_tables(), 0)
+        self.db_manager.insert_daily_data("2023-01-03", "TEST1", 31.0, 1_100)
+        self.assertEqual(self.db_manager.refresh_index_tables(), 1)
+        values_df = self.db_manager.query_index_values("2023-01-03", "2023-01-03")
+        self.assertAlmostEqual(values_df['index_value'].iloc[0], 26.0)
+
+
+class TestSchemaMigrations(unittest.TestCase):
+    def test_upgrade_original_schema(self):
+        # A database created with the original text-keyed schema is upgraded in place.
+        import sqlite3
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "legacy.db")
+            conn = sqlite3.connect(db_path)
+            conn.executescript("""
+                CREATE TABLE stocks (ticker TEXT PRIMARY KEY, name TEXT);
+                CREATE TABLE daily_data (date DATE, ticker TEXT, closing_price REAL, market_cap REAL,
+                                         PRIMARY KEY (date, ticker));
+                INSERT INTO stocks VALUES ('TEST1', 'Test One');
+                INSERT INTO daily_data VALUES ('2023-01-02', 'TEST1', 10.0, 1000.0);
+                INSERT INTO daily_data VALUES ('2023-01-02', 'TEST2', 20.0, 2000.0);
+            """)
+            conn.commit()
+            conn.close()
+            db_manager = DatabaseManager(db_path=db_path)
+            self.assertEqual(db_manager.schema_version(), MIGRATIONS[-1][0])
+            top_df = db_manager.query_top_stocks("2023-01-02")
+            self.assertEqual(list(top_df['ticker']), ["TEST2", "TEST1"])
+            name = db_manager.conn.execute("SELECT name FROM stocks WHERE ticker = 'TEST1'").fetchone()[0]
+            self.assertEqual(name, "Test One")
+            # Dates migrated from the old table are pending materialization.
+            self.assertEqual(db_manager.refresh_index_tables(), 1)
+            db_manager.close()
+            # Reopening an up-to-date database applies nothing.
+            db_manager = DatabaseManager(db_path=db_path)
+            self.assertEqual(db_manager.migrate(), MIGRATIONS[-1][0])
+            db_manager.close()
+
+    def test_top_stocks_uses_covering_index(self):
+        # The top-N query is answered from the covering index without a sort.
+        db_manager = DatabaseManager()
+        plan = db_manager.conn.execute("""
+            EXPLAIN QUERY PLAN
+            SELECT ticker_id, closing_price FROM daily_prices WHERE date_id = 20230102
+            ORDER BY market_cap DESC LIMIT 100
+        """).fetchall()
+        details = " ".join(row[-1] for row in plan)
+        self.assertIn("COVERING INDEX idx_daily_prices_rank", details)
+        self.assertNotIn("TEMP B-TREE", details)
+        db_manager.close()
+
+
+class TestRebalanceEvents(unittest.TestCase):
+    def setUp(self):
+        # Top-2 membership: TEST3 replaces TEST1 on 01-03 and TEST1 returns on 01-05.
+        self.db_manager = DatabaseManager()
+        caps = {
+            "2023-01-02": {"TEST1": 3, "TEST2": 2, "TEST3": 1},
+            "2023-01-03": {"TEST1": 1, "TEST2": 2, "TEST3": 3},
+            "2023-01-04": {"TEST1": 1, "TEST2": 2, "TEST3": 3},
+            "2023-01-05": {"TEST1": 4, "TEST2": 2, "TEST3": 3},
+        }
+        self.df = pd.DataFrame([
+            {'date': date, 'ticker': ticker, 'closing_price': 10.0, 'market_cap': cap}
+            for date, day_caps in caps.items() for ticker, cap in day_caps.items()
+        ])
+        self.db_manager.insert_daily_data_bulk(self.df)
+        self.db_manager.refresh_index_tables(limit=2)
+
+    def tearDown(self):
+        self.db_manager.close()
+
+    def test_compute_rebalance_events(self):
+        # Entries and exits are reported on the first day of the new membership.
+        constituents = self.db_manager.query_top_stocks_range("2023-01-02", "2023-01-05", limit=2)
+        events_df, turnover_df = compute_rebalance_events(constituents)
+        self.assertEqual(list(events_df.itertuples(index=False, name=None)), [
+            ("2023-01-03", "TEST3", "entry"), ("2023-01-03", "TEST1", "exit"),
+            ("2023-01-05", "TEST1", "entry"), ("2023-01-05", "TEST2", "exit"),
+        ])
+        self.assertEqual(list(turnover_df['date']), ["2023-01-03", "2023-01-04", "2023-01-05"])
+        self.assertEqual(list(turnover_df['turnover']), [0.5, 0.0, 0.5])
+
+    def test_persisted_events_follow_incremental_refresh(self):
+        # Changing one day's membership updates its events and the following day's events.
+        events_df = self.db_manager.query_rebalance_events("2023-01-01", "2023-01-31")
+        self.assertEqual(len(events_df), 4)
+        self.db_manager.insert_daily_data("2023-01-04", "TEST1", 10.0, 5)
+        self.db_manager.refresh_index_tables(limit=2)
+        events_df = self.db_manager.query_rebalance_events("2023-01-01", "2023-01-31")
+        self.assertEqual(list(events_df.itertuples(index=False, name=None)), [
+            ("2023-01-03", "TEST3", "entry"), ("2023-01-03", "TEST1", "exit"),
+            ("2023-01-04", "TEST1", "entry"), ("2023-01-04", "TEST2", "exit"),
+        ])
+        turnover_df = self.db_manager.query_turnover("2023-01-05", "2023-01-05")
+        self.assertEqual(turnover_df['entries'].iloc[0], 0)
+
+
+try:
+    import streamlit  # noqa: F401
+    HAS_STREAMLIT = True
+except ImportError:
+    HAS_STREAMLIT = False
+
+
+@unittest.skipUnless(HAS_STREAMLIT, "streamlit is required for the dashboard test")
+class TestIndexEngine(unittest.TestCase):
+    def setUp(self):
+        # Top-2 by market cap: CHEAP replaces BIG on 01-04. A plain price mean would jump
+        # from 505 to 55; the index should only move with the members' returns.
+        rows = []
+        prices = {"BIG": [1000.0, 1010.0, 1020.0, 1030.0], "MID": [100.0, 99.0, 100.0, 101.0],
+                  "CHEAP": [10.0, 10.5, 11.0, 11.0]}
+        caps = {"BIG": [3, 3, 1, 1], "MID": [2, 2, 2, 2], "CHEAP": [1, 1, 3, 3]}
+        for i, date in enumerate(["2023-01-02", "2023-01-03", "2023-01-04", "2023-01-05"]):
+            for ticker in prices:
+                rows.append({'date': date, 'ticker': ticker, 'closing_price': prices[ticker][i],
+                             'market_cap': caps[ticker][i]})
+        self.df = pd.DataFrame(rows)
+        self.prices, self.market_caps = build_market_matrices(self.df)
+
+    def test_equal_weight_is_return_continuous(self):
+        result = IndexEngine(top_n=2, weighting='equal').compute(self.prices, self.market_caps)
+        returns = self.prices.pct_change()
+        # Each day's index return is the mean return of the members chosen the day before.
+        expected = [100.0]
+        for previous_members, date in ((["BIG", "MID"], "2023-01-03"), (["BIG", "MID"], "2023-01-04"),
+                                       (["MID", "CHEAP"], "2023-01-05")):
+            expected.append(expected[-1] * (1 + returns.loc[date, previous_members].mean()))
+        np.testing.assert_allclose(result['index_value'], expected)
+        self.assertEqual(list(result['constituent_count']), [2, 2, 2, 2])
+
+    def test_holdings_fixed_between_rebalances(self):
+        # Monthly rebalance keeps the first day's equal-value basket for the whole month.
+        result = IndexEngine(top_n=2, weighting='equal', rebalance='M').compute(self.prices, self.market_caps)
+        units = 0.5 / self.prices.iloc[0][["BIG", "MID"]]
+        expected = 100.0 * (self.prices[["BIG", "MID"]] * units).sum(axis=1)
+        np.testing.assert_allclose(result['index_value'], expected.to_numpy())
+        self.assertEqual(list(result['rebalance']), [True, False, False, False])
+        self.assertTrue((result['divisor'] == result['divisor'].iloc[0]).all())
+
+    def test_market_cap_and_capped_weights(self):
+        caps = np.array([[50.0, 30.0, 10.0, 5.0, 5.0]])
+        members = np.ones_like(caps, dtype=bool)
+        weights = CappedMarketCapWeight(weight_cap=0.3).weights(caps, members)
+        self.assertAlmostEqual(weights.sum(), 1.0)
+        self.assertLessEqual(weights.max(), 0.3 + 1e-12)
+        # The uncapped names share the excess in proportion to their market caps.
+        self.assertAlmostEqual(weights[0, 2] / weights[0, 3], 2.0)
+        # Fewer than 1 / cap members: equal weights, which still sum to 1.
+        weights = CappedMarketCapWeight(weight_cap=0.3).weights(caps[:, :3], members[:, :3])
+        np.testing.assert_allclose(weights, [[1 / 3, 1 / 3, 1 / 3]])
+        result = IndexEngine(top_n=2, weighting='market_cap').compute(self.prices, self.market_caps)
+        # 3:2 cap weights on BIG and MID for the first day's move.
+        expected = 100.0 * (0.6 * 1010.0 / 1000.0 + 0.4 * 99.0 / 100.0)
+        self.assertAlmostEqual(result['index_value'].iloc[1], expected)
+
+    def test_infeasible_cap_keeps_flat_level(self):
+        dates = pd.bdate_range("2023-01-02", periods=4).strftime('%Y-%m-%d')
+        prices = pd.DataFrame(10.0, index=dates, columns=["A", "B", "C"])
+        market_caps = prices * [3.0, 2.0, 1.0]
+        result = IndexEngine(top_n=3, weighting='capped', rebalance='D').compute(prices, market_caps)
+        np.testing.assert_allclose(result['index_value'], 100.0)
+
+    def test_calculate_weighted_index_from_database(self):
+        db_manager = DatabaseManager()
+        db_manager.insert_daily_data_bulk(self.df)
+        calc = CustomIndexCalculator(db_manager)
+        result = calc.calculate_weighted_index("2023-01-01", "2023-01-31", top_n=2)
+        expected = IndexEngine(top_n=2).compute(self.prices, self.market_caps)
+        self.assertEqual(list(result['date']), list(self.prices.index))
+        np.testing.assert_allclose(result['index_value'], expected['index_value'])
+        db_manager.close()
+
+
+class TestIndexSweep(unittest.TestCase):
+    def setUp(self):
+        from benchmark import generate_synthetic_market
+        # A few missing quotes exercise forward-filled prices and ineligible tickers.
+        market_df = generate_synthetic_market(n_tickers=150, n_days=120, start_date="2023-01-02")
+        self.market_df = market_df.sample(frac=0.98, random_state=0)
+        self.prices, self.market_caps = build_market_matrices(self.market_df)
+
+    def test_sweep_matches_engine(self):
+        from index_sweep import SweepConfig, run_sweep, summarize_sweep, sweep_configs
+        configs = sweep_configs(top_ns=(20, 50, 200), rebalances=('D', 'M', 10)) + \
+            [SweepConfig(30, 'W', CappedMarketCapWeight(weight_cap=0.05))]
+        levels = run_sweep(self.prices, self.market_caps, configs)
+        self.assertEqual(levels.shape, (120, 28))
+        self.assertEqual(levels.columns[-1], "top30_W_CappedMarketCapWeight(weight_cap=0.05)")
+        for config, column in zip(configs, levels.columns):
+            expected = IndexEngine(top_n=config.top_n, weighting=config.weighting,
+                                   rebalance=config.rebalance).compute(self.prices, self.market_caps)
+            np.testing.assert_allclose(levels[column].to_numpy(), expected['index_value'].to_numpy(), rtol=1e-12)
+        summary = summarize_sweep(levels)
+        self.assertAlmostEqual(summary.loc["top50_M_equal", 'total_return'],
+                               levels["top50_M_equal"].iloc[-1] / 100.0 - 1)
+
+        # The calculator loads the matrices from storage once for the whole sweep.
+        db_manager = DatabaseManager()
+        db_manager.insert_daily_data_bulk(self.market_df)
+        from_storage = CustomIndexCalculator(db_manager).calculate_index_sweep("2023-01-01", "2023-12-31", configs[:3])
+        pd.testing.assert_frame_equal(from_storage, levels.iloc[:, :3])
+        db_manager.close()
+
+    def test_infeasible_cap_falls_back_to_equal_weights(self):
+        from index_sweep import SweepConfig, run_sweep
+        # Five members cannot each stay under a 10% cap, so both variants hold the same basket.
+        configs = [SweepConfig(5, 'D', 'capped'), SweepConfig(5, 'D', 'equal')]
+        levels = run_sweep(self.prices, self.market_caps, configs)
+        np.testing.assert_allclose(levels.iloc[:, 0], levels.iloc[:, 1], rtol=1e-12)
+        expected = IndexEngine(top_n=5, weighting='capped').compute(self.prices, self.market_caps)
+        np.testing.assert_allclose(levels.iloc[:, 0], expected['index_value'], rtol=1e-12)
+
+    def test_process_pool_matches_serial(self):
+        from index_sweep import run_sweep, sweep_configs
+        configs = sweep_configs(top_ns=(25, 75), rebalances=('D', 'Q'))
+        serial = run_sweep(self.prices, self.market_caps, configs)
+        pooled = run_sweep(self.prices, self.market_caps, configs, processes=2)
+        pd.testing.assert_frame_equal(pooled, serial, rtol=1e-12)
+
+
+class TestStreamingExports(unittest.TestCase):
+    def setUp(self):
+        from benchmark import generate_synthetic_market
+        self.db_manager = DatabaseManager()
+        self.db_manager.insert_daily_data_bulk(generate_synthetic_market(60, 30))
+        self.db_manager.refresh_index_tables(limit=50)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.expected = self.db_manager.query_top_stocks_range("2015-01-01", "2015-12-31", limit=50)
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def _chunks(self):
+        return self.db_manager.iter_index_composition("2015-01-01", "2015-12-31", chunksize=200)
+
+    def test_chunked_read_matches_composition(self):
+        chunks = list(self._chunks())
+        self.assertGreater(len(chunks), 1)
+        composition = pd.concat(chunks, ignore_index=True)
+        pd.testing.assert_frame_equal(composition[['date', 'ticker', 'rank']],
+                                      self.expected[['date', 'ticker', 'rank']])
+
+    def test_csv_excel_and_parquet_round_trip(self):
+        path = os.path.join(self.tmp_dir.name, "composition")
+        self.assertEqual(export_to_csv(self._chunks(), path + ".csv"), len(self.expected))
+        self.assertEqual(export_to_excel(self._chunks(), path + ".xlsx"), len(self.expected))
+        readers = [pd.read_csv(path + ".csv"), pd.read_excel(path + ".xlsx")]
+        try:
+            self.assertEqual(export_to_parquet(self._chunks(), path + ".parquet"), len(self.expected))
+            readers.append(pd.read_parquet(path + ".parquet"))
+        except ImportError:
+            pass
+        for df in readers:
+            self.assertEqual(list(df.columns), ['date', 'rank', 'ticker', 'closing_price', 'market_cap'])
+            self.assertEqual(list(df['ticker']), list(self.expected['ticker']))
+
+    def test_empty_csv_export_keeps_header(self):
+        path = os.path.join(self.tmp_dir.name, "empty.csv")
+        self.assertEqual(export_to_csv(iter([]), path, columns=exports.COMPOSITION_COLUMNS), 0)
+        self.assertEqual(list(pd.read_csv(path).columns), exports.COMPOSITION_COLUMNS)
+
+    def test_failed_exports_leave_no_partial_file(self):
+        def failing_chunks():
+            yield from self._chunks()
+            raise RuntimeError("read failed")
+
+        exporters = [(export_to_csv, "csv"), (export_to_excel, "xlsx"), (export_to_pdf, "pdf")]
+        try:
+            import pyarrow  # noqa: F401
+            exporters.append((export_to_parquet, "parquet"))
+        except ImportError:
+            pass
+        for exporter, extension in exporters:
+            path = os.path.join(self.tmp_dir.name, f"composition.{extension}")
+            self.assertIsNone(exporter(failing_chunks(), path))
+            self.assertEqual(os.listdir(self.tmp_dir.name), [])
+            # A previous export at the target is kept as it was.
+            with open(path, "w") as f:
+                f.write("previous")
+            self.assertIsNone(exporter(failing_chunks(), path))
+            with open(path) as f:
+                self.assertEqual(f.read(), "previous")
+            os.remove(path)
+
+    def test_excel_rolls_over_to_new_sheets(self):
+        path = os.path.join(self.tmp_dir.name, "composition.xlsx")
+        with mock.patch.object(exports, "EXCEL_MAX_ROWS", 1000):
+            export_to_excel(self._chunks(), path)
+        sheets = pd.read_excel(path, sheet_name=None)
+        self.assertEqual(list(sheets), ["Sheet1", "Sheet1_2"])
+        self.assertEqual(sum(len(df) for df in sheets.values()), len(self.expected))
+
+    def test_pdf_is_paginated_with_repeated_header(self):
+        path = os.path.join(self.tmp_dir.name, "composition.pdf")
+        self.assertEqual(export_to_pdf(self._chunks(), path, title="Index composition"), len(self.expected))
+        with open(path, "rb") as f:
+            data = f.read()
+        # Every cross-reference entry points at the start of its object.
+        xref = data[data.rindex(b"xref"):]
+        offsets = [int(entry) for entry in re.findall(rb"^(\d{10}) 00000 n", xref, re.M)]
+        for number, offset in enumerate(offsets, start=1):
+            self.assertTrue(data.startswith(f"{number} 0 obj".encode(), offset))
+        pages = [zlib.decompress(stream) for stream in re.findall(rb"stream\n(.*?)\nendstream", data, re.S)]
+        self.assertGreater(len(pages), 1)
+        self.assertEqual(len(pages), int(re.search(rb"/Count (\d+)", data).group(1)))
+        for page in pages:
+            self.assertIn(b"(Index composition) Tj", page)
+            self.assertIn(b"date        rank", page)
+
+
+class TestBenchmarkSuite(unittest.TestCase):
+    def test_suite_reports_every_stage_as_json(self):
+        import json
+        from benchmark import run_benchmark_suite
+        results = run_benchmark_suite(n_tickers=30, n_days=20, export_days=5, dashboard_days=10)
+        results = json.loads(json.dumps(results))
+        self.assertEqual(set(results['stages']), {
+            'insert', 'refresh_index', 'index_range', 'index_engine', 'dashboard_composition',
+            'export_csv', 'export_xlsx', 'export_pdf', 'export_parquet'})
+        self.assertEqual(results['stages']['insert']['rows'], 600)
+        self.assertEqual(results['stages']['export_csv']['rows'], 5 * 30)
+        for stage in results['stages'].values():
+            self.assertGreaterEqual(stage['seconds'], 0)
+            self.assertIn('peak_mib', stage)
+
+    def test_compare_with_baseline_flags_regressions(self):
+        from benchmark import compare_with_baseline
+        config = {'tickers': 10, 'days': 10}
+        baseline = {'config': config, 'stages': {'insert': {'seconds': 1.0, 'peak_mib': 10.0},
+                                                 'export_csv': {'seconds': 0.01, 'peak_mib': 1.0}}}
+        results = {'config': config, 'stages': {'insert': {'seconds': 2.0, 'peak_mib': 10.5},
+                                                'export_csv': {'seconds': 0.03, 'peak_mib': 1.0}}}
+        # The 3x slower export stays under the absolute noise floor.
+        self.assertEqual([(r['stage'], r['metric']) for r in compare_with_baseline(results, baseline)],
+                         [('insert', 'seconds')])
+        with self.assertRaises(ValueError):
+            compare_with_baseline({'config': {'tickers': 20, 'days': 10}, 'stages': {}}, baseline)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_registry_renders_json_and_prometheus(self):
+        from metrics import MetricsRegistry
+        metrics = MetricsRegistry()
+        metrics.inc("rows_written_total", 500, table="daily_data")
+        metrics.inc("rows_written_total", 250, table="daily_data")
+        with metrics.stage("insert"):
+            pass
+        for value in (0.003, 0.2, 0.3, 7.0):
+            metrics.observe("fetch_request_seconds", value)
+        summary = metrics.summary()
+        self.assertEqual(summary['counters']['rows_written_total{table="daily_data"}'], 750)
+        self.assertIn('stage_seconds{stage="insert"}', summary['gauges'])
+        histogram = summary['histograms']['fetch_request_seconds']
+        self.assertEqual((histogram['count'], histogram['max'], histogram['p50']), (4, 7.0, 0.25))
+        text = metrics.to_prometheus()
+        self.assertIn('# TYPE hedgineer_rows_written_total counter\n'
+                      'hedgineer_rows_written_total{table="daily_data"} 750\n', text)
+        self.assertIn('hedgineer_fetch_request_seconds_bucket{le="0.25"} 2\n', text)
+        self.assertIn('hedgineer_fetch_request_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('hedgineer_fetch_request_seconds_count 4\n', text)
+
+    def test_sampled_logger_logs_one_in_n(self):
+        from metrics import SampledLogger
+        with self.assertLogs("sampled", level="INFO") as captured:
+            sampled = SampledLogger(logging.getLogger("sampled"), every=10)
+            for i in range(25):
+                sampled.log(logging.INFO, f"row {i}")
+            sampled.flush(event="rows")
+        # The first, 10th and 20th occurrences plus the summary line.
+        self.assertEqual(len(captured.records), 4)
+        self.assertIn("25 rows in total", captured.records[-1].getMessage())
+
+    def test_ingestion_writes_run_summary(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            summary = run_data_ingestion(backfill_days=30, provider=FakeDataProvider(),
+                                         db_path=os.path.join(tmp_dir, "metrics.db"),
+                                         metrics_dir=os.path.join(tmp_dir, "metrics"))
+            for stage in ("fetch", "transform", "insert", "index"):
+                self.assertIn(f'stage_seconds{{stage="{stage}"}}', summary['gauges'])
+            rows = summary['counters']['rows_written_total{table="daily_data"}']
+            self.assertGreater(rows, 0)
+            self.assertEqual(summary['counters']['rows_fetched_total'], rows)
+            self.assertGreater(summary['histograms']['fetch_ticker_seconds']['count'], 0)
+            with open(os.path.join(tmp_dir, "metrics", "ingestion_metrics.prom")) as f:
+                self.assertIn(f'hedgineer_rows_written_total{{table="daily_data"}} {rows}', f.read())
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "metrics", "ingestion_metrics.json")))
+
+
+class RecordingProvider(FakeDataProvider):
+    """
+    FakeDataProvider that records every requested (tickers, start, end) and never returns `missing`.
+    """
+    def __init__(self, missing=()):
+        super().__init__()
+        self.missing = set(missing)
+        self.requests = []
+        self.shares_requests = []
+
+    def shares_outstanding(self, tickers, start_date, end_date):
+        self.shares_requests.append((tuple(tickers), start_date, end_date))
+        return super().shares_outstanding(tickers, start_date, end_date)
+
+    def download(self, tickers, start_date, end_date):
+        self.requests.append((tuple(tickers), start_date, end_date))
+        data = super().download(tickers, start_date, end_date)
+        return {ticker: df for ticker, df in data.items() if ticker not in self.missing}
+
+
+class TestIncrementalIngestion(unittest.TestCase):
+    def test_merge_and_missing_ranges(self):
+        from ingestion_state import merge_ranges, missing_ranges, plan_fetch_windows
+        d = datetime.date
+        self.assertEqual(merge_ranges([("2024-01-05", "2024-01-10"), ("2024-01-01", "2024-01-04"),
+                                       ("2024-01-20", "2024-01-25")]),
+                         [(d(2024, 1, 1), d(2024, 1, 10)), (d(2024, 1, 20), d(2024, 1, 25))])
+        self.assertEqual(missing_ranges([("2024-01-05", "2024-01-10")], "2024-01-01", "2024-01-31"),
+                         [(d(2024, 1, 1), d(2024, 1, 4)), (d(2024, 1, 11), d(2024, 1, 31))])
+        coverage = pd.DataFrame({'ticker': ["A", "A", "B"], 'start_date': ["2024-01-01", "2024-01-12", "2024-01-01"],
+                                 'end_date': ["2024-01-09", "2024-01-30", "2024-01-31"]})
+        # A's two-day hole and C's full range; B is complete.
+        windows = plan_fetch_windows(coverage, ["A", "B", "C"], "2024-01-01", "2024-01-31")
+        self.assertEqual(windows, {(d(2024, 1, 1), d(2024, 1, 31)): ["C"],
+                                   (d(2024, 1, 10), d(2024, 1, 11)): ["A"],
+                                   (d(2024, 1, 31), d(2024, 1, 31)): ["A"]})
+
+    def test_coverage_is_seeded_and_merged(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_manager = DatabaseManager(db_path=os.path.join(tmp_dir, "coverage.db"))
+            db_manager.record_ingestion_coverage(["AAA"], "2024-01-01", "2024-01-10")
+            db_manager.record_ingestion_coverage(["AAA", "BBB"], "2024-01-11", "2024-01-20")
+            coverage = db_manager.query_ingestion_coverage()
+            self.assertEqual(coverage.values.tolist(), [["AAA", "2024-01-01", "2024-01-20"],
+                                                        ["BBB", "2024-01-11", "2024-01-20"]])
+            # Migrated databases derive coverage from the stored rows.
+            db_manager.insert_daily_data("2024-02-01", "CCC", 1.0, 10.0)
+            db_manager.insert_daily_data("2024-02-05", "CCC", 1.0, 10.0)
+            db_manager.conn.execute("DELETE FROM ingestion_coverage")
+            db_manager.conn.execute("DELETE FROM schema_migrations WHERE version >= 5")
+            db_manager.conn.execute("DROP TABLE ingestion_coverage")
+            db_manager.conn.execute("DROP TABLE shares_outstanding")
+            db_manager.conn.execute("DROP TABLE quality_issues")
+            db_manager.conn.execute("DROP TABLE quality_dirty_dates")
+            db_manager.conn.execute("DROP TABLE index_analytics")
+            db_manager.conn.execute("DROP TABLE intraday_index_values")
+            db_manager.conn.execute("DROP TABLE shares_coverage")
+            db_manager.conn.commit()
+            db_manager.migrate()
+            self.assertEqual(db_manager.query_ingestion_coverage(["CCC"]).values.tolist(),
+                             [["CCC", "2024-02-01", "2024-02-05"]])
+            db_manager.close()
+
+    def test_rerun_fetches_only_missing_ranges(self):
+        from constants import top_200_us_stock_tickers
+        failed_chunk = list(dict.fromkeys(top_200_us_stock_tickers))[50:100]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "incremental.db")
+            # AAPL is answered without rows, MSFT fails silently inside an answered request and
+            # the second chunk's request fails outright.
+            provider = RecordingProvider(missing=["AAPL"])
+            provider.fail_once = {failed_chunk[0]}
+            provider.drop_once = {"MSFT"}
+            first = run_data_ingestion(backfill_days=30, provider=provider, db_path=db_path,
+                                       fetcher_options={'max_retries': 0})
+            self.assertEqual(first['counters']['fetch_windows_total'], 1)
+
+            # Only MSFT and the failed chunk are requested again, over the whole window; AAPL is covered.
+            provider = RecordingProvider()
+            second = run_data_ingestion(backfill_days=30, provider=provider, db_path=db_path)
+            self.assertEqual({ticker for tickers, _, _ in provider.requests for ticker in tickers},
+                             set(failed_chunk) | {"MSFT"})
+            self.assertEqual(second['counters']['rows_fetched_total'],
+                             (len(failed_chunk) + 1) * len(pd.bdate_range(datetime.date.today() - datetime.timedelta(days=30),
+                                                                     datetime.date.today() - datetime.timedelta(days=1))))
+
+            # A longer backfill fetches only the older days, for every ticker, in one window.
+            provider = RecordingProvider()
+            run_data_ingestion(backfill_days=40, provider=provider, db_path=db_path)
+            windows = {(start, end) for _, start, end in provider.requests}
+            self.assertEqual(windows, {(str(datetime.date.today() - datetime.timedelta(days=40)),
+                                        str(datetime.date.today() - datetime.timedelta(days=30)))})
+
+            # Nothing is missing any more.
+            provider = RecordingProvider()
+            last = run_data_ingestion(backfill_days=40, provider=provider, db_path=db_path)
+            self.assertEqual((provider.requests, last['counters']['fetch_windows_total']), ([], 0))
+
+
+    def test_shares_are_requested_only_when_stale(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "shares.db")
+            provider = RecordingProvider()
+            run_data_ingestion(backfill_days=30, provider=provider, db_path=db_path, universe=["AAA", "BBB"])
+            self.assertEqual(len(provider.shares_requests), 1)
+            # A longer backfill requests only the older shares; a rerun requests none.
+            provider = RecordingProvider()
+            run_data_ingestion(backfill_days=40, provider=provider, db_path=db_path, universe=["AAA", "BBB"])
+            today = datetime.date.today()
+            self.assertEqual([(start, end) for _, start, end in provider.shares_requests],
+                             [(str(today - datetime.timedelta(days=40 + 366)), str(today - datetime.timedelta(days=30 + 366)))])
+            provider = RecordingProvider()
+            summary = run_data_ingestion(backfill_days=40, provider=provider, db_path=db_path,
+                                         universe=["AAA", "BBB", "CCC"])
+            self.assertEqual([tickers for tickers, _, _ in provider.shares_requests], [("CCC",)])
+            self.assertEqual(summary['counters']['shares_fresh_tickers_total'], 0)
+            db_manager = DatabaseManager(db_path=db_path)
+            self.assertEqual(len(db_manager.query_shares_coverage(["AAA", "BBB", "CCC"])), 3)
+            db_manager.close()
+
+    def test_plan_shares_windows(self):
+        from ingestion_state import plan_shares_windows
+        d = datetime.date
+        covered = {"A": [(d(2023, 1, 1), d(2024, 1, 31))], "B": [(d(2023, 1, 1), d(2024, 2, 20))]}
+        # A's shares are stale and requested from the day after its fetched range; B's are fresh;
+        # C has none and needs the full lookback.
+        windows = plan_shares_windows(covered, ["A", "B", "C"], "2024-02-01", "2024-03-01",
+                                      lookback_days=31, refresh_days=14)
+        self.assertEqual(windows, {(d(2024, 1, 1), d(2024, 3, 1)): ["C"], (d(2024, 2, 1), d(2024, 3, 1)): ["A"]})
+
+
+class TestDownloadCache(unittest.TestCase):
+    def test_cached_ranges_are_not_downloaded_again(self):
+        from download_cache import CachingProvider
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            inner = RecordingProvider()
+            cache = CachingProvider(inner, tmp_dir)
+            first = cache.download(["AAA", "BBB"], "2024-01-01", "2024-02-01")
+            second = cache.download(["AAA"], "2024-01-10", "2024-01-20")
+            pd.testing.assert_frame_equal(
+                second["AAA"], first["AAA"][first["AAA"]['Date'].between("2024-01-10", "2024-01-19")]
+                .reset_index(drop=True))
+            self.assertEqual(len(inner.requests), 1)
+            # Extending the range fetches only the new days and keeps one file per ticker.
+            cache.download(["AAA"], "2024-01-01", "2024-02-15")
+            self.assertEqual(inner.requests[-1], (("AAA",), "2024-02-01", "2024-02-15"))
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, "AAA"))), 1)
+            # A range answered without rows is cached as empty and not requested again.
+            self.assertEqual(cache.download(["AAA"], "2024-02-17", "2024-02-19"), {})
+            self.assertEqual(cache.download(["AAA"], "2024-02-17", "2024-02-19"), {})
+            self.assertEqual(inner.requests[-1], (("AAA",), "2024-02-17", "2024-02-19"))
+            self.assertEqual(len(inner.requests), 3)
+
+    def test_recent_days_expire_after_ttl(self):
+        from download_cache import CachingProvider
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            now = [pd.Timestamp("2024-03-01 18:00").timestamp()]
+            inner = RecordingProvider()
+            cache = CachingProvider(inner, tmp_dir, ttl=3600, settle_days=5, clock=lambda: now[0])
+            cache.download(["AAA"], "2024-01-01", "2024-03-01")
+            now[0] += 7200
+            data = cache.download(["AAA"], "2024-01-01", "2024-03-01")
+            # Days from 5 days before the first fetch onwards were refetched; older days are final.
+            self.assertEqual(inner.requests[-1], (("AAA",), "2024-02-25", "2024-03-01"))
+            self.assertEqual(data["AAA"]['Date'].max(), pd.Timestamp("2024-02-29"))
+            # A failed refetch raises so the caller can retry it, and nothing is cached.
+            inner.fail_once = {"AAA"}
+            now[0] += 7200
+            with self.assertRaises(ConnectionError):
+                cache.download(["AAA"], "2024-01-01", "2024-03-01")
+            self.assertEqual(len(os.listdir(os.path.join(tmp_dir, "AAA"))), 1)
+            # So is a ticker the provider answered as failed; it is requested again next time.
+            inner.drop_once = {"BBB"}
+            self.assertEqual(cache.download(["AAA", "BBB"], "2024-02-01", "2024-02-10")["BBB"], None)
+            self.assertFalse(os.path.exists(os.path.join(tmp_dir, "BBB")))
+            data = cache.download(["BBB"], "2024-02-01", "2024-02-10")
+            self.assertEqual(inner.requests[-1], (("BBB",), "2024-02-01", "2024-02-10"))
+            self.assertEqual(len(data["BBB"]), 7)
+
+    def test_shares_are_cached_with_expiry(self):
+        from download_cache import CachingProvider
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            now = [pd.Timestamp("2024-03-01 18:00").timestamp()]
+            inner = RecordingProvider()
+            cache = CachingProvider(inner, tmp_dir, ttl=3600, settle_days=5, clock=lambda: now[0])
+            first = cache.shares_outstanding(["AAA", "BBB"], "2023-01-01", "2024-03-01")
+            self.assertTrue(cache.shares_cached(["AAA", "BBB"], "2023-06-01", "2024-03-01"))
+            pd.testing.assert_frame_equal(cache.shares_outstanding(["AAA", "BBB"], "2023-01-01", "2024-03-01"), first)
+            self.assertEqual(len(inner.shares_requests), 1)
+            # Recent days expire after the ttl and only they are requested again.
+            now[0] += 7200
+            self.assertFalse(cache.shares_cached(["AAA"], "2023-01-01", "2024-03-01"))
+            pd.testing.assert_frame_equal(cache.shares_outstanding(["AAA", "BBB"], "2023-01-01", "2024-03-01"), first)
+            self.assertEqual(inner.shares_requests[-1], (("AAA", "BBB"), "2024-02-25", "2024-03-01"))
+            self.assertEqual(sorted(os.listdir(os.path.join(tmp_dir, "AAA"))),
+                             [f"shares_20230101_20240229_{int(now[0])}.parquet"])
+
+    def test_reingest_and_replay_from_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_dir = os.path.join(tmp_dir, "cache")
+            run_data_ingestion(backfill_days=30, provider=RecordingProvider(), cache_dir=cache_dir,
+                               db_path=os.path.join(tmp_dir, "first.db"))
+            # A fresh database is filled from the cache without any download.
+            provider = RecordingProvider()
+            run_data_ingestion(backfill_days=30, provider=provider, cache_dir=cache_dir,
+                               db_path=os.path.join(tmp_dir, "second.db"))
+            self.assertEqual((provider.requests, provider.shares_requests), ([], []))
+            run_data_ingestion(replay_cache=True, cache_dir=cache_dir, db_path=os.path.join(tmp_dir, "replay.db"))
+            frames = []
+            for name in ("first.db", "second.db", "replay.db"):
+                db_manager = DatabaseManager(db_path=os.path.join(tmp_dir, name))
+                frames.append(db_manager.query_daily_data_range("2000-01-01", "2100-01-01"))
+                coverage = db_manager.query_ingestion_coverage(["AAPL"])
+                db_manager.close()
+                self.assertEqual(len(coverage), 1)
+            self.assertGreater(len(frames[0]), 0)
+            pd.testing.assert_frame_equal(frames[0], frames[1])
+            pd.testing.assert_frame_equal(frames[0], frames[2])
+
+
+class TestSharesOutstanding(unittest.TestCase):
+    def setUp(self):
+        self.db_manager = DatabaseManager()
+        dates = pd.bdate_range("2024-01-01", "2024-03-29").strftime('%Y-%m-%d')
+        self.daily_df = pd.DataFrame([
+            {'date': date, 'ticker': ticker, 'closing_price': price, 'market_cap': price * 1_000_000}
+            for date in dates for ticker, price in (("CHEAP", 10.0), ("PRICEY", 500.0))
+        ])
+        self.db_manager.insert_daily_data_bulk(self.daily_df)
+        self.shares_df = pd.DataFrame({'ticker': ["CHEAP", "PRICEY", "CHEAP"],
+                                       'effective_date': ["2024-01-01", "2024-01-01", "2024-02-15"],
+                                       'shares': [1e9, 2e6, 2e9]})
+
+    def tearDown(self):
+        self.db_manager.close()
+
+    def test_as_of_join_matches_per_row_lookup(self):
+        from market_caps import apply_shares_outstanding
+        shares_df = self.shares_df[self.shares_df['effective_date'] > "2024-01-01"]
+        result = apply_shares_outstanding(self.daily_df, shares_df)
+        for row, cap in zip(self.daily_df.itertuples(), result['market_cap']):
+            records = shares_df[(shares_df['ticker'] == row.ticker) & (shares_df['effective_date'] <= row.date)]
+            expected = row.closing_price * records['shares'].iloc[-1] if len(records) else row.market_cap
+            self.assertEqual(cap, expected)
+
+    def test_revised_shares_recompute_history(self):
+        from market_caps import recompute_market_caps
+        revised = self.db_manager.upsert_shares_outstanding(self.shares_df)
+        self.assertEqual(revised, {"CHEAP": "2024-01-01", "PRICEY": "2024-01-01"})
+        self.assertEqual(recompute_market_caps(self.db_manager, revised), len(self.daily_df))
+        self.db_manager.refresh_index_tables()
+        # Ranked by shares-based market cap rather than by price.
+        self.assertEqual(self.db_manager.query_index_constituents("2024-03-01")['ticker'].tolist(), ["CHEAP", "PRICEY"])
+
+        # A revision rewrites only the rows from its effective date to the next record.
+        revision = pd.DataFrame({'ticker': ["CHEAP", "PRICEY"], 'effective_date': ["2024-02-01", "2024-01-01"],
+                                 'shares': [3e9, 2e6]})
+        revised = self.db_manager.upsert_shares_outstanding(revision)
+        self.assertEqual(revised, {"CHEAP": "2024-02-01"})
+        updated = recompute_market_caps(self.db_manager, revised)
+        self.assertEqual(updated, len(pd.bdate_range("2024-02-01", "2024-02-14")))
+        self.assertEqual(self.db_manager.query_top_stocks("2024-02-05")['market_cap'].iloc[0], 3e10)
+        self.assertEqual(self.db_manager.refresh_index_tables(), updated)
+
+    def test_daily_data_since_reads_each_ticker_from_its_date(self):
+        from parquet_storage import ParquetStorageManager
+        starts = {"CHEAP": "2024-03-27", "PRICEY": "2024-03-28", "NONE": "2024-01-01"}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            parquet = ParquetStorageManager(root_dir=tmp_dir)
+            parquet.insert_daily_data_bulk(self.daily_df)
+            for storage in (self.db_manager, parquet):
+                df = storage.query_daily_data_since(starts)
+                self.assertEqual(list(zip(df['date'], df['ticker'])),
+                                 [("2024-03-27", "CHEAP"), ("2024-03-28", "CHEAP"), ("2024-03-28", "PRICEY"),
+                                  ("2024-03-29", "CHEAP"), ("2024-03-29", "PRICEY")])
+                self.assertTrue(storage.query_daily_data_since({}).empty)
+
+    def test_ingestion_uses_shares_outstanding(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            run_data_ingestion(backfill_days=30, provider=FakeDataProvider(), db_path=os.path.join(tmp_dir, "caps.db"))
+            db_manager = DatabaseManager(db_path=os.path.join(tmp_dir, "caps.db"))
+            daily = db_manager.query_daily_data_range("2000-01-01", "2100-01-01")
+            shares = db_manager.query_shares_outstanding()
+            db_manager.close()
+        merged = daily.merge(shares, on='ticker')
+        merged = merged[merged['effective_date'] <= merged['date']].sort_values('effective_date').groupby(
+            ['date', 'ticker']).last()
+        self.assertEqual(len(merged), len(daily))
+        np.testing.assert_allclose(merged['market_cap'], merged['closing_price'] * merged['shares'])
+
+
+class ProviderCrash(BaseException):
+    """
+    Simulates the process dying; DataFetcher only retries Exception subclasses.
+    """
+
+
+class TestStreamingIngestion(unittest.TestCase):
+    def test_background_iterator_is_bounded_and_propagates_errors(self):
+        from streaming import iter_in_background
+        produced = []
+
+        def numbers():
+            for i in range(100):
+                produced.append(i)
+                yield i
+
+        consumed = []
+        for i in iter_in_background(numbers(), maxsize=2):
+            consumed.append(i)
+            # The producer is never more than the queue plus one item ahead.
+            self.assertLessEqual(len(produced) - len(consumed), 3)
+        self.assertEqual(consumed, list(range(100)))
+
+        def failing():
+            yield 1
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            list(iter_in_background(failing()))
+
+    def test_crashed_run_resumes_from_committed_chunks(self):
+        from constants import top_200_us_stock_tickers
+        tickers = list(dict.fromkeys(top_200_us_stock_tickers))
+        crash_at = tickers[100]
+
+        class CrashingProvider(RecordingProvider):
+            def download(self, chunk, start_date, end_date):
+                if chunk[0] == crash_at:
+                    raise ProviderCrash()
+                return super().download(chunk, start_date, end_date)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "resume.db")
+            with self.assertRaises(ProviderCrash):
+                run_data_ingestion(backfill_days=30, provider=CrashingProvider(), db_path=db_path)
+            db_manager = DatabaseManager(db_path=db_path)
+            self.assertEqual(set(db_manager.query_ingestion_coverage()['ticker']), set(tickers[:100]))
+            db_manager.close()
+
+            provider = RecordingProvider()
+            summary = run_data_ingestion(backfill_days=30, provider=provider, db_path=db_path)
+            self.assertEqual({ticker for chunk, _, _ in provider.requests for ticker in chunk}, set(tickers[100:]))
+            self.assertEqual(summary['counters']['ingestion_chunks_total'], 2)
+
+            run_data_ingestion(backfill_days=30, provider=RecordingProvider(), db_path=os.path.join(tmp_dir, "full.db"))
+            frames = []
+            for name in ("resume.db", "full.db"):
+                db_manager = DatabaseManager(db_path=os.path.join(tmp_dir, name))
+                frames.append(db_manager.query_daily_data_range("2000-01-01", "2100-01-01"))
+                db_manager.close()
+            pd.testing.assert_frame_equal(frames[0], frames[1])
+
+
+class TestDashboard(unittest.TestCase):
+    def test_dashboard_renders_from_cache(self):
+        # The dashboard renders and a rerun with unchanged data is served without errors.
+        from streamlit.testing.v1 import AppTest
+        from benchmark import generate_synthetic_market
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "data.db")
+            db_manager = DatabaseManager(db_path=db_path)
+            start = (datetime.date.today() - datetime.timedelta(days=40)).strftime('%Y-%m-%d')
+            db_manager.insert_daily_data_bulk(generate_synthetic_market(n_tickers=110, n_days=30, start_date=start))
+            # The dashboard only reads; the tables are materialized by ingestion.
+            from index_analytics import update_index_analytics
+            db_manager.refresh_index_tables()
+            update_index_analytics(db_manager)
+            db_manager.close()
+            os.environ["HEDGINEER_STORAGE_PATH"] = db_path
+            try:
+                app = AppTest.from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), "dashboard.py"),
+                                        default_timeout=60)
+                app.run()
+                self.assertFalse(app.exception)
+                self.assertIn("Summary Metrics", [header.value for header in app.subheader])
+                app.run()
+                self.assertFalse(app.exception)
+            finally:
+                del os.environ["HEDGINEER_STORAGE_PATH"]
+
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+
+@unittest.skipUnless(HAS_PYARROW, "pyarrow is required for the parquet backend")
+class TestParquetStorage(unittest.TestCase):
+    def setUp(self):
+        from benchmark import generate_synthetic_market
+        from parquet_storage import ParquetStorageManager
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        # Seed 2 has the top 100 change several times over the 40 days, which exercises rebalance events.
+        self.market_df = generate_synthetic_market(n_tickers=120, n_days=40, start_date="2023-01-02", seed=2)
+        self.sqlite = DatabaseManager()
+        self.sqlite.insert_daily_data_bulk(self.market_df)
+        self.parquet = ParquetStorageManager(root_dir=os.path.join(self.tmp_dir.name, "store"))
+        self.parquet.insert_daily_data_bulk(self.market_df, batch_size=100)
+
+    def tearDown(self):
+        self.sqlite.close()
+        self.tmp_dir.cleanup()
+
+    def test_reads_match_sqlite(self):
+        # Both backends rank the same constituents and compute the same index history.
+        expected = self.sqlite.query_top_stocks_range("2023-01-02", "2023-01-06")
+        actual = self.parquet.query_top_stocks_range("2023-01-02", "2023-01-06")
+        pd.testing.assert_frame_equal(actual.reset_index(drop=True), expected, check_dtype=False)
+        sqlite_history = calculate_index_for_date_range(self.sqlite, "2023-01-02", "2023-01-06")
+        parquet_history = calculate_index_for_date_range(self.parquet, "2023-01-02", "2023-01-06")
+        for expected_value, actual_value in zip(sqlite_history['index_value'], parquet_history['index_value']):
+            self.assertAlmostEqual(actual_value, expected_value, places=9)
+        self.assertEqual(self.parquet.query_date_bounds(), ("2023-01-02", "2023-02-24"))
+        # Rebalance events are persisted identically by both backends.
+        self.sqlite.refresh_index_tables()
+        self.parquet.refresh_index_tables()
+        sqlite_events = self.sqlite.query_rebalance_events("2023-01-02", "2023-02-24")
+        parquet_events = self.parquet.query_rebalance_events("2023-01-02", "2023-02-24")
+        self.assertFalse(sqlite_events.empty)
+        self.assertEqual(sorted(map(tuple, sqlite_events.to_numpy().tolist())),
+                         sorted(map(tuple, parquet_events.to_numpy().tolist())))
+        # Chunked composition reads agree as well.
+        sqlite_chunks = pd.concat(self.sqlite.iter_index_composition("2023-01-02", "2023-01-31", chunksize=300))
+        parquet_chunks = list(self.parquet.iter_index_composition("2023-01-02", "2023-01-31", chunksize=300))
+        self.assertGreater(len(parquet_chunks), 1)
+        pd.testing.assert_frame_equal(pd.concat(parquet_chunks, ignore_index=True),
+                                      sqlite_chunks.reset_index(drop=True), check_dtype=False)
+
+    def test_quality_checks_match_sqlite(self):
+        from data_quality import run_quality_checks
+        bad_row = pd.DataFrame({'date': ["2023-01-16"], 'ticker': ["SYN00003"], 'closing_price': [1e6],
+                                'market_cap': [1e6]})
+        results = []
+        for storage in (self.sqlite, self.parquet):
+            storage.refresh_index_tables()
+            run_quality_checks(storage)
+            storage.insert_daily_data_bulk(bad_row)
+            self.assertEqual(storage.query_quality_dirty_dates(), ["2023-01-16"])
+            run_quality_checks(storage)
+            self.assertEqual(storage.query_quality_dirty_dates(), [])
+            results.append(storage.query_quality_issues())
+        self.assertFalse(results[0].empty)
+        pd.testing.assert_frame_equal(results[1], results[0], check_dtype=False)
+
+    def test_index_analytics_match_sqlite(self):
+        from index_analytics import update_index_analytics
+        for storage in (self.sqlite, self.parquet):
+            storage.refresh_index_tables()
+            update_index_analytics(storage)
+        expected = self.sqlite.query_index_analytics()
+        self.assertEqual(len(expected), 40)
+        pd.testing.assert_frame_equal(self.parquet.query_index_analytics(), expected, check_dtype=False)
+
+    def test_index_analytics_are_appended_as_segments(self):
+        from index_analytics import update_index_analytics
+        from parquet_storage import ParquetStorageManager
+        dates = sorted(self.market_df['date'].unique())
+        for storage in (self.sqlite, self.parquet):
+            storage.refresh_index_tables()
+            update_index_analytics(storage)
+        segments_dir = os.path.join(self.parquet.root_dir, "index_analytics")
+        # A daily append writes only its own row as a new segment; refreshes keep the segments few.
+        for date in dates[-5:]:
+            day = self.market_df[self.market_df['date'] == date]
+            next_day = day.assign(date=(pd.Timestamp(date) + pd.Timedelta(days=28)).strftime('%Y-%m-%d'))
+            for storage in (self.sqlite, self.parquet):
+                storage.insert_daily_data_bulk(next_day)
+                storage.refresh_index_tables()
+            update_index_analytics(self.sqlite)
+            with mock.patch.object(self.parquet, "_write_file", wraps=self.parquet._write_file) as write:
+                self.assertEqual(update_index_analytics(self.parquet), 1)
+            self.assertEqual([len(call.args[0]) for call in write.call_args_list], [1])
+        self.assertLessEqual(len(os.listdir(segments_dir)), 4)
+        pd.testing.assert_frame_equal(self.parquet.query_index_analytics(), self.sqlite.query_index_analytics(),
+                                      check_dtype=False)
+        # A revised date drops the analytics from that date on, which are then recomputed.
+        revised = self.market_df[self.market_df['date'] == dates[20]].assign(closing_price=lambda df: df['closing_price'] * 1.1)
+        for storage in (self.sqlite, self.parquet):
+            storage.insert_daily_data_bulk(revised)
+            storage.refresh_index_tables()
+        self.assertEqual(self.parquet.query_index_analytics()['date'].max(), dates[19])
+        for storage in (self.sqlite, self.parquet):
+            update_index_analytics(storage)
+        expected = self.sqlite.query_index_analytics()
+        pd.testing.assert_frame_equal(self.parquet.query_index_analytics(), expected, check_dtype=False)
+        pd.testing.assert_frame_equal(self.parquet.query_index_analytics(dates[10], dates[30]),
+                                      expected[expected['date'].between(dates[10], dates[30])].reset_index(drop=True),
+                                      check_dtype=False)
+        # A store that kept the analytics in one file is read through a single segment.
+        legacy = os.path.join(self.parquet.root_dir, "index_analytics.parquet")
+        self.parquet._write_file(expected, legacy)
+        for name in os.listdir(segments_dir):
+            os.remove(os.path.join(segments_dir, name))
+        reopened = ParquetStorageManager(root_dir=self.parquet.root_dir)
+        self.assertFalse(os.path.exists(legacy))
+        pd.testing.assert_frame_equal(reopened.query_index_analytics(), expected, check_dtype=False)
+
+    def test_unchanged_rows_are_not_dirty(self):
+        # Rewriting identical rows marks no date and leaves the data version alone, as in SQLite.
+        self.parquet.refresh_index_tables()
+        version = self.parquet.get_data_version()
+        self.parquet.insert_daily_data_bulk(self.market_df.iloc[:500], batch_size=100)
+        self.assertEqual((self.parquet.get_data_version(), self.parquet._load_dirty_dates()), (version, set()))
+        changed = self.market_df.iloc[[0]].assign(closing_price=1.0)
+        self.assertEqual(self.parquet.insert_daily_data_bulk(pd.concat([self.market_df.iloc[:3], changed]))['rows'], 4)
+        self.assertEqual(self.parquet._load_dirty_dates(), {changed['date'].iloc[0]})
+        self.assertGreater(self.parquet.get_data_version(), version)
+        self.assertEqual([name for name in os.listdir(self.parquet.root_dir) if name.endswith(".tmp")], [])
+
+    def test_chunked_writes_add_parts_until_compacted(self):
+        # Each write adds one part file per changed partition; reads see the latest row per ticker.
+        from parquet_storage import ParquetStorageManager
+        storage = ParquetStorageManager(root_dir=os.path.join(self.tmp_dir.name, "parts"))
+        first_day = self.market_df[self.market_df['date'] == "2023-01-02"]
+        for offset in range(0, len(first_day), 10):
+            storage.insert_daily_data_bulk(first_day.iloc[offset:offset + 10])
+        expected = first_day.assign(closing_price=np.arange(len(first_day), dtype=float))
+        storage.insert_daily_data_bulk(expected.iloc[:60])
+        storage.insert_daily_data_bulk(expected.iloc[60:])
+        self.assertEqual(len(storage._partition_parts("2023-01-02")), 14)
+        stored = storage.query_daily_data_range("2023-01-02", "2023-01-02").sort_values('ticker')
+        self.assertEqual(stored['closing_price'].tolist(), expected.sort_values('ticker')['closing_price'].tolist())
+        # The 16th part compacts the partition into one file.
+        storage.insert_daily_data_bulk(expected.iloc[:1].assign(market_cap=7.0))
+        storage.insert_daily_data_bulk(expected.iloc[:1])
+        self.assertEqual(len(storage._partition_parts("2023-01-02")), 1)
+        # So does the index refresh, for every changed partition.
+        storage.insert_daily_data_bulk(expected.iloc[:1].assign(market_cap=7.0))
+        storage.refresh_index_tables()
+        self.assertEqual(len(storage._partition_parts("2023-01-02")), 1)
+        stored = storage.query_daily_data_range("2023-01-02", "2023-01-02").sort_values('ticker')
+        self.assertEqual(len(stored), len(first_day))
+        self.assertEqual(stored['closing_price'].tolist(), expected.sort_values('ticker')['closing_price'].tolist())
+
+    def test_migrate_sqlite_database(self):
+        # The migration tool converts an SQLite file into an equivalent Parquet store.
+        from parquet_storage import ParquetStorageManager, migrate_sqlite_to_parquet
+        db_path = os.path.join(self.tmp_dir.name, "source.db")
+        source = DatabaseManager(db_path=db_path)
+        source.insert_daily_data_bulk(self.market_df)
+        source.close()
+        root_dir = os.path.join(self.tmp_dir.name, "migrated")
+        self.assertEqual(migrate_sqlite_to_parquet(db_path, root_dir, chunksize=250), len(self.market_df))
+        migrated = ParquetStorageManager(root_dir=root_dir)
+        top_df = migrated.query_top_stocks("2023-01-04", limit=5)
+        expected = self.sqlite.query_top_stocks("2023-01-04", limit=5)
+        self.assertEqual(list(top_df['ticker']), list(expected['ticker']))
+        self.assertEqual(len(migrated.query_index_constituents("2023-01-04")), 100)
+
+
+class TestCompactReads(unittest.TestCase):
+    def setUp(self):
+        from benchmark import generate_synthetic_market
+        from parquet_storage import ParquetStorageManager
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        market_df = generate_synthetic_market(n_tickers=30, n_days=20, start_date="2023-01-02", seed=3)
+        # A ticker missing on some dates leaves gaps in the matrices.
+        market_df = market_df[~((market_df['ticker'] == "SYN00007") & (market_df['date'] < "2023-01-10"))]
+        self.storages = [DatabaseManager(),
+                         ParquetStorageManager(root_dir=os.path.join(self.tmp_dir.name, "store"))]
+        for storage in self.storages:
+            storage.insert_daily_data_bulk(market_df)
+
+    def tearDown(self):
+        self.storages[0].close()
+        self.tmp_dir.cleanup()
+
+    def test_compact_read_matches_string_read(self):
+        for storage in self.storages:
+            expected = storage.query_daily_data_range("2023-01-02", "2023-01-27")
+            compact = storage.query_daily_data_range("2023-01-02", "2023-01-27", compact=True)
+            self.assertIsInstance(compact['ticker'].dtype, pd.CategoricalDtype)
+            self.assertTrue(pd.api.types.is_datetime64_any_dtype(compact['date']))
+            self.assertEqual(list(compact['ticker'].astype(str)), list(expected['ticker']))
+            self.assertEqual(list(compact['date'].dt.strftime('%Y-%m-%d')), list(expected['date']))
+            np.testing.assert_array_equal(compact['closing_price'], expected['closing_price'])
+            np.testing.assert_array_equal(compact['market_cap'], expected['market_cap'])
+            # Chunked iteration returns the same rows with float32 prices and int32 dates.
+            chunks = list(storage.iter_daily_data("2023-01-02", "2023-01-27", chunksize=100, float32=True,
+                                                  date_ids=True))
+            self.assertGreater(len(chunks), 1)
+            joined = pd.concat(chunks, ignore_index=True)
+            self.assertEqual(joined['closing_price'].dtype, np.float32)
+            self.assertEqual(joined['date'].dtype, np.int32)
+            self.assertEqual(joined['date'].iloc[0], 20230102)
+            np.testing.assert_allclose(joined['closing_price'], expected['closing_price'], rtol=1e-6)
+            self.assertLess(compact.memory_usage(deep=True).sum(), expected.memory_usage(deep=True).sum())
+            empty = storage.query_daily_data_range("2030-01-01", "2030-01-31", compact=True, float32=True)
+            self.assertTrue(empty.empty)
+            self.assertEqual(empty['closing_price'].dtype, np.float32)
+
+    def test_load_market_matrices_matches_pivot(self):
+        from index_engine import load_market_matrices
+        for storage in self.storages:
+            expected = build_market_matrices(storage.query_daily_data_range("2023-01-02", "2023-01-27"))
+            actual = load_market_matrices(storage, "2023-01-02", "2023-01-27", chunksize=50)
+            for actual_matrix, expected_matrix in zip(actual, expected):
+                pd.testing.assert_frame_equal(actual_matrix, expected_matrix)
+            self.assertTrue(np.isnan(actual[0].loc["2023-01-03", "SYN00007"]))
+
+
+class TestConnectionLayer(unittest.TestCase):
+    def setUp(self):
+        from benchmark import iter_synthetic_market
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_manager = DatabaseManager(db_path=os.path.join(self.tmp_dir.name, "data.db"), readers=2)
+        self.chunks = list(iter_synthetic_market(n_tickers=50, n_days=40, start_date="2023-01-02", chunk_days=5))
+
+    def tearDown(self):
+        self.db_manager.close()
+        self.tmp_dir.cleanup()
+
+    def count_rows(self, conn):
+        return conn.execute("SELECT COUNT(*) FROM daily_prices").fetchone()[0]
+
+    def test_readers_run_during_writes(self):
+        # Readers on other threads see only committed batches and a stable snapshot per block.
+        import threading
+        errors, seen = [], []
+
+        def read():
+            try:
+                while not done.is_set():
+                    with self.db_manager.reader() as conn:
+                        before = self.count_rows(conn)
+                        self.db_manager.query_date_bounds()
+                        self.assertEqual(self.count_rows(conn), before)
+                    seen.append(before)
+            except Exception as e:
+                errors.append(e)
+
+        done = threading.Event()
+        threads = [threading.Thread(target=read) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for chunk in self.chunks:
+            self.db_manager.insert_daily_data_bulk(chunk)
+        done.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertTrue(all(count % 250 == 0 for count in seen))
+        with self.db_manager.reader() as conn:
+            self.assertEqual(self.count_rows(conn), 2000)
+            self.assertEqual(conn.execute("PRAGMA mmap_size").fetchone()[0], 268435456)
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_transaction_commits_or_rolls_back(self):
+        self.db_manager.insert_daily_data_bulk(self.chunks[0])
+        with self.assertRaises(RuntimeError):
+            with self.db_manager.transaction() as conn:
+                conn.execute("DELETE FROM daily_prices")
+                # Reads inside the transaction see its uncommitted writes.
+                self.assertEqual(self.db_manager.query_date_bounds(), (None, None))
+                raise RuntimeError("abort")
+        self.assertEqual(self.db_manager.query_date_bounds(), ("2023-01-02", "2023-01-06"))
+
+    def test_reader_pool_is_bounded(self):
+        import threading
+        borrowed, release = threading.Barrier(3), threading.Event()
+
+        def hold():
+            with self.db_manager.reader():
+                borrowed.wait()
+                release.wait()
+
+        threads = [threading.Thread(target=hold) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        borrowed.wait()
+        with self.assertRaises(TimeoutError):
+            with self.db_manager.reader(timeout=0.1):
+                pass
+        release.set()
+        for thread in threads:
+            thread.join()
+        with self.db_manager.reader(timeout=0.1) as conn:
+            self.assertEqual(self.count_rows(conn), 0)
+
+
+class TestDataQuality(unittest.TestCase):
+    def setUp(self):
+        from benchmark import generate_synthetic_market
+        self.market_df = generate_synthetic_market(n_tickers=110, n_days=80, start_date="2023-01-02")
+        self.dates = sorted(self.market_df['date'].unique())
+
+    def test_checks_find_injected_issues(self):
+        from data_quality import check_daily_data
+        self.assertTrue(check_daily_data(self.market_df).empty)
+        df = self.market_df[self.market_df['date'] <= self.dates[11]].copy()
+        d = self.dates
+        df = df[~((df['ticker'] == "SYN00001") & (df['date'] == d[3]))]
+        stale = (df['ticker'] == "SYN00002") & (df['date'] >= d[4]) & (df['date'] <= d[9])
+        df.loc[stale, 'closing_price'] = df.loc[(df['ticker'] == "SYN00002") & (df['date'] == d[4]), 'closing_price'].iloc[0]
+        df.loc[(df['ticker'] == "SYN00003") & (df['date'] == d[6]), 'closing_price'] *= 2
+        copied = df.loc[df['ticker'] == "SYN00005", ['closing_price', 'market_cap']].to_numpy()
+        df.loc[df['ticker'] == "SYN00004", ['closing_price', 'market_cap']] = copied
+        df = df[~((df['date'] == d[11]) & df['ticker'].isin([f"SYN{i:05d}" for i in range(95, 110)]))]
+
+        issues = check_daily_data(df)
+        expected = {(d[3], "SYN00001", "missing_day"), (d[8], "SYN00002", "stale_price"),
+                    (d[9], "SYN00002", "stale_price"), (d[6], "SYN00003", "outlier_return"),
+                    (d[7], "SYN00003", "outlier_return"), (d[11], None, "thin_universe")}
+        expected |= {(date, ticker, "duplicate_price") for date in d[:12] for ticker in ("SYN00004", "SYN00005")}
+        # The tickers left out of the last date stopped reporting.
+        expected |= {(d[11], f"SYN{i:05d}", "missing_day") for i in range(95, 110)}
+        self.assertEqual(set(issues[['date', 'ticker', 'check']].itertuples(index=False, name=None)), expected)
+        values = {(date, check): value for date, _, check, value in issues.itertuples(index=False, name=None)}
+        self.assertEqual(values[(d[11], "thin_universe")], 95)
+        self.assertEqual(values[(d[9], "stale_price")], 6)
+        self.assertAlmostEqual(values[(d[7], "outlier_return")], -0.5, delta=0.05)
+
+        # A ticker missing on the last 3 days of the block is flagged on each of them.
+        df = self.market_df[self.market_df['date'] <= d[11]]
+        issues = check_daily_data(df[~((df['ticker'] == "SYN00006") & (df['date'] >= d[9]))], min_universe=0)
+        self.assertEqual(list(issues[['date', 'ticker', 'check', 'value']].itertuples(index=False, name=None)),
+                         [(date, "SYN00006", "missing_day", 3.0) for date in d[9:12]])
+
+    def test_incremental_checks_are_persisted(self):
+        from data_quality import run_quality_checks
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_manager = DatabaseManager(db_path=os.path.join(tmp_dir, "quality.db"))
+            db_manager.insert_daily_data_bulk(self.market_df)
+            db_manager.refresh_index_tables()
+            first = run_quality_checks(db_manager)
+            self.assertEqual(first['rows_checked'], len(self.market_df))
+            self.assertEqual(sum(first['issues'].values()), 0)
+            self.assertEqual(db_manager.query_quality_dirty_dates(), [])
+            self.assertEqual(run_quality_checks(db_manager)['rows_checked'], 0)
+
+            # A bad print is found by checking only the dates around it, and cleared once corrected.
+            date = self.dates[60]
+            row = self.market_df[(self.market_df['date'] == date) & (self.market_df['ticker'] == "SYN00007")]
+            db_manager.insert_daily_data(date, "SYN00007", row['closing_price'].iloc[0] * 10, row['market_cap'].iloc[0])
+            db_manager.refresh_index_tables()
+            second = run_quality_checks(db_manager)
+            self.assertLess(second['rows_checked'], len(self.market_df) / 2)
+            self.assertEqual(second['issues']['outlier_return'], 2)
+            issues = db_manager.query_quality_issues(checks=["outlier_return"])
+            self.assertEqual(list(issues['ticker']), ["SYN00007", "SYN00007"])
+            self.assertEqual(issues['date'].iloc[0], date)
+            db_manager.insert_daily_data_bulk(row)
+            run_quality_checks(db_manager)
+            self.assertTrue(db_manager.query_quality_issues().empty)
+            db_manager.close()
+
+    def test_incremental_checks_read_whole_stale_runs(self):
+        from data_quality import run_quality_checks
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_manager = DatabaseManager(db_path=os.path.join(tmp_dir, "quality.db"))
+            df = self.market_df.copy()
+            held = (df['ticker'] == "SYN00002") & df['date'].between(self.dates[20], self.dates[59])
+            price = df.loc[held, 'closing_price'].iloc[0]
+            df.loc[held, 'closing_price'] = price
+            db_manager.insert_daily_data_bulk(df)
+            db_manager.refresh_index_tables()
+            run_quality_checks(db_manager, stale_days=30)
+            # Only the next date changes, yet the run of 41 rows spans more than 21 calendar days.
+            row = df[(df['date'] == self.dates[60]) & (df['ticker'] == "SYN00002")].copy()
+            row['closing_price'] = price
+            db_manager.insert_daily_data_bulk(row)
+            db_manager.refresh_index_tables()
+            self.assertEqual(db_manager.query_quality_dirty_dates(), [self.dates[60]])
+            run_quality_checks(db_manager, stale_days=30)
+            issues = db_manager.query_quality_issues(checks=["stale_price"])
+            self.assertEqual(issues['date'].iloc[-1], self.dates[60])
+            self.assertEqual(issues['value'].iloc[-1], 41)
+            db_manager.close()
+
+
+class TestIndexAnalytics(unittest.TestCase):
+    def setUp(self):
+        from benchmark import generate_synthetic_market
+        self.market_df = generate_synthetic_market(n_tickers=120, n_days=60, start_date="2023-01-02", seed=2)
+        self.dates = sorted(self.market_df['date'].unique())
+
+    def _full_analytics(self, market_df):
+        from index_analytics import update_index_analytics
+        db_manager = DatabaseManager()
+        db_manager.insert_daily_data_bulk(market_df)
+        db_manager.refresh_index_tables()
+        update_index_analytics(db_manager)
+        analytics = db_manager.query_index_analytics()
+        db_manager.close()
+        return analytics
+
+    def test_daily_updates_match_full_computation(self):
+        from index_analytics import update_index_analytics
+        db_manager = DatabaseManager()
+        db_manager.insert_daily_data_bulk(self.market_df[self.market_df['date'] <= self.dates[39]])
+        db_manager.refresh_index_tables()
+        self.assertEqual(update_index_analytics(db_manager), 40)
+        for date in self.dates[40:]:
+            db_manager.insert_daily_data_bulk(self.market_df[self.market_df['date'] == date])
+            db_manager.refresh_index_tables()
+            self.assertEqual(update_index_analytics(db_manager), 1)
+        self.assertEqual(update_index_analytics(db_manager), 0)
+        pd.testing.assert_frame_equal(db_manager.query_index_analytics(), self._full_analytics(self.market_df),
+                                      check_dtype=False)
+
+        # A revised price drops and rebuilds the analytics from its date onwards only.
+        revised = self.market_df.copy()
+        row = (revised['date'] == self.dates[30]) & (revised['ticker'] == "SYN00007")
+        revised.loc[row, 'closing_price'] *= 2
+        db_manager.insert_daily_data_bulk(revised[row])
+        db_manager.refresh_index_tables()
+        self.assertEqual(len(db_manager.query_index_analytics()), 30)
+        self.assertEqual(update_index_analytics(db_manager), 30)
+        pd.testing.assert_frame_equal(db_manager.query_index_analytics(), self._full_analytics(revised),
+                                      check_dtype=False)
+        db_manager.close()
+
+    def test_horizon_summary_matches_direct_computation(self):
+        from index_analytics import summarize_horizon
+        analytics = self._full_analytics(self.market_df)
+        horizon = analytics.iloc[10:50]
+        summary = summarize_horizon(horizon)
+        values = horizon['index_value'].to_numpy()
+        returns = values[1:] / values[:-1] - 1
+        active = returns - horizon['market_return'].to_numpy()[1:]
+        self.assertEqual(summary['days'], 39)
+        self.assertAlmostEqual(summary['total_return'], values[-1] / values[0] - 1, places=12)
+        self.assertAlmostEqual(summary['volatility'], returns.std(ddof=1) * np.sqrt(252), places=12)
+        self.assertAlmostEqual(summary['max_drawdown'], np.min(values / np.maximum.accumulate(values) - 1), places=12)
+        self.assertAlmostEqual(summary['average_turnover'], horizon['turnover'].iloc[1:].mean(), places=12)
+        self.assertAlmostEqual(summary['market_return'], np.prod(1 + horizon['market_return'].iloc[1:]) - 1, places=12)
+        self.assertAlmostEqual(summary['tracking_error'], active.std(ddof=1) * np.sqrt(252), places=12)
+        # The stored rolling volatility is the annualized deviation of the last 21 returns.
+        all_returns = analytics['index_value'].pct_change()
+        rolling = all_returns.rolling(21).std() * np.sqrt(252)
+        np.testing.assert_allclose(analytics['volatility'].iloc[21:], rolling.iloc[21:], rtol=1e-9)
+        self.assertTrue(analytics['volatility'].iloc[:21].isna().all())
+        self.assertIsNone(summarize_horizon(analytics.iloc[:1]))
+
+
+class TestCLI(unittest.TestCase):
+    def test_commands_run_single_steps(self):
+        from benchmark import generate_synthetic_market
+        from cli import main
+        market_df = generate_synthetic_market(n_tickers=110, n_days=30, start_date="2023-01-02")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "cli.db")
+            db_manager = DatabaseManager(db_path=db_path)
+            db_manager.insert_daily_data_bulk(market_df)
+            db_manager.close()
+            self.assertEqual(main(["compute", "--db_path", db_path]), 0)
+            out_dir = os.path.join(tmp_dir, "out")
+            self.assertEqual(main(["export", "--db_path", db_path, "--start", "2023-01-02", "--end", "2023-02-10",
+                                   "--output_dir", out_dir]), 0)
+            self.assertEqual(sorted(os.listdir(out_dir)),
+                             ["index_analytics.xlsx", "index_composition.csv", "index_history.pdf",
+                              "index_history.xlsx", "index_rebalances.xlsx"])
+            self.assertEqual(main(["validate", "--db_path", db_path, "--show", "0"]), 0)
+            self.assertEqual(main(["live", "--db_path", db_path, "--batches", "50", "--batch_size", "10"]), 0)
+            db_manager = DatabaseManager(db_path=db_path)
+            self.assertEqual(len(db_manager.query_index_analytics()), 30)
+            self.assertEqual(len(db_manager.query_intraday_index_values()), 50)
+            self.assertEqual(db_manager.query_quality_dirty_dates(), [])
+            db_manager.close()
+            with self.assertRaises(SystemExit):
+                main(["compute", "--unknown"])
+            with self.assertRaises(SystemExit):
+                main(["live", "--db_path", db_path, "--top_n", "0"])
+            for rebalance in ("0", "X"):
+                with self.assertRaises(SystemExit):
+                    main(["sweep", "--db_path", db_path, "--rebalance", rebalance])
+
+    def test_live_reports_missing_value(self):
+        import io
+        from cli import main
+        stats = {'quotes': 0, 'batches': 0, 'seconds': 0.0, 'quotes_per_sec': None, 'membership_changes': 0,
+                 'snapshots_written': 0, 'flushes': 0, 'value': None}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            db_path = os.path.join(tmp_dir, "cli.db")
+            db_manager = DatabaseManager(db_path=db_path)
+            db_manager.insert_daily_data_bulk(pd.DataFrame({
+                'date': ["2023-01-02"], 'ticker': ["AAA"], 'closing_price': [10.0], 'market_cap': [1e9]}))
+            db_manager.close()
+            with mock.patch("live_index.run_live_index", return_value=stats), \
+                    mock.patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                self.assertEqual(main(["live", "--db_path", db_path, "--batches", "1"]), 0)
+        self.assertIn("Last value: n/a.", stdout.getvalue())
+
+    def test_parsing_does_not_import_dependencies(self):
+        import subprocess
+        import sys
+        probe = ("import sys, cli; cli.build_parser().parse_args(['compute']); "
+                 "print(sorted({'pandas', 'numpy', 'yfinance', 'openpyxl'} & set(sys.modules)))")
+        result = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(result.stdout.strip(), "[]")
+
+
+class TestLiveIndex(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        tickers = [f"T{i:03d}" for i in range(300)]
+        self.prices = dict(zip(tickers, rng.uniform(10, 500, len(tickers))))
+        self.shares = dict(zip(tickers, rng.uniform(1e7, 1e10, len(tickers))))
+
+    def test_matches_full_recompute(self):
+        from live_index import LiveIndex, simulated_quotes
+        live = LiveIndex(self.shares, self.prices, top_n=20)
+        feed = simulated_quotes(dict(self.prices), 600, batch_size=5, volatility=0.05, seed=1)
+        for i, (_, batch) in enumerate(feed):
+            value = live.update_many(batch) if i % 2 else live.update(*batch[0])
+            ranked = sorted(live.prices, key=lambda t: live.prices[t] * live.shares[t], reverse=True)[:20]
+            self.assertEqual(live.members, set(ranked))
+            self.assertAlmostEqual(value, np.mean([live.prices[t] for t in ranked]), places=9)
+        self.assertGreater(live.membership_changes, 0)
+        # Superseded heap entries are bounded by the rebuilds.
+        self.assertLessEqual(len(live._members_heap) + len(live._others_heap), 2 * len(live.prices) + 64)
+        # Unknown tickers and invalid prices are ignored.
+        quotes = live.quotes
+        self.assertEqual(live.update_many([("UNKNOWN", 10.0), ("T001", float("nan")), ("T002", 0.0)]), value)
+        self.assertEqual(live.quotes, quotes)
+        self.assertEqual(list(live.constituents()['ticker']), ranked)
+
+    def test_snapshots_flushed_in_batches(self):
+        from benchmark import generate_synthetic_market
+        from live_index import LiveIndex, SnapshotWriter, run_live_index, simulated_quotes
+        from parquet_storage import ParquetStorageManager
+        market_df = generate_synthetic_market(n_tickers=120, n_days=5, start_date="2023-01-02", seed=2)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for storage in (DatabaseManager(), ParquetStorageManager(root_dir=os.path.join(tmp_dir, "store"))):
+                storage.insert_daily_data_bulk(market_df)
+                storage.refresh_index_tables()
+                live = LiveIndex.from_storage(storage)
+                # The starting value is the end-of-day index value of the latest date.
+                stored = storage.query_index_values("2023-01-06", "2023-01-06")['index_value'].iloc[0]
+                self.assertAlmostEqual(live.value, stored, places=9)
+                writer = SnapshotWriter(storage, flush_rows=25, flush_seconds=3600)
+                feed = simulated_quotes(dict(live.prices), 110, batch_size=10,
+                                        start=datetime.datetime(2023, 1, 9, 9, 30), seed=3)
+                stats = run_live_index(live, feed, writer)
+                self.assertEqual((stats['quotes'], stats['snapshots_written'], stats['flushes']), (1100, 110, 5))
+                snapshots = storage.query_intraday_index_values()
+                self.assertEqual(len(snapshots), 110)
+                self.assertTrue(snapshots['timestamp'].is_monotonic_increasing)
+                self.assertEqual(snapshots['timestamp'].iloc[0], pd.Timestamp("2023-01-09 09:30"))
+                self.assertAlmostEqual(snapshots['index_value'].iloc[-1], stats['value'], places=9)
+                self.assertEqual(len(storage.query_intraday_index_values(end="2023-01-09 09:30:00.095")), 10)
+
+
+class TestIndexService(unittest.TestCase):
+    def setUp(self):
+        from benchmark import generate_synthetic_market
+        from index_service import IndexService
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "service.db")
+        self.writer = DatabaseManager(db_path=self.db_path, wal=True)
+        self.writer.insert_daily_data_bulk(generate_synthetic_market(n_tickers=120, n_days=20, start_date="2023-01-02"))
+        self.writer.refresh_index_tables()
+        self.service = IndexService(self.db_path, pool_size=2, cache_size=16)
+
+    def tearDown(self):
+        self.service.close()
+        self.writer.close()
+        self.tmp_dir.cleanup()
+
+    def get(self, path, **params):
+        status, _, body = self.service.handle(path, {name: [value] for name, value in params.items()})
+        return status, json.loads(body)
+
+    def test_endpoints_match_database(self):
+        status, body = self.get('/index', start="2023-01-02", end="2023-01-08")
+        self.assertEqual(status, 200)
+        expected = calculate_index_for_date_range(self.writer, "2023-01-02", "2023-01-08")
+        self.assertEqual([row['date'] for row in body['values']], list(expected['date']))
+        for row, value in zip(body['values'], expected['index_value']):
+            self.assertAlmostEqual(row['index_value'], value, places=9)
+        status, body = self.get('/constituents', date="2023-01-04")
+        self.assertEqual(status, 200)
+        self.assertEqual([row['ticker'] for row in body['constituents']],
+                         list(self.writer.query_index_constituents("2023-01-04")['ticker']))
+        self.assertEqual(self.get('/index', start="2023-01-02", end="not-a-date")[0], 400)
+        self.assertEqual(self.get('/index', start="2023-01-08", end="2023-01-02")[0], 400)
+        self.assertEqual(self.get('/index', start="1900-01-01", end="2023-01-02")[0], 400)
+        self.assertEqual(self.get('/missing')[0], 404)
+        # A real HTTP round trip returns the same JSON.
+        import http.client
+        import threading
+        server = self.service.make_server(port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", server.server_address[1])
+            conn.request("GET", "/constituents?date=2023-01-04")
+            response = conn.getresponse()
+            self.assertEqual(response.status, 200)
+            self.assertEqual(json.loads(response.read()), body)
+            conn.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_cache_invalidated_by_ingestion(self):
+        first = self.get('/constituents', date="2023-01-04")[1]
+        self.assertEqual(self.get('/constituents', date="2023-01-04")[1], first)
+        self.assertEqual(self.service.metrics.summary()['counters']['service_cache_total{result="hit"}'], 1)
+        # A write through a separate connection bumps the data version, so the next request misses.
+        self.writer.insert_daily_data_bulk(pd.DataFrame({'date': ["2023-01-04"], 'ticker': ["NEWCO"],
+                                                         'closing_price': [10.0], 'market_cap': [1e15]}))
+        self.writer.refresh_index_tables()
+        updated = self.get('/constituents', date="2023-01-04")[1]
+        self.assertGreater(updated['data_version'], first['data_version'])
+        self.assertEqual(updated['constituents'][0]['ticker'], "NEWCO")
+        self.assertEqual(self.service.metrics.summary()['counters']['service_cache_total{result="miss"}'], 2)
+
+    def test_cache_version_only_moves_forward(self):
+        from index_service import ResponseCache
+        cache = ResponseCache(maxsize=4)
+        self.assertIsNone(cache.get(2, "a"))
+        cache.put(2, "a", b"v2")
+        # A reader on an older snapshot neither clears the cache nor caches its response.
+        self.assertIsNone(cache.get(1, "a"))
+        cache.put(1, "a", b"v1")
+        self.assertEqual(cache.get(2, "a"), b"v2")
+        self.assertIsNone(cache.get(3, "a"))
+        self.assertIsNone(cache.get(2, "a"))
+
+    def test_pool_connections_are_read_only(self):
+        import sqlite3
+        with self.service.db_manager.reader() as conn:
+            with self.assertRaises(sqlite3.OperationalError):
+                conn.execute("INSERT INTO stocks (ticker) VALUES ('NOPE')")
+        with self.assertRaises(sqlite3.OperationalError):
+            self.service.db_manager.insert_stock("NOPE")
+
+
 if __name__ == "__main__":
     # Run the test suite
     unittest.main(argv=['first-arg-is-ignored'], exit=False)
\ No newline at end of file